@@ -102,6 +102,20 @@ st.markdown(
     div.stButton > button[key='Payments']:hover .card-icon {
         color: #ff9a9e;
     }
+
+    div.stButton > button[key='Statements']:hover {
+        box-shadow: 0 0 20px rgba(251,194,235,0.6);
+    }
+    div.stButton > button[key='Statements']:hover .card-icon {
+        color: #fbc2eb;
+    }
+
+    div.stButton > button[key='Trends']:hover {
+        box-shadow: 0 0 20px rgba(150,230,161,0.6);
+    }
+    div.stButton > button[key='Trends']:hover .card-icon {
+        color: #96e6a1;
+    }
     </style>
     <div id="bg"></div>
     """,
@@ -119,6 +133,8 @@ cards = [
     {"icon": "📦", "label": "Products",     "file": "2_📦_Products.py",            "bg": "linear-gradient(135deg,#43e97b,#38f9d7)"},
     {"icon": "💳", "label": "Transactions", "file": "3_💳_Credit_Transactions.py", "bg": "linear-gradient(135deg,#f093fb,#f5576c)"},
     {"icon": "💰", "label": "Payments",     "file": "4_💰_Payments.py",            "bg": "linear-gradient(135deg,#fad0c4,#ff9a9e)"},
+    {"icon": "🧾", "label": "Statements",   "file": "5_🧾_Statements.py",          "bg": "linear-gradient(135deg,#a18cd1,#fbc2eb)"},
+    {"icon": "📈", "label": "Trends",       "file": "6_📈_Trends.py",              "bg": "linear-gradient(135deg,#d4fc79,#96e6a1)"},
 ]
 
 cols = st.columns(2, gap="large")
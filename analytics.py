@@ -0,0 +1,143 @@
+import threading
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from database import create_connection
+
+# Aging buckets (days since the credit was given)
+AGING_BINS = [-1, 30, 60, 90, np.inf]
+AGING_LABELS = ["0-30 days", "31-60 days", "61-90 days", "90+ days"]
+
+# one consistent version of the snapshot's frames
+Frames = namedtuple("Frames", "items payments transactions customers")
+
+
+def _items_frame(rows):
+    df = pd.DataFrame(rows, columns=["id", "transaction_id", "customer_id", "total_cents"])
+    return df.astype({"id": "int32", "transaction_id": "int32", "customer_id": "int32", "total_cents": "int64"})
+
+
+def _payments_frame(rows):
+    df = pd.DataFrame(rows, columns=["id", "transaction_id", "customer_id", "method", "amount_cents"])
+    return df.astype({"id": "int32", "transaction_id": "int32", "customer_id": "int32",
+                      "method": "category", "amount_cents": "int64"})
+
+
+class LedgerSnapshot:
+    """
+    Read-only, columnar copy of the ledger for dashboards.
+    Items and payments are appended by primary-key watermark on refresh();
+    deletes are detected by row count and trigger a full reload.
+    Edits to existing rows need refresh(full=True).
+    `connect` opens the connection each refresh reads through (and closes);
+    pass reporting.connect_report to build it from the reporting snapshot.
+    When the connection serves a different database file (a new reporting
+    copy), everything is reloaded, since rows may have changed in place.
+
+    The snapshot is shared across sessions: a refresh builds new frames and
+    swaps them in with one assignment, and views work on the frames they
+    picked up, so they never see a half-finished refresh.
+    """
+
+    def __init__(self, connect=create_connection):
+        self._connect = connect
+        self._lock = threading.Lock()           # one refresh at a time
+        self._swap_lock = threading.Lock()      # publishing / picking up `_frames`
+        self._frames = Frames(_items_frame([]), _payments_frame([]), pd.DataFrame(), pd.DataFrame())
+        self._stale = False
+        self._source = None
+
+    def frames(self):
+        """The current items, payments, transactions and customers, all from one refresh."""
+        with self._swap_lock:
+            return self._frames
+
+    def invalidate(self):
+        """Force the next refresh() to reload everything (after in-place edits)."""
+        self._stale = True
+
+    def refresh(self, full=False):
+        with self._lock:
+            full, self._stale = full or self._stale, False
+            conn = self._connect()
+            try:
+                self._refresh(conn, full)
+            finally:
+                conn.close()
+        return self
+
+    def _refresh(self, conn, full):
+        c = conn.cursor()
+        source = next(row[2] for row in c.execute("PRAGMA database_list") if row[1] == "main")
+        full, self._source = full or source != self._source, source
+        old = self._frames      # only refreshes replace it, and they hold _lock
+        item_mark = 0 if full or old.items.empty else int(old.items["id"].iat[-1])
+        pay_mark = 0 if full or old.payments.empty else int(old.payments["id"].iat[-1])
+
+        # rows at or below the watermark went missing -> start over
+        c.execute("SELECT COUNT(*) FROM credit_items WHERE id <= ?", (item_mark,))
+        items_ok = c.fetchone()[0] == len(old.items) or full
+        c.execute("SELECT COUNT(*) FROM payments WHERE id <= ?", (pay_mark,))
+        pays_ok = c.fetchone()[0] == len(old.payments) or full
+        if not (items_ok and pays_ok):
+            item_mark = pay_mark = 0
+
+        c.execute("""
+            SELECT ci.id, ci.transaction_id, ct.customer_id, ci.total_price_cents
+            FROM credit_items ci JOIN credit_transactions ct ON ci.transaction_id = ct.id
+            WHERE ci.id > ? ORDER BY ci.id
+        """, (item_mark,))
+        new_items = _items_frame(c.fetchall())
+        c.execute("""
+            SELECT p.id, p.transaction_id, ct.customer_id, p.method, p.amount_cents
+            FROM payments p JOIN credit_transactions ct ON p.transaction_id = ct.id
+            WHERE p.id > ? ORDER BY p.id
+        """, (pay_mark,))
+        new_payments = _payments_frame(c.fetchall())
+
+        if item_mark:
+            new_items = pd.concat([old.items, new_items], ignore_index=True)
+        if pay_mark:
+            new_payments = pd.concat([old.payments, new_payments], ignore_index=True)
+            new_payments["method"] = new_payments["method"].astype("category")
+
+        # transactions/customers are small and mutable (status, names) -> reload
+        transactions = pd.read_sql("SELECT id, customer_id, date, status FROM credit_transactions", conn).astype(
+            {"id": "int32", "customer_id": "int32", "status": "category"})
+        transactions["date"] = pd.to_datetime(transactions["date"], errors="coerce")
+        customers = pd.read_sql("SELECT id, name FROM customers", conn).astype({"id": "int32"})
+        with self._swap_lock:
+            self._frames = Frames(new_items, new_payments, transactions, customers)
+
+    # ---------- Views ----------
+    def transaction_balances(self):
+        """Balance per transaction in cents (credit minus payments)."""
+        f = self.frames()
+        credit = f.items.groupby("transaction_id")["total_cents"].sum()
+        paid = f.payments.groupby("transaction_id")["amount_cents"].sum()
+        tx = f.transactions.set_index("id")
+        tx["balance_cents"] = credit.reindex(tx.index, fill_value=0) - paid.reindex(tx.index, fill_value=0)
+        return tx
+
+    def top_owed(self, limit=10):
+        """Customers with the largest outstanding balance (id, name, balance_cents)."""
+        f = self.frames()
+        credit = f.items.groupby("customer_id")["total_cents"].sum()
+        paid = f.payments.groupby("customer_id")["amount_cents"].sum()
+        balance = credit.sub(paid, fill_value=0).astype("int64")
+        balance = balance[balance > 0].nlargest(limit)
+        names = f.customers.set_index("id")["name"]
+        return pd.DataFrame({"id": balance.index, "name": names.reindex(balance.index).values,
+                             "balance_cents": balance.values})
+
+    def aging(self, as_of=None):
+        """Outstanding balance split into aging buckets by transaction date."""
+        as_of = pd.Timestamp(as_of or pd.Timestamp.today().normalize())
+        tx = self.transaction_balances()
+        tx = tx[tx["balance_cents"] > 0]
+        days = (as_of - tx["date"]).dt.days.fillna(0)
+        buckets = pd.cut(days, AGING_BINS, labels=AGING_LABELS)
+        out = tx.groupby(buckets, observed=False)["balance_cents"].agg(["count", "sum"])
+        return out.rename(columns={"count": "transactions", "sum": "balance_cents"}).reset_index(names="age")
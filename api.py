@@ -0,0 +1,281 @@
+"""
+Local HTTP JSON API for point-of-sale terminals and mobile clients.
+
+Runs on the standard library (ThreadingHTTPServer, HTTP/1.1 keep-alive) over
+the same repository functions as the Streamlit pages:
+
+    python api.py [--host 127.0.0.1] [--port 8765] [--token SECRET]
+    python api_loadtest.py --mode credits --batch 200    # requests/s and p99 latency
+
+    GET  /health
+    GET  /customers                      GET /products
+    GET  /balances?customer_id=1&customer_id=2
+    GET  /customers/<id>/balance
+    GET  /payments/<id>/receipt?format=escpos58        thermal receipt (text58/80, escpos58/80)
+    GET  /transactions/<id>/receipt?format=text80
+    POST /credits         {"customer_id", "date", "items": [{"product_id", "qty", "unit_price_cents"}]}
+    POST /credits/bulk    {"records": [<credit>, ...], "policy": "until_paid"}
+    POST /payments        {"transaction_id", "amount_cents", "method", "date"}
+    POST /payments/bulk   {"records": [<payment>, ...]}
+
+Single writes take an Idempotency-Key header; bulk records carry their own
+"idempotency_key". A retried key returns the first result (marked
+"replayed") instead of writing again. Money is always integer cents.
+"policy" is optional; without it credit follows the shop's open transaction
+policy (set on the Customers page).
+"""
+import argparse
+import json
+import os
+import re
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from database import init_db
+from receipts import RECEIPT_FORMATS, render_receipt
+from repository import (
+    OPEN_TX_POLICIES, fetch_balances, fetch_customers, fetch_products, payment_receipt_data,
+    record_payment_batch, save_credit_batch, transaction_receipt_data,
+)
+
+DEFAULT_PORT = 8765
+MAX_BATCH = 1000                  # records per bulk request
+MAX_BODY = 8 * 1024 * 1024        # bytes
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# ---------- Validation ----------
+def _int(value, field, minimum=None):
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise ApiError(400, f"{field} must be an integer")
+    if minimum is not None and value < minimum:
+        raise ApiError(400, f"{field} must be >= {minimum}")
+    return value
+
+def _date(value, field):
+    if value is None:
+        return date.today().strftime("%Y-%m-%d")
+    try:
+        datetime.strptime(value, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        raise ApiError(400, f"{field} must be a YYYY-MM-DD date")
+    return value
+
+def _key(value, field):
+    if value is not None and (not isinstance(value, str) or not 0 < len(value) <= 200):
+        raise ApiError(400, f"{field} must be a string of 1-200 characters")
+    return value
+
+def credit_record(body, where="body"):
+    if not isinstance(body, dict):
+        raise ApiError(400, f"{where} must be an object")
+    items = body.get("items")
+    if not isinstance(items, list) or not items:
+        raise ApiError(400, f"{where}.items must be a non-empty list")
+    for i, it in enumerate(items):
+        if not isinstance(it, dict):
+            raise ApiError(400, f"{where}.items[{i}] must be an object")
+        _int(it.get("product_id"), f"{where}.items[{i}].product_id")
+        _int(it.get("qty"), f"{where}.items[{i}].qty", 1)
+        _int(it.get("unit_price_cents"), f"{where}.items[{i}].unit_price_cents", 0)
+    return {
+        "customer_id": _int(body.get("customer_id"), f"{where}.customer_id"),
+        "date": _date(body.get("date"), f"{where}.date"),
+        "items": [{"product_id": it["product_id"], "qty": it["qty"], "unit_price_cents": it["unit_price_cents"]}
+                  for it in items],
+        "idempotency_key": _key(body.get("idempotency_key"), f"{where}.idempotency_key"),
+    }
+
+def payment_record(body, where="body"):
+    if not isinstance(body, dict):
+        raise ApiError(400, f"{where} must be an object")
+    method = body.get("method", "Cash")
+    if not isinstance(method, str) or not method.strip():
+        raise ApiError(400, f"{where}.method must be a non-empty string")
+    return {
+        "transaction_id": _int(body.get("transaction_id"), f"{where}.transaction_id"),
+        "amount_cents": _int(body.get("amount_cents"), f"{where}.amount_cents", 1),
+        "method": method.strip(),
+        "date": _date(body.get("date"), f"{where}.date"),
+        "idempotency_key": _key(body.get("idempotency_key"), f"{where}.idempotency_key"),
+    }
+
+def _records(body, parse):
+    records = body.get("records") if isinstance(body, dict) else None
+    if not isinstance(records, list) or not records:
+        raise ApiError(400, "records must be a non-empty list")
+    if len(records) > MAX_BATCH:
+        raise ApiError(413, f"at most {MAX_BATCH} records per request")
+    return [parse(r, f"records[{i}]") for i, r in enumerate(records)]
+
+def _policy(body):
+    policy = body.get("policy") if isinstance(body, dict) else None
+    if policy is not None and policy not in OPEN_TX_POLICIES:
+        raise ApiError(400, f"policy must be one of {', '.join(OPEN_TX_POLICIES)}")
+    return policy
+
+
+# ---------- Handlers ----------
+def _single_status(result):
+    if result.get("ok"):
+        return 201
+    return 422 if "reason" in result else 400  # refused (credit limit, deleted customer or product) / broke a constraint
+
+def get_balances(query):
+    ids = query.get("customer_id")
+    try:
+        ids = [int(i) for i in ids] if ids else None
+    except ValueError:
+        raise ApiError(400, "customer_id must be an integer")
+    return 200, {"balances": [{"customer_id": cid, "balance_cents": bal}
+                              for cid, bal in sorted(fetch_balances(ids).items())]}
+
+def get_customer_balance(customer_id):
+    return 200, {"customer_id": customer_id, "balance_cents": fetch_balances([customer_id])[customer_id]}
+
+def get_receipt(kind, record_id, query):
+    """Thermal receipt bytes; PDF receipts are made by the Streamlit pages."""
+    fmt = query.get("format", ["text58"])[-1]
+    if fmt not in RECEIPT_FORMATS or fmt == "pdf":
+        raise ApiError(400, "format must be one of " + ", ".join(f for f in RECEIPT_FORMATS if f != "pdf"))
+    data = payment_receipt_data(record_id) if kind == "payments" else transaction_receipt_data(record_id)
+    if data is None:
+        raise ApiError(404, f"no {kind[:-1]} {record_id}")
+    return 200, render_receipt(data, fmt, kind[:-1]), RECEIPT_FORMATS[fmt][1]
+
+def post_credit(body, idempotency_key):
+    record = credit_record(body)
+    record["idempotency_key"] = _key(idempotency_key, "Idempotency-Key") or record["idempotency_key"]
+    result = save_credit_batch([record], _policy(body))[0]
+    return _single_status(result), result
+
+def post_credits_bulk(body, _):
+    return 200, {"results": save_credit_batch(_records(body, credit_record), _policy(body))}
+
+def post_payment(body, idempotency_key):
+    record = payment_record(body)
+    record["idempotency_key"] = _key(idempotency_key, "Idempotency-Key") or record["idempotency_key"]
+    result = record_payment_batch([record])[0]
+    return _single_status(result), result
+
+def post_payments_bulk(body, _):
+    return 200, {"results": record_payment_batch(_records(body, payment_record))}
+
+POST_ROUTES = {
+    "/credits": post_credit,
+    "/credits/bulk": post_credits_bulk,
+    "/payments": post_payment,
+    "/payments/bulk": post_payments_bulk,
+}
+CUSTOMER_BALANCE_PATH = re.compile(r"^/customers/(\d+)/balance$")
+RECEIPT_PATH = re.compile(r"^/(payments|transactions)/(\d+)/receipt$")
+
+
+class ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"     # keep connections open between requests
+    disable_nagle_algorithm = True    # headers and body are separate writes; don't wait on delayed ACKs
+    server_version = "ShopAPI/1.0"
+    token = None
+    quiet = False
+
+    def _send(self, status, payload, content_type="application/json"):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authorized(self):
+        return self.token is None or self.headers.get("Authorization") == f"Bearer {self.token}"
+
+    def _dispatch(self, handle):
+        try:
+            if not self._authorized():
+                raise ApiError(401, "missing or wrong bearer token")
+            status, payload, *content_type = handle()  # (status, payload[, content type for bytes])
+        except ApiError as e:
+            status, payload, content_type = e.status, {"ok": False, "error": str(e)}, []
+        except Exception as e:  # keep the connection and the server alive
+            self.log_error("unhandled error: %r", e)
+            status, payload, content_type = 500, {"ok": False, "error": "internal error"}, []
+        self._send(status, payload, *content_type)
+
+    def do_GET(self):
+        def handle():
+            url = urlsplit(self.path)
+            query = parse_qs(url.query)
+            if url.path == "/health":
+                return 200, {"ok": True}
+            if url.path == "/balances":
+                return get_balances(query)
+            if url.path == "/customers":
+                return 200, {"customers": fetch_customers().to_dict("records")}
+            if url.path == "/products":
+                return 200, {"products": fetch_products().to_dict("records")}
+            match = CUSTOMER_BALANCE_PATH.match(url.path)
+            if match:
+                return get_customer_balance(int(match.group(1)))
+            match = RECEIPT_PATH.match(url.path)
+            if match:
+                return get_receipt(match.group(1), int(match.group(2)), query)
+            raise ApiError(404, f"no route for GET {url.path}")
+        self._dispatch(handle)
+
+    def do_POST(self):
+        # read the body before anything can fail, so the connection stays usable
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length <= MAX_BODY else None
+
+        def handle():
+            if raw is None:
+                self.close_connection = True  # the unread body is still on the socket
+                raise ApiError(413, f"request body over {MAX_BODY} bytes")
+            route = POST_ROUTES.get(urlsplit(self.path).path)
+            if route is None:
+                raise ApiError(404, f"no route for POST {self.path}")
+            try:
+                body = json.loads(raw or b"null")
+            except ValueError:
+                raise ApiError(400, "request body is not valid JSON")
+            return route(body, self.headers.get("Idempotency-Key"))
+        self._dispatch(handle)
+
+    def log_message(self, format, *args):
+        if not self.quiet:
+            super().log_message(format, *args)
+
+
+def make_server(host="127.0.0.1", port=DEFAULT_PORT, token=None, quiet=False):
+    handler = type("ConfiguredApiHandler", (ApiHandler,), {"token": token, "quiet": quiet})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the shop ledger as a local JSON API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--token", default=os.environ.get("SHOP_API_TOKEN"),
+                        help="require 'Authorization: Bearer <token>' (default: $SHOP_API_TOKEN)")
+    parser.add_argument("--quiet", action="store_true", help="do not log each request")
+    args = parser.parse_args()
+
+    init_db()
+    server = make_server(args.host, args.port, args.token, args.quiet)
+    print(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,168 @@
+"""
+Load test for api.py: each client thread keeps one HTTP/1.1 connection open
+and sends requests back to back for a fixed time; reports requests/s,
+records/s and latency percentiles.
+
+    python api.py --quiet                                   # preferably on a copy of the database
+    python api_loadtest.py --mode balances --clients 8
+    python api_loadtest.py --mode credits --batch 200
+    python api_loadtest.py --mode payments --batch 200
+
+The credits and payments modes WRITE to the ledger. Every record carries a
+fresh idempotency key; --retry-rate resends that share of requests with the
+same keys to measure replays.
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import date
+from urllib.parse import urlsplit
+
+from api import DEFAULT_PORT
+from stats import percentile
+
+
+class Client:
+    def __init__(self, url, token=None):
+        parts = urlsplit(url)
+        self.conn = http.client.HTTPConnection(parts.hostname, parts.port or DEFAULT_PORT, timeout=60)
+        self.headers = {"Content-Type": "application/json"}
+        if token:
+            self.headers["Authorization"] = f"Bearer {token}"
+
+    def request(self, method, path, payload=None):
+        body = json.dumps(payload) if payload is not None else None
+        self.conn.request(method, path, body=body, headers=self.headers)
+        response = self.conn.getresponse()
+        return response.status, json.loads(response.read() or b"null")
+
+    def close(self):
+        self.conn.close()
+
+
+def _credit(customers, products):
+    product = random.choice(products)
+    return {"customer_id": random.choice(customers)["id"], "date": date.today().strftime("%Y-%m-%d"),
+            "items": [{"product_id": product["id"], "qty": random.randint(1, 3),
+                       "unit_price_cents": product["price_cents"]}],
+            "idempotency_key": uuid.uuid4().hex}
+
+def _payment(transactions):
+    return {"transaction_id": random.choice(transactions), "amount_cents": 100, "method": "Cash",
+            "idempotency_key": uuid.uuid4().hex}
+
+def _open_transactions(client, customers, products, count):
+    """Credit to pay against: one new transaction per record."""
+    records = [_credit(customers, products) for _ in range(count)]
+    status, body = client.request("POST", "/credits/bulk", {"records": records, "policy": "new"})
+    ids = [r["transaction_id"] for r in body.get("results", []) if r.get("ok")]
+    if status != 200 or not ids:
+        raise SystemExit(f"could not create transactions to pay: {status} {body}")
+    return ids
+
+
+def make_request_factory(mode, batch, client):
+    """Returns next_request() -> (method, path, payload, records)."""
+    if mode == "balances":
+        _, body = client.request("GET", "/customers")
+        ids = [c["id"] for c in body["customers"]]
+        def next_request():
+            picked = random.sample(ids, min(batch, len(ids)))
+            return "GET", "/balances?" + "&".join(f"customer_id={i}" for i in picked), None, len(picked)
+        return next_request
+
+    _, customers = client.request("GET", "/customers")
+    _, products = client.request("GET", "/products")
+    customers, products = customers["customers"], products["products"]
+    if not customers or not products:
+        raise SystemExit("the database needs at least one customer and one product")
+    if mode == "credits":
+        make = lambda: _credit(customers, products)
+    else:
+        transactions = _open_transactions(client, customers, products, 200)
+        make = lambda: _payment(transactions)
+    path = f"/{mode}"
+
+    def next_request():
+        if batch == 1:
+            return "POST", path, make(), 1
+        return "POST", f"{path}/bulk", {"records": [make() for _ in range(batch)]}, batch
+    return next_request
+
+
+def run(url, mode, clients=4, seconds=10.0, batch=1, retry_rate=0.0, token=None):
+    setup = Client(url, token)
+    next_request = make_request_factory(mode, batch, setup)
+    setup.close()
+
+    lock = threading.Lock()
+    latencies, stats = [], {"requests": 0, "records": 0, "errors": 0, "replayed": 0}
+    deadline = time.perf_counter() + seconds
+
+    def worker():
+        client = Client(url, token)
+        mine, counts = [], {"requests": 0, "records": 0, "errors": 0, "replayed": 0}
+        last = None
+        try:
+            while time.perf_counter() < deadline:
+                with lock:  # the factories share random state
+                    req = last if last and random.random() < retry_rate else next_request()
+                method, path, payload, records = req
+                t0 = time.perf_counter()
+                status, body = client.request(method, path, payload)
+                mine.append(time.perf_counter() - t0)
+                counts["requests"] += 1
+                counts["records"] += records
+                if status >= 300:
+                    counts["errors"] += 1
+                elif isinstance(body, dict):
+                    results = body.get("results", [body])
+                    counts["replayed"] += sum(1 for r in results if isinstance(r, dict) and r.get("replayed"))
+                last = req
+        finally:
+            client.close()
+            with lock:
+                latencies.extend(mine)
+                for k, v in counts.items():
+                    stats[k] += v
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    stats.update({
+        "seconds": elapsed,
+        "requests_per_s": stats["requests"] / elapsed,
+        "records_per_s": stats["records"] / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies, default=0) * 1000,
+    })
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the shop JSON API.")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{DEFAULT_PORT}")
+    parser.add_argument("--mode", choices=["balances", "credits", "payments"], default="balances")
+    parser.add_argument("--clients", type=int, default=4, help="concurrent keep-alive connections")
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--batch", type=int, default=1, help="records per request (bulk endpoints when > 1)")
+    parser.add_argument("--retry-rate", type=float, default=0.0, help="share of requests resent with the same keys")
+    parser.add_argument("--token")
+    args = parser.parse_args()
+
+    r = run(args.url, args.mode, args.clients, args.seconds, args.batch, args.retry_rate, args.token)
+    print(f"{args.mode}: {r['requests']:,} requests ({r['records']:,} records) in {r['seconds']:.1f} s "
+          f"over {args.clients} connection(s)")
+    print(f"throughput:  {r['requests_per_s']:,.1f} requests/s  {r['records_per_s']:,.1f} records/s")
+    print(f"latency:     p50={r['p50_ms']:.2f} ms  p99={r['p99_ms']:.2f} ms  max={r['max_ms']:.2f} ms")
+    print(f"errors:      {r['errors']}   replayed records: {r['replayed']}")
@@ -0,0 +1,330 @@
+"""
+Concurrent-session load test for the Streamlit app, driven by AppTest.
+
+Each simulated cashier runs one AppTest session through a till flow against
+a generated database, over and over:
+
+    log in -> add 1-3 products to the cart -> save -> open the dashboard
+    -> open a transaction -> record a payment -> download a receipt
+    -> back to Add Credit
+
+Reports rerun latency percentiles per step, SQLite lock errors and memory per
+session.
+
+    python app_loadtest.py --sessions 8 --seconds 60
+    python app_loadtest.py --sessions 4 --transactions 2000 --keep data/loadtest
+
+Each session is its own process, because AppTest installs a process-wide mock
+runtime on every run and threads would trample it. SQLite still sees one
+connection per session writing to one file, as with the server's session
+threads. The database is generated in a scratch directory (--keep to choose
+and keep it); data/shop.db is never touched.
+"""
+import argparse
+import ast
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+from stats import percentile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+LOGIN_PAGE = "pages/0_🔑_Login.py"
+CREDIT_PAGE = "pages/3_💳_Credit_Transactions.py"
+VIEW_ADD, VIEW_MANAGE = "➕ Add Credit", "📊 Dashboard & Manage"
+STEPS = ("login", "add_item", "save", "dashboard", "open_row", "payment", "receipt", "add_view")
+LOCK_MESSAGES = ("database is locked", "database table is locked")
+
+
+# ---------- Data ----------
+def generate_db(customers=200, products=40, transactions=300, paid_share=0.4, seed=1):
+    """Fill data/shop.db under the current directory with random ledger data."""
+    from database import init_db
+    from repository import add_customer, add_product, query, record_payment_batch, save_credit_batch
+
+    rng = random.Random(seed)
+    init_db()
+    for i in range(customers):
+        add_customer(f"Customer {i + 1}", f"07{rng.randrange(10 ** 8):08d}")
+    for i in range(products):
+        add_product(f"Product {i + 1}", rng.randrange(2, 200) * 100)
+    customer_ids = [r.id for r in query("SELECT id FROM customers")]
+    prices = {r.id: r.price_cents for r in query("SELECT id, price_cents FROM products")}
+
+    records = []
+    for _ in range(transactions):
+        picked = rng.sample(list(prices), rng.randint(1, min(4, len(prices))))
+        records.append({
+            "customer_id": rng.choice(customer_ids),
+            "date": (date.today() - timedelta(days=rng.randrange(120))).strftime("%Y-%m-%d"),
+            "items": [{"product_id": p, "qty": rng.randint(1, 3), "unit_price_cents": prices[p]} for p in picked],
+        })
+    tx_ids = [r["transaction_id"] for r in save_credit_batch(records, "new") if r["ok"]]
+    record_payment_batch([
+        {"transaction_id": t, "amount_cents": 100 * rng.randint(1, 2), "method": "Cash",
+         "date": date.today().strftime("%Y-%m-%d")}
+        for t in rng.sample(tx_ids, int(len(tx_ids) * paid_share))
+    ])
+    return len(tx_ids)
+
+def _login_credentials():
+    """USERNAME / PASSWORD as assigned at the top of the login page."""
+    with open(os.path.join(ROOT, LOGIN_PAGE), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    found = {node.targets[0].id: node.value.value for node in tree.body
+             if isinstance(node, ast.Assign) and isinstance(node.targets[0], ast.Name)
+             and node.targets[0].id in ("USERNAME", "PASSWORD")}
+    return found["USERNAME"], found["PASSWORD"]
+
+
+# ---------- One session ----------
+def _rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:  # not Linux: peak rather than current
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _require_internal(module, name):
+    """The two patches below replace Streamlit internals that are not public API
+    (checked against Streamlit 1.66). Fail loudly if an upgrade moved them,
+    rather than silently measuring an unpatched harness."""
+    import streamlit
+
+    if not hasattr(module, name):
+        raise RuntimeError(f"{module.__name__}.{name} is gone in Streamlit {streamlit.__version__}; "
+                           f"app_loadtest.py needs updating for this version")
+
+def _keep_media_managers():
+    """AppTest builds a MediaFileManager for each run and drops it afterwards.
+    Keep the latest, so a download button's deferred receipt can be made the
+    way the server makes it when the button is clicked."""
+    from streamlit.testing.v1 import app_test
+
+    _require_internal(app_test, "MediaFileManager")
+
+    class KeptMediaFileManager(app_test.MediaFileManager):
+        latest = None
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            KeptMediaFileManager.latest = self
+
+    app_test.MediaFileManager = KeptMediaFileManager
+    return KeptMediaFileManager
+
+def _wait_without_polling():
+    """AppTest waits for a run by polling every 1 ms and rescanning every event
+    emitted so far. With a long page that steals the GIL from the script
+    thread and can add several seconds per rerun. Wait on the SHUTDOWN event
+    instead, so the latencies measure the page and not the poll loop."""
+    from streamlit.runtime.scriptrunner import ScriptRunnerEvent
+    from streamlit.testing.v1 import local_script_runner
+
+    _require_internal(local_script_runner, "require_widgets_deltas")
+
+    def require_widgets_deltas(runner, timeout=3):
+        done = threading.Event()
+
+        def on_event(sender, event, **kwargs):
+            if event == ScriptRunnerEvent.SHUTDOWN:
+                done.set()
+
+        runner.on_event.connect(on_event, weak=False)
+        try:
+            if runner.script_stopped() or done.wait(timeout):
+                return
+        finally:
+            runner.on_event.disconnect(on_event)
+        runner.request_stop()
+        runner.join()
+        raise RuntimeError(f"AppTest script run timed out after {timeout}(s)")
+
+    local_script_runner.require_widgets_deltas = require_widgets_deltas
+
+def _labelled(elements, label):
+    return next(e for e in elements if e.label == label)
+
+def run_session(index, workdir, seconds, iterations, timeout, seed, barrier, startup_lock):
+    """Run the till flow in one AppTest session; returns its measurements."""
+    os.chdir(workdir)
+    from streamlit.testing.v1 import AppTest
+    from database import init_db
+
+    with startup_lock:  # the server runs init_db once for all sessions, not once per session
+        init_db()
+
+    media = _keep_media_managers()
+    _wait_without_polling()
+    rng = random.Random(seed * 1000 + index)
+    latencies = {step: [] for step in STEPS}
+    out = {"latencies": latencies, "lock_errors": 0, "app_errors": [], "harness_errors": [], "flows": 0,
+           "rss_start_mb": _rss_mb()}
+    at = AppTest.from_file(os.path.join(ROOT, "Home.py"), default_timeout=timeout)
+
+    def check(name):
+        """Count the exceptions the last rerun showed; False if there were any."""
+        for exc in at.exception:
+            if any(m in exc.message.lower() for m in LOCK_MESSAGES):
+                out["lock_errors"] += 1
+            else:
+                out["app_errors"].append(f"{name}: {exc.message}")
+        return not at.exception
+
+    def step(name, action):
+        t0 = time.perf_counter()
+        try:
+            action()
+        except Exception as e:  # a widget the flow needs is missing, or the rerun timed out
+            out["harness_errors"].append(f"{name}: {type(e).__name__}: {e}")
+            return False
+        latencies[name].append(time.perf_counter() - t0)
+        return check(name)
+
+    def log_in():
+        username, password = _login_credentials()
+        at.run()
+        check("login")
+        at.switch_page(LOGIN_PAGE).run()
+        check("login")
+        _labelled(at.text_input, "Username").input(username)
+        _labelled(at.text_input, "Password").input(password)
+        _labelled(at.button, "Login").click().run()
+
+    def add_item():
+        _labelled(at.selectbox, "Product").select_index(rng.randrange(len(_labelled(at.selectbox, "Product").options)))
+        _labelled(at.number_input, "Quantity").set_value(rng.randint(1, 3))
+        _labelled(at.button, "➕ Add Product").click().run()
+
+    opened = []
+
+    def open_row():
+        key = rng.choice([e.key for e in at.expander if e.key and e.key.startswith("tx_open_")])
+        at.session_state[key] = True  # what clicking the expander does
+        opened.append(key)
+        at.run()
+
+    def pay():
+        tid = opened[-1][len("tx_open_"):]
+        at.number_input(key=f"payamt_{tid}").set_value(1.0)
+        next(b for b in at.button if b.proto.form_id == f"payment_form_{tid}").click().run()
+
+    def download_receipt():
+        button = rng.choice(at.get("download_button"))
+        media.latest.execute_deferred(button.proto.deferred_file_id)
+
+    def show(view):
+        while opened:
+            at.session_state[opened.pop()] = False
+        at.radio(key="credit_view").set_value(view).run()
+
+    if not step("login", log_in):
+        return out
+    at.switch_page(CREDIT_PAGE)
+    step("add_view", at.run)
+    out["rss_login_mb"] = _rss_mb()
+    barrier.wait(timeout=600)  # every session starts its flows together
+
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline and (not iterations or out["flows"] < iterations):
+        _labelled(at.selectbox, "Select Customer").select_index(rng.randrange(len(_labelled(at.selectbox, "Select Customer").options)))
+        for _ in range(rng.randint(1, 3)):
+            step("add_item", add_item)
+        step("save", lambda: _labelled(at.button, "💾 Save Transaction").click().run())
+        step("dashboard", lambda: show(VIEW_MANAGE))
+        if step("open_row", open_row):
+            step("payment", pay)
+        step("receipt", download_receipt)
+        step("add_view", lambda: show(VIEW_ADD))
+        out["flows"] += 1
+        if out["flows"] == 1:
+            out["rss_warm_mb"] = _rss_mb()
+    out["rss_end_mb"] = _rss_mb()
+    return out
+
+
+# ---------- Driver ----------
+def run(sessions=4, seconds=30.0, iterations=0, timeout=60.0, customers=200, products=40, transactions=300,
+        seed=1, workdir=None):
+    """Generate a database, run `sessions` concurrent sessions and merge their
+    measurements. A scratch directory is removed afterwards unless given."""
+    keep = workdir is not None
+    workdir = os.path.abspath(workdir) if keep else tempfile.mkdtemp(prefix="shop-loadtest-")
+    os.makedirs(workdir, exist_ok=True)
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        if not os.path.exists(os.path.join("data", "shop.db")):
+            generate_db(customers, products, transactions, seed=seed)
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Manager() as manager, ProcessPoolExecutor(sessions, mp_context=ctx) as pool:
+            barrier, startup_lock = manager.Barrier(sessions), manager.Lock()
+            t0 = time.perf_counter()
+            futures = [pool.submit(run_session, i, workdir, seconds, iterations, timeout, seed, barrier, startup_lock)
+                       for i in range(sessions)]
+            results = [f.result() for f in futures]
+            elapsed = time.perf_counter() - t0
+    finally:
+        os.chdir(cwd)
+        if not keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    steps = {}
+    for name in STEPS:
+        values = [v for r in results for v in r["latencies"][name]]
+        steps[name] = {"count": len(values), "p50_ms": percentile(values, 50) * 1000,
+                       "p95_ms": percentile(values, 95) * 1000, "p99_ms": percentile(values, 99) * 1000,
+                       "max_ms": max(values, default=0) * 1000}
+    flows = sum(r["flows"] for r in results)
+    memory = [(r["rss_end_mb"], r["rss_end_mb"] - r.get("rss_warm_mb", r["rss_end_mb"]))
+              for r in results if "rss_end_mb" in r]
+    return {
+        "sessions": sessions,
+        "seconds": elapsed,
+        "flows": flows,
+        "flows_per_min": flows / elapsed * 60 if elapsed else 0.0,
+        "steps": steps,
+        "lock_errors": sum(r["lock_errors"] for r in results),
+        "app_errors": [e for r in results for e in r["app_errors"]],
+        "harness_errors": [e for r in results for e in r["harness_errors"]],
+        "rss_mb": max((m for m, _ in memory), default=0.0),
+        "growth_mb": max((g for _, g in memory), default=0.0),
+        "workdir": workdir if keep else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the Streamlit pages with concurrent AppTest sessions.")
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent cashiers")
+    parser.add_argument("--seconds", type=float, default=30.0, help="how long each session repeats the flow")
+    parser.add_argument("--iterations", type=int, default=0, help="stop a session after this many flows (0 = no cap)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds one rerun may take")
+    parser.add_argument("--customers", type=int, default=200)
+    parser.add_argument("--products", type=int, default=40)
+    parser.add_argument("--transactions", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", metavar="DIR", help="generate (or reuse) the database in DIR and keep it")
+    args = parser.parse_args()
+
+    r = run(args.sessions, args.seconds, args.iterations, args.timeout, args.customers, args.products,
+            args.transactions, args.seed, args.keep)
+    print(f"{r['sessions']} session(s), {r['flows']} flows in {r['seconds']:.1f} s ({r['flows_per_min']:.1f} flows/min)")
+    print(f"{'step':<10} {'count':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for name, s in r["steps"].items():
+        print(f"{name:<10} {s['count']:>6} {s['p50_ms']:>7.0f}ms {s['p95_ms']:>7.0f}ms "
+              f"{s['p99_ms']:>7.0f}ms {s['max_ms']:>7.0f}ms")
+    print(f"sqlite lock errors: {r['lock_errors']}   app errors: {len(r['app_errors'])}   "
+          f"harness errors: {len(r['harness_errors'])}")
+    for error in (r["app_errors"] + r["harness_errors"])[:5]:
+        print(f"  {error}")
+    print(f"memory per session: {r['rss_mb']:.0f} MB process RSS, "
+          f"+{r['growth_mb']:.1f} MB after the first flow (max over sessions)")
+    if r["workdir"]:
+        print(f"database kept in {r['workdir']}")
@@ -0,0 +1,166 @@
+"""
+Archival of settled credit.
+
+Paid transactions older than N days are moved, with their items and payments,
+into data/archive.db (attached as `archive`). Day-to-day queries only read the
+hot tables in data/shop.db; pass include_archived where history is wanted.
+
+Run nightly, e.g. from cron:
+    python archive.py --days 180 --vacuum
+
+Daily rollups count archived history too; rebuild them from hot + archive with
+    python archive.py --rebuild-rollups
+"""
+import argparse
+import os
+import sqlite3
+from datetime import date, timedelta
+
+from database import ROLLUPS_PAUSED_KEY, create_connection, fill_rollups, init_db
+
+ARCHIVE_PATH = 'data/archive.db'
+IDEMPOTENCY_KEY_DAYS = 30   # how long API clients may safely retry a write
+
+ARCHIVE_TABLES = {
+    "credit_transactions": '''
+        CREATE TABLE IF NOT EXISTS archive.credit_transactions (
+            id INTEGER PRIMARY KEY,
+            customer_id INTEGER NOT NULL,
+            date TEXT NOT NULL,
+            status TEXT NOT NULL
+        )''',
+    "credit_items": '''
+        CREATE TABLE IF NOT EXISTS archive.credit_items (
+            id INTEGER PRIMARY KEY,
+            transaction_id INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            unit_price_cents INTEGER NOT NULL,
+            total_price_cents INTEGER NOT NULL
+        )''',
+    "payments": '''
+        CREATE TABLE IF NOT EXISTS archive.payments (
+            id INTEGER PRIMARY KEY,
+            transaction_id INTEGER NOT NULL,
+            amount_cents INTEGER NOT NULL,
+            method TEXT NOT NULL,
+            date TEXT NOT NULL,
+            customer_id INTEGER
+        )''',
+}
+
+ARCHIVE_COLUMNS = {
+    "credit_transactions": "id, customer_id, date, status",
+    "credit_items": "id, transaction_id, product_id, quantity, unit_price_cents, total_price_cents",
+    "payments": "id, transaction_id, amount_cents, method, date, customer_id",
+}
+
+
+def attach_archive(conn):
+    """Attach the archive file as schema `archive`, creating its tables if needed."""
+    attached = [row[1] for row in conn.execute("PRAGMA database_list")]
+    if "archive" not in attached:
+        conn.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_PATH,))
+        for ddl in ARCHIVE_TABLES.values():
+            conn.execute(ddl)
+        if "customer_id" not in [row[1] for row in conn.execute("PRAGMA archive.table_info(payments)")]:
+            with conn:  # archives written before payments carried their customer
+                conn.execute("ALTER TABLE archive.payments ADD COLUMN customer_id INTEGER")
+                conn.execute("UPDATE archive.payments SET customer_id = (SELECT ct.customer_id FROM "
+                             "archive.credit_transactions ct WHERE ct.id = payments.transaction_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_act_customer_date ON credit_transactions (customer_id, date, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_aci_transaction ON credit_items (transaction_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_apay_transaction ON payments (transaction_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS archive.idx_apay_customer_date ON payments (customer_id, date, id)")
+    return conn
+
+
+def table_source(table, include_archived=False):
+    """FROM-clause source for a ledger table: the hot table, or hot + archive."""
+    if not include_archived:
+        return table
+    cols = ARCHIVE_COLUMNS[table]
+    return f"(SELECT {cols} FROM main.{table} UNION ALL SELECT {cols} FROM archive.{table})"
+
+
+def archive_paid_transactions(older_than_days=180):
+    """
+    Move Paid transactions dated more than `older_than_days` ago into the
+    archive in a single transaction. Only transactions whose payments equal
+    their items are moved, so archived rows add nothing to any customer's
+    balance; an overpaid transaction stays live, where its credit still
+    counts against the customer's balance. Returns the number archived.
+    """
+    cutoff = (date.today() - timedelta(days=older_than_days)).strftime("%Y-%m-%d")
+    conn = attach_archive(create_connection())
+    c = conn.cursor()
+    try:
+        c.execute("BEGIN IMMEDIATE")
+        # rows are moving, not going away: keep the rollup triggers out of it
+        c.execute("INSERT OR REPLACE INTO main.settings (key, value) VALUES (?, '1')", (ROLLUPS_PAUSED_KEY,))
+        c.execute("CREATE TEMP TABLE IF NOT EXISTS archive_batch (id INTEGER PRIMARY KEY)")
+        c.execute("DELETE FROM archive_batch")
+        c.execute("""
+            INSERT INTO archive_batch (id)
+            SELECT ct.id FROM credit_transactions ct
+            WHERE ct.status = 'Paid' AND ct.date < ?
+              AND COALESCE((SELECT SUM(total_price_cents) FROM credit_items WHERE transaction_id = ct.id), 0)
+                  = COALESCE((SELECT SUM(amount_cents) FROM payments WHERE transaction_id = ct.id), 0)
+        """, (cutoff,))
+        moved = c.rowcount
+        for table, key in [("credit_items", "transaction_id"), ("payments", "transaction_id"), ("credit_transactions", "id")]:
+            cols = ARCHIVE_COLUMNS[table]
+            c.execute(f"INSERT INTO archive.{table} ({cols}) SELECT {cols} FROM main.{table} "
+                      f"WHERE {key} IN (SELECT id FROM archive_batch)")
+            c.execute(f"DELETE FROM main.{table} WHERE {key} IN (SELECT id FROM archive_batch)")
+        c.execute("DELETE FROM main.settings WHERE key = ?", (ROLLUPS_PAUSED_KEY,))
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return moved
+
+
+def rebuild_rollups():
+    """Recompute daily_rollups from the hot and archived tables."""
+    conn = attach_archive(create_connection())
+    try:
+        with conn:
+            fill_rollups(conn.cursor(), lambda table: table_source(table, include_archived=True))
+    finally:
+        conn.close()
+
+
+def run_maintenance(vacuum=False):
+    """Drop expired API idempotency keys and refresh planner statistics;
+    optionally VACUUM to return freed pages to the OS."""
+    conn = create_connection()
+    conn.execute("PRAGMA busy_timeout = 30000")
+    with conn:
+        conn.execute("DELETE FROM idempotency_keys WHERE created_at < datetime('now', ?)",
+                     (f"-{IDEMPOTENCY_KEY_DAYS} days",))
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA optimize")
+    if vacuum:
+        conn.execute("VACUUM")
+    conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive settled credit and tidy up the database.")
+    parser.add_argument("--days", type=int, default=180, help="archive Paid transactions older than this")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM the main database afterwards")
+    parser.add_argument("--rebuild-rollups", action="store_true", help="recompute daily rollups from hot + archive")
+    args = parser.parse_args()
+
+    if not os.path.exists("data"):
+        os.makedirs("data")
+    init_db()
+    if args.rebuild_rollups:
+        rebuild_rollups()
+        print("Daily rollups rebuilt.")
+    count = archive_paid_transactions(args.days)
+    run_maintenance(vacuum=args.vacuum)
+    print(f"Archived {count} paid transaction(s) older than {args.days} days.")
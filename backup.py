@@ -0,0 +1,222 @@
+"""
+Online backups of the ledger using the SQLite backup API.
+
+Snapshots are copied a few pages at a time (writers keep going), checked with
+PRAGMA integrity_check, gzip-compressed into data/backups and rotated.
+
+    python backup.py backup [--keep 14]
+    python backup.py list
+    python backup.py verify data/backups/shop-20260101-020000.db.gz
+    python backup.py restore --at "2026-01-01 12:00"     # newest snapshot at or before
+    python backup.py bench                                # backup time vs writer latency
+"""
+import argparse
+import glob
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from database import DB_PATH
+from stats import percentile
+
+BACKUP_DIR = 'data/backups'
+BACKUP_PREFIX = 'shop-'
+STAMP_FORMAT = '%Y%m%d-%H%M%S'
+STEP_PAGES = 256        # pages copied per step
+STEP_SLEEP = 0.005      # pause between steps so writers get the lock
+
+
+class BackupError(Exception):
+    pass
+
+
+def _copy_online(src_path, dest_path, pages=STEP_PAGES, sleep=STEP_SLEEP, progress=None):
+    """Copy a live database in steps. The source holds one read transaction so
+    concurrent WAL writes neither block the copy nor force it to restart."""
+    src = sqlite3.connect(src_path, isolation_level=None)
+    dest = sqlite3.connect(dest_path)
+    try:
+        src.execute("BEGIN")
+        src.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+        src.backup(dest, pages=pages, sleep=sleep, progress=progress)
+        src.execute("COMMIT")
+    finally:
+        dest.close()
+        src.close()
+
+
+def check_integrity(path):
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        conn.close()
+    if result != "ok":
+        raise BackupError(f"integrity_check failed for {path}: {result}")
+
+
+def list_backups(backup_dir=BACKUP_DIR):
+    """Backups as (taken_at, path), oldest first."""
+    found = []
+    for path in glob.glob(os.path.join(backup_dir, f"{BACKUP_PREFIX}*.db.gz")):
+        stamp = os.path.basename(path)[len(BACKUP_PREFIX):-len(".db.gz")]
+        try:
+            found.append((datetime.strptime(stamp, STAMP_FORMAT), path))
+        except ValueError:
+            continue
+    return sorted(found)
+
+
+def rotate_backups(keep, backup_dir=BACKUP_DIR):
+    removed = []
+    for _, path in list_backups(backup_dir)[:-keep] if keep > 0 else []:
+        os.remove(path)
+        removed.append(path)
+    return removed
+
+
+def create_backup(db_path=DB_PATH, backup_dir=BACKUP_DIR, keep=14):
+    """Take a verified, compressed snapshot and rotate old ones. Returns its path."""
+    os.makedirs(backup_dir, exist_ok=True)
+    final_path = os.path.join(backup_dir, f"{BACKUP_PREFIX}{datetime.now().strftime(STAMP_FORMAT)}.db.gz")
+    with tempfile.TemporaryDirectory(dir=backup_dir) as tmp:
+        raw = os.path.join(tmp, "snapshot.db")
+        _copy_online(db_path, raw)
+        check_integrity(raw)
+        with open(raw, "rb") as f_in, gzip.open(final_path + ".part", "wb", compresslevel=6) as f_out:
+            shutil.copyfileobj(f_in, f_out)
+    os.replace(final_path + ".part", final_path)
+    rotate_backups(keep, backup_dir)
+    return final_path
+
+
+def _decompress(path, dest):
+    with gzip.open(path, "rb") as f_in, open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+
+
+def verify_backup(path):
+    with tempfile.TemporaryDirectory() as tmp:
+        raw = os.path.join(tmp, "verify.db")
+        _decompress(path, raw)
+        check_integrity(raw)
+
+
+def find_backup(at=None, backup_dir=BACKUP_DIR):
+    """Newest backup taken at or before `at` (a datetime), or the newest overall."""
+    candidates = [(ts, p) for ts, p in list_backups(backup_dir) if at is None or ts <= at]
+    if not candidates:
+        raise BackupError("no backup found" + (f" at or before {at}" if at else ""))
+    return candidates[-1][1]
+
+
+def restore_backup(path, db_path=DB_PATH):
+    """Verify a snapshot, then copy it over the live database through the backup
+    API (so open connections see the restored data rather than a swapped file).
+    The current database is saved first as a safety snapshot."""
+    with tempfile.TemporaryDirectory() as tmp:
+        raw = os.path.join(tmp, "restore.db")
+        _decompress(path, raw)
+        check_integrity(raw)
+        if os.path.exists(db_path):
+            create_backup(db_path, keep=0)
+        src = sqlite3.connect(raw)
+        dest = sqlite3.connect(db_path, timeout=30)
+        try:
+            src.backup(dest)
+        finally:
+            dest.close()
+            src.close()
+    check_integrity(db_path)
+
+
+# ---------- Benchmark ----------
+def _writer(db_path, stop, latencies):
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.execute("CREATE TABLE IF NOT EXISTS bench_writes (id INTEGER PRIMARY KEY, note TEXT)")
+    conn.commit()
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        conn.execute("INSERT INTO bench_writes (note) VALUES (?)", ("x" * 64,))
+        conn.commit()
+        latencies.append(time.perf_counter() - t0)
+        time.sleep(0.002)
+    conn.close()
+
+
+def benchmark(db_path=DB_PATH, seconds=2.0):
+    """Writer latency alone vs during a backup, on a scratch copy of `db_path`."""
+    with tempfile.TemporaryDirectory() as tmp:
+        scratch = os.path.join(tmp, "bench.db")
+        _copy_online(db_path, scratch, pages=-1)
+        conn = sqlite3.connect(scratch)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.close()
+
+        results = {}
+        for label in ("baseline", "during_backup"):
+            stop, latencies = threading.Event(), []
+            writer = threading.Thread(target=_writer, args=(scratch, stop, latencies))
+            writer.start()
+            if label == "during_backup":
+                t0 = time.perf_counter()
+                runs = 0
+                while time.perf_counter() - t0 < seconds:
+                    _copy_online(scratch, os.path.join(tmp, "copy.db"))
+                    runs += 1
+                results["backup_seconds"] = (time.perf_counter() - t0) / runs
+            else:
+                time.sleep(seconds)
+            stop.set()
+            writer.join()
+            results[label] = {
+                "writes": len(latencies),
+                "p50_ms": percentile(latencies, 50) * 1000,
+                "p99_ms": percentile(latencies, 99) * 1000,
+                "max_ms": max(latencies, default=0) * 1000,
+            }
+        results["db_bytes"] = os.path.getsize(scratch)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Back up and restore the shop ledger.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_backup = sub.add_parser("backup", help="take a verified, compressed snapshot")
+    p_backup.add_argument("--keep", type=int, default=14, help="number of snapshots to keep")
+    sub.add_parser("list", help="list snapshots")
+    p_verify = sub.add_parser("verify", help="integrity-check a snapshot")
+    p_verify.add_argument("path")
+    p_restore = sub.add_parser("restore", help="restore a snapshot over the live database")
+    p_restore.add_argument("path", nargs="?", help="snapshot file (default: newest, or see --at)")
+    p_restore.add_argument("--at", help="restore the newest snapshot at or before 'YYYY-MM-DD HH:MM'")
+    p_bench = sub.add_parser("bench", help="measure backup time and writer latency impact")
+    p_bench.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+
+    if args.command == "backup":
+        print(create_backup(keep=args.keep))
+    elif args.command == "list":
+        for ts, path in list_backups():
+            print(f"{ts:%Y-%m-%d %H:%M:%S}  {os.path.getsize(path):>10,} bytes  {path}")
+    elif args.command == "verify":
+        verify_backup(args.path)
+        print("ok")
+    elif args.command == "restore":
+        at = datetime.strptime(args.at, "%Y-%m-%d %H:%M") if args.at else None
+        path = args.path or find_backup(at)
+        restore_backup(path)
+        print(f"Restored {path}")
+    elif args.command == "bench":
+        r = benchmark(seconds=args.seconds)
+        print(f"database size:     {r['db_bytes']:,} bytes")
+        print(f"backup time:       {r['backup_seconds'] * 1000:.1f} ms")
+        for label in ("baseline", "during_backup"):
+            s = r[label]
+            print(f"writes {label:<14} n={s['writes']:<6} p50={s['p50_ms']:.2f} ms  "
+                  f"p99={s['p99_ms']:.2f} ms  max={s['max_ms']:.2f} ms")
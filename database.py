@@ -1,9 +1,71 @@
+import logging
+import os
 import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
 
 DB_PATH = 'data/shop.db'
+CACHED_STATEMENTS = 512     # prepared statements kept per connection (sqlite3 default is 128)
+
+# numpy scalars (ids/prices taken from DataFrames) must be stored as numbers, not BLOBs
+sqlite3.register_adapter(np.int64, int)
+sqlite3.register_adapter(np.int32, int)
+sqlite3.register_adapter(np.float64, float)
+
+# Shared pool for independent page reads (each worker thread uses its own connection)
+_read_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="shop-read")
+_local = threading.local()
+_idle = deque()     # connections whose thread has ended, kept with their statement caches
+_db_ready = False
+log = logging.getLogger(__name__)
 
 def create_connection():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
+    if not os.path.exists(os.path.dirname(DB_PATH)):
+        os.makedirs(os.path.dirname(DB_PATH))
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+    conn.execute("PRAGMA foreign_keys = ON")
+    return conn
+
+class _Lease:
+    """A thread's hold on a connection; hands it back to the idle pool when the thread ends."""
+    __slots__ = ("conn",)
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __del__(self):
+        try:
+            if self.conn.in_transaction:
+                self.conn.rollback()
+            _idle.append(self.conn)
+        except Exception:   # interpreter shutdown / connection already closed
+            pass
+
+def get_connection():
+    """
+    Connection leased to the current thread. Streamlit runs every rerun on a
+    new thread, so when a thread ends its connection goes back to the idle pool
+    and the next thread picks it up with its prepared statements still cached.
+    """
+    lease = getattr(_local, "lease", None)
+    if lease is None:
+        try:
+            conn = _idle.pop()
+        except IndexError:
+            conn = create_connection()
+        lease = _local.lease = _Lease(conn)
+    return lease.conn
+
+def enable_wal(conn):
+    """Switch the database to WAL so readers run alongside a writer."""
+    conn.execute("PRAGMA journal_mode=WAL")
+
+def submit_read(fn, *args, **kwargs):
+    """Start a read-only fetcher in the background and return its Future."""
+    return _read_pool.submit(fn, *args, **kwargs)
 
 def column_exists(cursor, table_name, column_name):
     """Check if a column exists in a table."""
@@ -15,8 +77,359 @@ def add_column_if_missing(cursor, table_name, column_name, column_def):
     if not column_exists(cursor, table_name, column_name):
         cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_def}")
 
+def repair_blob_ids(cursor):
+    """Convert id columns written as raw numpy int64 BLOBs back into integers."""
+    for table, column in [("credit_transactions", "customer_id"), ("credit_items", "transaction_id"),
+                          ("credit_items", "product_id"), ("payments", "transaction_id")]:
+        cursor.execute(f"SELECT id, {column} FROM {table} WHERE typeof({column}) = 'blob'")
+        fixes = [(int.from_bytes(value, "little", signed=True), row_id) for row_id, value in cursor.fetchall()]
+        cursor.executemany(f"UPDATE {table} SET {column} = ? WHERE id = ?", fixes)
+
+def _rebuild_table(cursor, table, create_sql, columns, select_sql):
+    """Recreate a table with a new definition, copying rows across."""
+    cursor.execute(create_sql.format(table=f"{table}_new"))
+    cursor.execute(f"INSERT INTO {table}_new ({columns}) {select_sql}")
+    cursor.execute(f"DROP TABLE {table}")
+    cursor.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+def migrate_money_to_cents(cursor):
+    """Rebuild the money tables so amounts are INTEGER cents instead of REAL Kshs."""
+    if column_exists(cursor, "products", "price"):
+        _rebuild_table(cursor, "products", '''
+            CREATE TABLE {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                price_cents INTEGER NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )''', "id, name, price_cents, created_at",
+            "SELECT id, name, CAST(ROUND(COALESCE(price,0) * 100) AS INTEGER), created_at FROM products")
+
+    if column_exists(cursor, "credit_items", "unit_price"):
+        _rebuild_table(cursor, "credit_items", '''
+            CREATE TABLE {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                transaction_id INTEGER NOT NULL,
+                product_id INTEGER NOT NULL,
+                quantity INTEGER NOT NULL,
+                unit_price_cents INTEGER NOT NULL,
+                total_price_cents INTEGER NOT NULL,
+                FOREIGN KEY (transaction_id) REFERENCES credit_transactions (id),
+                FOREIGN KEY (product_id) REFERENCES products (id)
+            )''', "id, transaction_id, product_id, quantity, unit_price_cents, total_price_cents",
+            '''SELECT id, transaction_id, product_id, quantity,
+                      CAST(ROUND(COALESCE(unit_price,0) * 100) AS INTEGER),
+                      quantity * CAST(ROUND(COALESCE(unit_price,0) * 100) AS INTEGER)
+               FROM credit_items''')
+
+    if column_exists(cursor, "payments", "amount"):
+        _rebuild_table(cursor, "payments", '''
+            CREATE TABLE {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                transaction_id INTEGER NOT NULL,
+                amount_cents INTEGER NOT NULL,
+                method TEXT NOT NULL DEFAULT 'Cash',
+                date TEXT NOT NULL DEFAULT '',
+                FOREIGN KEY (transaction_id) REFERENCES credit_transactions (id)
+            )''', "id, transaction_id, amount_cents, method, date",
+            '''SELECT id, transaction_id, CAST(ROUND(COALESCE(amount,0) * 100) AS INTEGER),
+                      COALESCE(method,'Cash'), COALESCE(date,'')
+               FROM payments''')
+
+# ON DELETE action wanted for each foreign key: table -> {parent: action}
+FOREIGN_KEY_ACTIONS = {
+    "credit_transactions": {"customers": "RESTRICT"},
+    "credit_items": {"credit_transactions": "CASCADE", "products": "RESTRICT"},
+    "payments": {"credit_transactions": "CASCADE"},
+}
+
+def migrate_foreign_keys(conn):
+    """
+    Rebuild the ledger tables with ON DELETE CASCADE/RESTRICT. Rows left behind
+    by old hard deletes are fixed first: transactions and items whose customer
+    or product is gone get a soft-deleted placeholder parent; items whose
+    transaction is gone are dropped. Payments whose transaction is gone are
+    money received, so they are moved to orphan_payments (and logged) for
+    someone to re-apply, never deleted. Needs foreign_keys OFF.
+    """
+    c = conn.cursor()
+    if all({row[2]: row[6] for row in c.execute(f"PRAGMA foreign_key_list({table})")} == wanted
+           for table, wanted in FOREIGN_KEY_ACTIONS.items()):
+        return
+    conn.commit()
+    try:
+        c.execute('''
+            INSERT INTO customers (id, name, deleted_at)
+            SELECT DISTINCT customer_id, '(deleted customer #' || customer_id || ')', CURRENT_TIMESTAMP
+            FROM credit_transactions WHERE customer_id NOT IN (SELECT id FROM customers)
+        ''')
+        c.execute('''
+            INSERT INTO products (id, name, price_cents, deleted_at)
+            SELECT DISTINCT product_id, '(deleted product #' || product_id || ')', 0, CURRENT_TIMESTAMP
+            FROM credit_items WHERE product_id NOT IN (SELECT id FROM products)
+        ''')
+        c.execute("DELETE FROM credit_items WHERE transaction_id NOT IN (SELECT id FROM credit_transactions)")
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS orphan_payments (
+                id INTEGER PRIMARY KEY,
+                transaction_id INTEGER NOT NULL,
+                amount_cents INTEGER NOT NULL,
+                method TEXT NOT NULL,
+                date TEXT NOT NULL,
+                quarantined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        orphans = c.execute('''
+            INSERT OR REPLACE INTO orphan_payments (id, transaction_id, amount_cents, method, date)
+            SELECT id, transaction_id, amount_cents, method, date FROM payments
+            WHERE transaction_id NOT IN (SELECT id FROM credit_transactions)
+        ''').rowcount
+        c.execute("DELETE FROM payments WHERE transaction_id NOT IN (SELECT id FROM credit_transactions)")
+        # triggers name these tables; drop them for the rebuild (init_db recreates them)
+        for (name,) in c.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall():
+            c.execute(f"DROP TRIGGER {name}")
+
+        _rebuild_table(c, "credit_transactions", '''
+            CREATE TABLE {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                customer_id INTEGER NOT NULL REFERENCES customers (id) ON DELETE RESTRICT,
+                date TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'Unpaid'
+            )''', "id, customer_id, date, status", "SELECT id, customer_id, date, status FROM credit_transactions")
+        _rebuild_table(c, "credit_items", '''
+            CREATE TABLE {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                transaction_id INTEGER NOT NULL REFERENCES credit_transactions (id) ON DELETE CASCADE,
+                product_id INTEGER NOT NULL REFERENCES products (id) ON DELETE RESTRICT,
+                quantity INTEGER NOT NULL,
+                unit_price_cents INTEGER NOT NULL,
+                total_price_cents INTEGER NOT NULL
+            )''', "id, transaction_id, product_id, quantity, unit_price_cents, total_price_cents",
+            "SELECT id, transaction_id, product_id, quantity, unit_price_cents, total_price_cents FROM credit_items")
+        _rebuild_table(c, "payments", '''
+            CREATE TABLE {table} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                transaction_id INTEGER NOT NULL REFERENCES credit_transactions (id) ON DELETE CASCADE,
+                amount_cents INTEGER NOT NULL,
+                method TEXT NOT NULL DEFAULT 'Cash',
+                date TEXT NOT NULL DEFAULT ''
+            )''', "id, transaction_id, amount_cents, method, date",
+            "SELECT id, transaction_id, amount_cents, method, date FROM payments")
+
+        problems = c.execute("PRAGMA foreign_key_check").fetchall()
+        if problems:
+            raise sqlite3.IntegrityError(f"foreign key check failed after migration: {problems[:5]}")
+        conn.commit()
+        if orphans:
+            total = c.execute("SELECT SUM(amount_cents) FROM orphan_payments").fetchone()[0]
+            log.warning("%d payment(s) totalling %d cents referred to deleted transactions; "
+                        "moved to orphan_payments for review", orphans, total)
+    except Exception:
+        conn.rollback()
+        raise
+
+def add_payment_customers(cursor):
+    """Copy each payment's customer (from its transaction) onto the payment,
+    so one customer's payments can be read by date from a single index.
+    repository.SQL_INSERT_PAYMENT fills it in; the triggers cover other writers
+    and a transaction moved to another customer."""
+    if not column_exists(cursor, "payments", "customer_id"):
+        cursor.execute("ALTER TABLE payments ADD COLUMN customer_id INTEGER")
+        cursor.execute("UPDATE payments SET customer_id = "
+                       "(SELECT customer_id FROM credit_transactions WHERE id = payments.transaction_id)")
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_payments_customer_insert AFTER INSERT ON payments
+        WHEN NEW.customer_id IS NULL
+        BEGIN
+            UPDATE payments SET customer_id = (SELECT customer_id FROM credit_transactions WHERE id = NEW.transaction_id)
+            WHERE id = NEW.id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_payments_customer_update AFTER UPDATE OF customer_id ON credit_transactions
+        BEGIN UPDATE payments SET customer_id = NEW.customer_id WHERE transaction_id = NEW.id; END
+    ''')
+
+def create_indexes(cursor):
+    """Indexes backing per-customer history and per-transaction totals."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ct_customer_date ON credit_transactions (customer_id, date, id)")
+    # covering: per-transaction totals and the per-product analytics read items from the index alone
+    cursor.execute("""CREATE INDEX IF NOT EXISTS idx_ci_transaction_product
+                      ON credit_items (transaction_id, product_id, quantity, unit_price_cents, total_price_cents)""")
+    cursor.execute("DROP INDEX IF EXISTS idx_ci_transaction")          # superseded by the covering index
+    cursor.execute("DROP INDEX IF EXISTS idx_ci_product_transaction")  # product-first: scanned every item for any period
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_payments_transaction_date ON payments (transaction_id, date, id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_payments_customer_date ON payments (customer_id, date, id)")
+    # partial index: only open (not Paid) transactions, so finding a customer's
+    # current account is one seek however long their history is
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ct_open ON credit_transactions (customer_id, date, id) WHERE status != 'Paid'")
+    # transactions in a date range (per-product analytics)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ct_date ON credit_transactions (date, id)")
+
+def create_ledger_version(cursor):
+    """A one-row counter bumped by triggers on every write that can move a
+    balance, so in-memory caches can tell cheaply whether they are stale."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS ledger_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO ledger_version (id, version) VALUES (1, 0)")
+    for table, event in [("credit_items", "INSERT"), ("credit_items", "UPDATE"), ("credit_items", "DELETE"),
+                         ("payments", "INSERT"), ("payments", "UPDATE"), ("payments", "DELETE"),
+                         ("credit_transactions", "UPDATE OF customer_id"), ("credit_transactions", "DELETE")]:
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_version_{table}_{event.split()[0].lower()}
+            AFTER {event} ON {table}
+            BEGIN UPDATE ledger_version SET version = version + 1 WHERE id = 1; END
+        ''')
+
+def create_products_version(cursor):
+    """Like ledger_version, for the product list (names, prices, soft deletes),
+    so caches of product analytics see catalogue edits too."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS products_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO products_version (id, version) VALUES (1, 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_products_version_{event.lower()}
+            AFTER {event} ON products
+            BEGIN UPDATE products_version SET version = version + 1 WHERE id = 1; END
+        ''')
+
+# ---------- Customer balances ----------
+# Outstanding balance per customer (items minus payments), kept up to date by
+# triggers, so reading a balance never aggregates the ledger.
+_BALANCE_UPSERT = '''
+    INSERT INTO customer_balances (customer_id, balance_cents) {select}
+    ON CONFLICT (customer_id) DO UPDATE SET balance_cents = balance_cents + excluded.balance_cents;
+'''
+_BALANCE_DELTA = "SELECT customer_id, {sign}{row}.{column} FROM credit_transactions WHERE id = {row}.transaction_id"
+
+def create_customer_balances(cursor):
+    new = cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'customer_balances'").fetchone() is None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS customer_balances (
+            customer_id INTEGER PRIMARY KEY,
+            balance_cents INTEGER NOT NULL
+        )
+    ''')
+    for table, column, sign in [("credit_items", "total_price_cents", ""), ("payments", "amount_cents", "-")]:
+        negated = "" if sign else "-"
+        for event, rows in [("INSERT", [("NEW", sign)]), ("DELETE", [("OLD", negated)]),
+                            ("UPDATE", [("OLD", negated), ("NEW", sign)])]:
+            body = "".join(_BALANCE_UPSERT.format(select=_BALANCE_DELTA.format(row=row, sign=row_sign, column=column))
+                           for row, row_sign in rows)
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_balance_{table}_{event.lower()} AFTER {event} ON {table}
+                BEGIN {body} END
+            ''')
+    # a cascaded delete removes items and payments after their transaction is
+    # gone, when they can no longer be traced to a customer: take the
+    # transaction's balance off before it goes
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_balance_credit_transactions_delete BEFORE DELETE ON credit_transactions
+        BEGIN {_BALANCE_UPSERT.format(select=
+            "SELECT OLD.customer_id, "
+            "-COALESCE((SELECT SUM(total_price_cents) FROM credit_items WHERE transaction_id = OLD.id), 0) "
+            "+ COALESCE((SELECT SUM(amount_cents) FROM payments WHERE transaction_id = OLD.id), 0) WHERE true")} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_balance_credit_transactions_update AFTER UPDATE OF customer_id ON credit_transactions
+        WHEN OLD.customer_id != NEW.customer_id
+        BEGIN {"".join(_BALANCE_UPSERT.format(select=
+            f"SELECT {row}.customer_id, {sign}(COALESCE((SELECT SUM(total_price_cents) FROM credit_items "
+            f"WHERE transaction_id = NEW.id), 0) - COALESCE((SELECT SUM(amount_cents) FROM payments "
+            f"WHERE transaction_id = NEW.id), 0)) WHERE true") for row, sign in [("OLD", "-"), ("NEW", "")])} END
+    ''')
+    if new:
+        fill_customer_balances(cursor)
+
+def fill_customer_balances(cursor):
+    """Recompute customer_balances from the ledger."""
+    cursor.execute("DELETE FROM customer_balances")
+    cursor.execute('''
+        INSERT INTO customer_balances (customer_id, balance_cents)
+        SELECT ct.customer_id, SUM(m.cents)
+        FROM (SELECT transaction_id, total_price_cents AS cents FROM credit_items
+              UNION ALL
+              SELECT transaction_id, -amount_cents FROM payments) m
+        JOIN credit_transactions ct ON ct.id = m.transaction_id
+        GROUP BY ct.customer_id
+    ''')
+
+# ---------- Daily rollups ----------
+# Credit issued (by transaction date) and collected (by payment date and method)
+# per day, kept up to date by triggers. archive.py sets ROLLUPS_PAUSED_KEY in
+# settings for the length of its transaction, so moving rows to the archive
+# does not subtract them from history.
+ROLLUPS_PAUSED_KEY = "rollups_paused"
+
+_ROLLUP_UPSERT = '''
+    INSERT INTO daily_rollups (day, kind, method, amount_cents) {select}
+    ON CONFLICT (day, kind, method) DO UPDATE SET amount_cents = amount_cents + excluded.amount_cents;
+'''
+_ROLLUP_ISSUED = "SELECT substr(date, 1, 10), 'issued', '', {sign}{row}.total_price_cents FROM credit_transactions WHERE id = {row}.transaction_id"
+_ROLLUP_COLLECTED = "SELECT substr({row}.date, 1, 10), 'collected', {row}.method, {sign}{row}.amount_cents WHERE true"
+
+def create_rollups(cursor):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_rollups (
+            day TEXT NOT NULL,
+            kind TEXT NOT NULL,           -- 'issued' or 'collected'
+            method TEXT NOT NULL DEFAULT '',
+            amount_cents INTEGER NOT NULL,
+            PRIMARY KEY (day, kind, method)
+        ) WITHOUT ROWID
+    ''')
+    for table, select in [("credit_items", _ROLLUP_ISSUED), ("payments", _ROLLUP_COLLECTED)]:
+        for event, rows in [("INSERT", [("NEW", "")]), ("DELETE", [("OLD", "-")]),
+                            ("UPDATE", [("OLD", "-"), ("NEW", "")])]:
+            body = "".join(_ROLLUP_UPSERT.format(select=select.format(row=row, sign=sign)) for row, sign in rows)
+            cursor.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_rollup_{table}_{event.lower()} AFTER {event} ON {table}
+                WHEN NOT EXISTS (SELECT 1 FROM settings WHERE key = '{ROLLUPS_PAUSED_KEY}')
+                BEGIN {body} END
+            ''')
+    # a cascaded delete removes the items after their transaction is gone, so
+    # take the transaction's items out of its day before it goes
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_rollup_credit_transactions_delete BEFORE DELETE ON credit_transactions
+        WHEN NOT EXISTS (SELECT 1 FROM settings WHERE key = '{ROLLUPS_PAUSED_KEY}')
+        BEGIN {_ROLLUP_UPSERT.format(select=
+            "SELECT substr(OLD.date, 1, 10), 'issued', '', -SUM(total_price_cents) FROM credit_items "
+            "WHERE transaction_id = OLD.id HAVING COUNT(*) > 0")} END
+    ''')
+
+def fill_rollups(cursor, source=lambda table: table):
+    """Recompute daily_rollups from scratch. `source` maps a table name to the
+    FROM source to read (see archive.table_source for hot + archive)."""
+    cursor.execute("DELETE FROM daily_rollups")
+    cursor.execute(f'''
+        INSERT INTO daily_rollups (day, kind, method, amount_cents)
+        SELECT substr(ct.date, 1, 10), 'issued', '', SUM(ci.total_price_cents)
+        FROM {source("credit_items")} ci JOIN {source("credit_transactions")} ct ON ct.id = ci.transaction_id
+        GROUP BY 1
+    ''')
+    cursor.execute(f'''
+        INSERT INTO daily_rollups (day, kind, method, amount_cents)
+        SELECT substr(date, 1, 10), 'collected', method, SUM(amount_cents)
+        FROM {source("payments")}
+        GROUP BY 1, 3
+    ''')
+
 def init_db():
+    """Create and migrate the schema. Runs once per process; later calls are free."""
+    global _db_ready
+    if _db_ready:
+        return
     conn = create_connection()
+    conn.execute("PRAGMA foreign_keys = OFF")  # migrations below rewrite referenced tables
+    enable_wal(conn)
     c = conn.cursor()
 
     # Customers table
@@ -28,13 +441,15 @@ def init_db():
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
+    add_column_if_missing(c, "customers", "credit_limit_cents", "INTEGER")  # NULL = no limit
+    add_column_if_missing(c, "customers", "deleted_at", "TIMESTAMP")        # soft delete
 
     # Products table
     c.execute('''
         CREATE TABLE IF NOT EXISTS products (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             name TEXT NOT NULL,
-            price REAL NOT NULL,
+            price_cents INTEGER NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
@@ -45,8 +460,8 @@ def init_db():
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             customer_id INTEGER NOT NULL,
             date TEXT NOT NULL,
-            status TEXT DEFAULT 'Unpaid',
-            FOREIGN KEY (customer_id) REFERENCES customers (id)
+            status TEXT NOT NULL DEFAULT 'Unpaid',
+            FOREIGN KEY (customer_id) REFERENCES customers (id) ON DELETE RESTRICT
         )
     ''')
 
@@ -57,10 +472,10 @@ def init_db():
             transaction_id INTEGER NOT NULL,
             product_id INTEGER NOT NULL,
             quantity INTEGER NOT NULL,
-            unit_price REAL NOT NULL,
-            total_price REAL NOT NULL,
-            FOREIGN KEY (transaction_id) REFERENCES credit_transactions (id),
-            FOREIGN KEY (product_id) REFERENCES products (id)
+            unit_price_cents INTEGER NOT NULL,
+            total_price_cents INTEGER NOT NULL,
+            FOREIGN KEY (transaction_id) REFERENCES credit_transactions (id) ON DELETE CASCADE,
+            FOREIGN KEY (product_id) REFERENCES products (id) ON DELETE RESTRICT
         )
     ''')
 
@@ -69,17 +484,104 @@ def init_db():
         CREATE TABLE IF NOT EXISTS payments (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             transaction_id INTEGER NOT NULL,
-            amount REAL,
-            method TEXT,
-            date TEXT,
-            FOREIGN KEY (transaction_id) REFERENCES credit_transactions (id)
+            amount_cents INTEGER NOT NULL,
+            method TEXT NOT NULL DEFAULT 'Cash',
+            date TEXT NOT NULL DEFAULT '',
+            FOREIGN KEY (transaction_id) REFERENCES credit_transactions (id) ON DELETE CASCADE
+        )
+    ''')
+
+    # Shop-wide settings
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+
+    # Credit refused by a limit check, kept for review
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS credit_blocks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_id INTEGER NOT NULL,
+            attempted_cents INTEGER NOT NULL,
+            balance_cents INTEGER NOT NULL,
+            limit_cents INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+    # Results of API writes, replayed when a client retries with the same key
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS idempotency_keys (
+            scope TEXT NOT NULL,
+            key TEXT NOT NULL,
+            response TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (scope, key)
+        )
+    ''')
+
+    # Imported mobile-money / bank statement lines; 'review' ones wait for a person
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS statement_lines (
+            reference TEXT PRIMARY KEY,
+            date TEXT NOT NULL,
+            amount_cents INTEGER NOT NULL,
+            phone TEXT,
+            details TEXT,
+            status TEXT NOT NULL,
+            note TEXT,
+            customer_id INTEGER,
+            allocation TEXT,
+            imported_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_statement_review ON statement_lines (date) WHERE status = 'review'")
+
+    # One reminder per customer per day; failed ones may be retried the same day
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS reminders_sent (
+            customer_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL,
+            balance_cents INTEGER NOT NULL,
+            error TEXT,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (customer_id, day)
+        )
+    ''')
+
+    # Repayment-behaviour scores, replaced wholesale by the nightly scoring.py run
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS customer_scores (
+            customer_id INTEGER PRIMARY KEY,
+            avg_days_to_settle REAL,
+            repayment_ratio REAL NOT NULL,
+            overdue_days INTEGER NOT NULL,
+            velocity_cents INTEGER NOT NULL,
+            score INTEGER NOT NULL,
+            band TEXT NOT NULL,
+            scored_at TEXT NOT NULL
         )
     ''')
 
-    # ---- Migration: ensure all required columns exist ----
-    add_column_if_missing(c, "payments", "amount", "REAL NOT NULL DEFAULT 0")
-    add_column_if_missing(c, "payments", "method", "TEXT NOT NULL DEFAULT 'Cash'")
-    add_column_if_missing(c, "payments", "date", "TEXT NOT NULL DEFAULT ''")
+    # ---- Migration: bring older databases up to date ----
+    repair_blob_ids(c)
+    migrate_money_to_cents(c)
+    add_column_if_missing(c, "products", "deleted_at", "TIMESTAMP")         # soft delete
+    migrate_foreign_keys(conn)
+    add_payment_customers(c)
+    create_indexes(c)
+    create_ledger_version(c)
+    create_products_version(c)
+    create_customer_balances(c)
+    create_rollups(c)
+    if c.execute("SELECT 1 FROM daily_rollups LIMIT 1").fetchone() is None:
+        fill_rollups(c)
 
     conn.commit()
     conn.close()
+    _db_ready = True
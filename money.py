@@ -0,0 +1,44 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+# All money is stored and summed as integer cents (Kshs * 100).
+# Convert at the edges: to_cents() on input from widgets, format_kshs() for display.
+
+CURRENCY = "Kshs"
+
+
+def to_cents(amount):
+    """Convert a Kshs amount (float/str/Decimal) to integer cents, rounding half up."""
+    if amount is None:
+        return 0
+    return int((Decimal(str(amount)) * 100).quantize(Decimal("1"), rounding=ROUND_HALF_UP))
+
+
+def to_amount(cents):
+    """Convert integer cents back to a Kshs float (for widgets and exports)."""
+    return (cents or 0) / 100
+
+
+def format_kshs(cents, currency=CURRENCY):
+    """Format integer cents as e.g. 'Kshs 1,234.50'."""
+    cents = int(cents or 0)
+    sign = "-" if cents < 0 else ""
+    whole, frac = divmod(abs(cents), 100)
+    return f"{currency} {sign}{whole:,}.{frac:02d}"
+
+
+def line_total(qty, unit_cents):
+    """Total for a line item; exact because both factors are integers."""
+    return int(qty) * int(unit_cents)
+
+
+def format_kshs_many(cents, currency=CURRENCY, blank_zero=False):
+    """
+    Format a whole column of cents (Series, array or list) in one pass; same
+    output as format_kshs. Returns a list, ready to assign to a display column.
+    Cents / 100 is exact to two places for any realistic amount.
+    """
+    values = cents.tolist() if hasattr(cents, "tolist") else list(cents)
+    fmt = f"{currency} {{:,.2f}}".format
+    if blank_zero:
+        return [fmt(c / 100) if c else "" for c in values]
+    return [fmt((c or 0) / 100) for c in values]
@@ -1,6 +1,17 @@
+import os
+import subprocess
+import sys
 import streamlit as st
-import pandas as pd
-from database import create_connection
+import reminders
+import scoring
+from database import init_db
+from money import format_kshs, format_kshs_many, to_amount, to_cents
+from repository import (
+    OPEN_TX_POLICIES, add_customer, delete_customer, fetch_all_customers, fetch_credit_blocks, fetch_exposure,
+    fetch_exposure_cap, fetch_open_tx_policy, fetch_overdue_customers, fetch_reminder_summary, fetch_scored_at,
+    set_credit_limit, set_exposure_cap, set_open_tx_policy,
+)
+from scoring import VELOCITY_DAYS, risk_label
 
 
 if "logged_in" not in st.session_state or not st.session_state.logged_in:
@@ -12,24 +23,29 @@ if st.button("🚪 Logout"):
     st.session_state.logged_in = False
     st.switch_page("pages/0_🔑_Login.py")
 
+init_db()
 
+OPEN_TX_POLICY_LABELS = {
+    "until_paid": "The customer's open transaction, until it is paid off",
+    "per_day": "One transaction per lending day",
+    "new": "A new transaction every time",
+}
 
+# background jobs started from this page ({name: Popen}), shared by all sessions of this server;
+# they run as their own processes so a long run never blocks the page
+@st.cache_resource
+def background_jobs():
+    return {}
 
+def job_running(name):
+    process = background_jobs().get(name)
+    return process is not None and process.poll() is None
 
-# Connect to the database
-conn = create_connection()
-
-# --- Database Functions ---
-def add_customer(name, phone):
-    conn.execute("INSERT INTO customers (name, phone) VALUES (?, ?)", (name, phone))
-    conn.commit()
-
-def get_customers():
-    return pd.read_sql_query("SELECT * FROM customers ORDER BY created_at DESC", conn)
-
-def delete_customer(customer_id):
-    conn.execute("DELETE FROM customers WHERE id = ?", (customer_id,))
-    conn.commit()
+def start_job(name, args, log_path):
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    with open(log_path, "a") as log:
+        background_jobs()[name] = subprocess.Popen([sys.executable, *args], stdout=log, stderr=subprocess.STDOUT,
+                                                   start_new_session=True)
 
 # --- Streamlit UI ---
 st.title("📇 Customer Management")
@@ -52,10 +68,94 @@ st.markdown("---")
 
 # Display customer list
 st.subheader("📋 List of Customers")
-customers = get_customers()
+customers = fetch_all_customers()
 
 if not customers.empty:
+    limits = customers.pop("credit_limit_cents")
+    customers["credit_limit"] = format_kshs_many(limits.fillna(0))
+    customers.loc[limits.isna(), "credit_limit"] = "No limit"
+    # repayment behaviour from the nightly scoring run (blank until a customer has credit)
+    customers["risk"] = [risk_label(band, score) for band, score in zip(customers["risk"], customers.pop("score"))]
+    customers["repaid"] = [f"{r:.0%}" if r == r else "" for r in customers.pop("repayment_ratio").astype(float)]
+    velocity = customers.pop("velocity_cents")
+    customers[f"credit_last_{VELOCITY_DAYS}_days"] = format_kshs_many(velocity.fillna(0).astype(int))
+    customers.loc[velocity.isna(), f"credit_last_{VELOCITY_DAYS}_days"] = ""
     st.dataframe(customers, use_container_width=True)
+    scored_at = fetch_scored_at()
+    scol1, scol2 = st.columns([4, 1])
+    with scol1:
+        st.caption(f"Risk scores as of {scored_at} (refreshed nightly by `python scoring.py`)." if scored_at
+                   else "No risk scores yet — they are computed nightly by `python scoring.py`.")
+    with scol2:
+        scoring_running = job_running("scoring")
+        st.button("📊 Rescore now", disabled=scoring_running, on_click=start_job,
+                  args=("scoring", [scoring.__file__], os.path.join("data", "outbox", "scoring.log")),
+                  help="Runs scoring.py in the background; reload the page when it is done")
+        if scoring_running:
+            st.caption("Scoring in progress…")
+
+    with st.expander("💳 Credit Limits"):
+        limit_names = customers["name"] + " (ID: " + customers["id"].astype(str) + ")"
+        limit_choice = st.selectbox("Customer", limit_names, key="limit_customer")
+        limit_idx = limit_names[limit_names == limit_choice].index[0]
+        has_limit = bool(limits.notna()[limit_idx])
+        no_limit = st.checkbox("No limit", value=not has_limit, key="limit_none")
+        new_limit = st.number_input("Credit limit (Kshs)", min_value=0.00, format="%.2f",
+                                    value=to_amount(int(limits[limit_idx])) if has_limit else 0.0, disabled=no_limit)
+        if st.button("Save Limit"):
+            set_credit_limit(int(customers.at[limit_idx, "id"]), None if no_limit else to_cents(new_limit))
+            st.success("Credit limit saved.")
+            st.rerun()
+
+        st.markdown("---")
+        cap = fetch_exposure_cap()
+        st.write(f"**Total outstanding across all customers:** {format_kshs(fetch_exposure())}")
+        no_cap = st.checkbox("No shop-wide cap", value=cap is None, key="cap_none")
+        new_cap = st.number_input("Shop exposure cap (Kshs)", min_value=0.00, format="%.2f",
+                                  value=to_amount(cap or 0), disabled=no_cap)
+        if st.button("Save Cap"):
+            set_exposure_cap(None if no_cap else to_cents(new_cap))
+            st.success("Exposure cap saved.")
+            st.rerun()
+
+        st.markdown("---")
+        policy = fetch_open_tx_policy()
+        new_policy = st.selectbox("New credit goes into", OPEN_TX_POLICIES, index=OPEN_TX_POLICIES.index(policy),
+                                  format_func=OPEN_TX_POLICY_LABELS.get, key="open_tx_policy")
+        if st.button("Save Policy"):
+            set_open_tx_policy(new_policy)
+            st.success("Open transaction policy saved.")
+            st.rerun()
+
+    with st.expander("⛔ Blocked Credit Attempts"):
+        blocks = fetch_credit_blocks()
+        if blocks.empty:
+            st.info("No credit has been blocked.")
+        else:
+            for col in ("attempted_cents", "balance_cents", "limit_cents"):
+                blocks[col[:-len("_cents")]] = format_kshs_many(blocks.pop(col))
+            st.dataframe(blocks, use_container_width=True, hide_index=True)
+
+    # built only while open: selecting overdue customers aggregates the whole ledger
+    reminder_panel = st.expander("📣 Payment Reminders", key="reminders_open", on_change="rerun")
+    if reminder_panel.open:
+        with reminder_panel:
+            overdue_days = st.number_input("Remind about credit older than (days)", min_value=1, value=30)
+            due, skipped = reminders.build_reminders(fetch_overdue_customers(int(overdue_days)))
+            sent_today = fetch_reminder_summary()
+            st.write(f"**{len(due)}** customer(s) to remind — {skipped['reminded_today']} already reminded today, "
+                     f"{skipped['no_phone']} without a phone number. Today so far: "
+                     f"{sent_today.get('sent', 0)} sent, {sent_today.get('failed', 0)} failed.")
+            if due:
+                st.caption(f"e.g. {due[0].text}")
+            # one run at a time from here (runs started elsewhere are kept apart by their claims)
+            running = job_running("reminders")
+            log_path = os.path.join("data", "outbox", "reminders.log")
+            if running:
+                st.info(f"A reminder run is in progress; progress is logged to {log_path}.")
+            if st.button("📣 Send reminders in the background", disabled=running or not due):
+                start_job("reminders", [reminders.__file__, "--days", str(int(overdue_days))], log_path)
+                st.success(f"Sending {len(due)} reminder(s); progress is logged to {log_path}.")
 
     with st.expander("🗑️ Delete Customer"):
         customer_names = customers["name"] + " (ID: " + customers["id"].astype(str) + ")"
@@ -63,6 +163,6 @@ if not customers.empty:
         if st.button("Delete Selected Customer"):
             selected_id = int(selected.split("ID: ")[1].replace(")", ""))
             delete_customer(selected_id)
-            st.success("Customer deleted. Refresh the page to update the list.")
+            st.success("Customer removed from the lists; their credit history is kept.")
 else:
     st.info("No customers found.")
@@ -1,6 +1,17 @@
 import streamlit as st
-import pandas as pd
-from database import create_connection
+import plotly.express as px
+from datetime import date, timedelta
+from database import init_db
+from money import format_kshs_many, to_cents
+from repository import (
+    add_product, delete_product, fetch_all_products, fetch_ledger_version, fetch_product_stats, fetch_products_version,
+)
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def product_stats(start, end, ledger_version, products_version):
+    # the versions are only part of the cache key: any item write or product edit starts a new entry
+    return fetch_product_stats(start, end)
 
 
 
@@ -13,23 +24,7 @@ if st.button("🚪 Logout"):
     st.session_state.logged_in = False
     st.switch_page("pages/0_🔑_Login.py")
 
-
-
-
-# Connect to the database
-conn = create_connection()
-
-# --- Database Functions ---
-def add_product(name, price):
-    conn.execute("INSERT INTO products (name, price) VALUES (?, ?)", (name, price))
-    conn.commit()
-
-def get_products():
-    return pd.read_sql_query("SELECT * FROM products ORDER BY created_at DESC", conn)
-
-def delete_product(product_id):
-    conn.execute("DELETE FROM products WHERE id = ?", (product_id,))
-    conn.commit()
+init_db()
 
 # --- Streamlit UI ---
 st.title("📦 Product Management")
@@ -50,18 +45,18 @@ with st.form("add_product_form"):
         if name.strip() == "" or price <= 0:
             st.warning("Both Product Name and Price are required.")
         else:
-            add_product(name.strip(), price)
+            add_product(name.strip(), to_cents(price))
             st.success(f"Product '{name}' added successfully at Kshs. {price:.2f}.")
 
 st.markdown("---")
 
 # Display product list
 st.subheader("📋 List of Products")
-products = get_products()
+products = fetch_all_products()
 
 if not products.empty:
     # Format price with Kshs. and 2 decimals
-    products["price"] = products["price"].apply(lambda x: f"Kshs. {x:,.2f}")
+    products.insert(2, "price", format_kshs_many(products.pop("price_cents"), "Kshs."))
     st.dataframe(products, use_container_width=True)
 
     with st.expander("🗑️ Delete Product"):
@@ -70,7 +65,40 @@ if not products.empty:
         if st.button("Delete Selected Product"):
             selected_id = int(selected.split("ID: ")[1].replace(")", ""))
             delete_product(selected_id)
-            st.success("Product deleted. Refresh the page to update the list.")
+            st.success("Product removed from the lists; past credit items keep it.")
 else:
     st.info("No products found.")
 
+st.markdown("---")
+
+# Product analytics
+st.subheader("📊 Product Analytics")
+acol1, acol2, acol3 = st.columns([2, 1, 1])
+with acol1:
+    period = st.date_input("Period", value=(date.today() - timedelta(days=30), date.today()), key="analytics_period")
+with acol2:
+    top_n = st.number_input("Top N", min_value=1, max_value=100, value=10)
+with acol3:
+    rank_by = st.selectbox("Rank by", ["Value lent", "Units"])
+
+if isinstance(period, tuple) and len(period) == 2:
+    start, end = period[0].strftime("%Y-%m-%d"), (period[1] + timedelta(days=1)).strftime("%Y-%m-%d")
+    stats = product_stats(start, end, fetch_ledger_version(), fetch_products_version())
+    if stats.empty:
+        st.info("No credit lent in this period.")
+    else:
+        days = (period[1] - period[0]).days + 1
+        top = stats.sort_values("value_cents" if rank_by == "Value lent" else "units", ascending=False).head(int(top_n))
+        top = top.assign(units_per_day=(top["units"] / days).round(2))
+        st.plotly_chart(px.bar(top.assign(kshs=top["value_cents"] / 100), x="name",
+                               y="kshs" if rank_by == "Value lent" else "units",
+                               labels={"name": "Product", "kshs": "Kshs", "units": "Units"}),
+                        use_container_width=True)
+        display = top[["name", "units", "transactions", "avg_qty", "units_per_day"]].copy()
+        display.insert(2, "value", format_kshs_many(top["value_cents"], "Kshs."))
+        display["list_price"] = format_kshs_many(top["price_cents"], "Kshs.")
+        display["price_overrides"] = top["overrides"].astype(str) + " (" + (top["override_rate"] * 100).round(1).astype(str) + "%)"
+        st.dataframe(display, use_container_width=True, hide_index=True)
+else:
+    st.info("Pick a start and end date.")
+
@@ -1,33 +1,23 @@
 # 3_💳_Credit_Transactions.py
 import streamlit as st
-import sqlite3
+from streamlit.errors import StreamlitAPIException
 import pandas as pd
 from datetime import datetime, date
+from functools import partial
 from io import BytesIO
-import os
-
-# Try to import PDF libraries
-_pdf_backend = None
-try:
-    # ReportLab preferred, import platypus helpers too
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib.units import mm
-    from reportlab.pdfgen import canvas
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    from reportlab.lib.styles import getSampleStyleSheet
-    from reportlab.lib import colors
-    _pdf_backend = "reportlab"
-except Exception:
-    try:
-        from fpdf import FPDF
-        _pdf_backend = "fpdf"
-    except Exception:
-        _pdf_backend = None
-
-# ---------- Config ----------
-DB_PATH = "data/shop.db"
-if not os.path.exists("data"):
-    os.makedirs("data")
+from database import init_db, submit_read
+from money import format_kshs, format_kshs_many, line_total, to_amount, to_cents
+from analytics import LedgerSnapshot
+from repository import (
+    CreditRefused, delete_payment, delete_transaction, fetch_account, fetch_credit_limit,
+    fetch_customer_balance, fetch_customer_picker, fetch_grouped_accounts, fetch_items_with_names, fetch_payments,
+    fetch_products,
+    payment_receipt_data, recompute_all_statuses, record_payment, save_credit_items_for_customer,
+    settle_transactions, transaction_receipt_data, update_credit_item,
+)
+from receipts import RECEIPT_FORMATS, pdf_backend, render_receipt
+from scoring import risk_label
+from reporting import REPORT_MAX_AGE_SECONDS, connect_report, describe_age, refresh_snapshot, snapshot_age
 
 st.set_page_config(page_title="Credit Transactions", page_icon="💳", layout="wide")
 st.title("💳 Credit Transactions — All-in-One")
@@ -41,272 +31,64 @@ if st.button("🚪 Logout"):
     st.session_state.logged_in = False
     st.switch_page("pages/0_🔑_Login.py")
     
-# ---------- DB helpers & migration ----------
-def create_connection():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
-
-def migrate_schema():
-    conn = create_connection()
-    c = conn.cursor()
-
-    # customers
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS customers (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        phone TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )""")
-
-    # products
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS products (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        price REAL NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )""")
-
-    # credit_transactions
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS credit_transactions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        customer_id INTEGER NOT NULL,
-        date TEXT NOT NULL,
-        status TEXT NOT NULL DEFAULT 'Unpaid',
-        FOREIGN KEY (customer_id) REFERENCES customers(id)
-    )""")
-
-    # credit_items
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS credit_items (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        transaction_id INTEGER NOT NULL,
-        product_id INTEGER NOT NULL,
-        quantity INTEGER NOT NULL,
-        unit_price REAL NOT NULL,
-        total_price REAL NOT NULL,
-        FOREIGN KEY (transaction_id) REFERENCES credit_transactions(id),
-        FOREIGN KEY (product_id) REFERENCES products(id)
-    )""")
-
-    # payments
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS payments (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        transaction_id INTEGER NOT NULL,
-        amount REAL NOT NULL,
-        method TEXT NOT NULL,
-        date TEXT NOT NULL,
-        FOREIGN KEY (transaction_id) REFERENCES credit_transactions(id)
-    )""")
-
-    conn.commit()
-    conn.close()
-
-# Recalculate and update transaction status
-def recalc_balance(transaction_id):
-    conn = create_connection()
-    c = conn.cursor()
-    c.execute("SELECT COALESCE(SUM(total_price),0) FROM credit_items WHERE transaction_id=?", (transaction_id,))
-    total_credit = c.fetchone()[0] or 0.0
-    c.execute("SELECT COALESCE(SUM(amount),0) FROM payments WHERE transaction_id=?", (transaction_id,))
-    total_paid = c.fetchone()[0] or 0.0
-    balance = round(total_credit - total_paid, 2)
-    if balance <= 0:
-        c.execute("UPDATE credit_transactions SET status='Paid' WHERE id=?", (transaction_id,))
-    elif 0 < total_paid < total_credit:
-        c.execute("UPDATE credit_transactions SET status='Partially Paid' WHERE id=?", (transaction_id,))
-    else:
-        c.execute("UPDATE credit_transactions SET status='Unpaid' WHERE id=?", (transaction_id,))
-    conn.commit()
-    conn.close()
-    return balance
-
-# Insert a transaction and items (reuses open transaction)
-def save_credit_items_for_customer(customer_id, lending_date, items):
-    """items: list of dicts with keys product_id, qty, unit_price"""
-    conn = create_connection()
-    c = conn.cursor()
-    # find open transaction for this customer (Unpaid or Partially Paid) - use latest
-    c.execute("SELECT id FROM credit_transactions WHERE customer_id=? AND status!='Paid' ORDER BY date DESC LIMIT 1", (customer_id,))
-    row = c.fetchone()
-    if row:
-        tx_id = row[0]
-    else:
-        c.execute("INSERT INTO credit_transactions (customer_id, date, status) VALUES (?, ?, 'Unpaid')", (customer_id, lending_date))
-        tx_id = c.lastrowid
-
-    for it in items:
-        total_price = round(it['qty'] * it['unit_price'], 2)
-        c.execute("""
-            INSERT INTO credit_items (transaction_id, product_id, quantity, unit_price, total_price)
-            VALUES (?, ?, ?, ?, ?)
-        """, (tx_id, it['product_id'], it['qty'], it['unit_price'], total_price))
-    conn.commit()
-    conn.close()
-    recalc_balance(tx_id)
-    return tx_id
-
-# Insert payment and auto-recalc
-def record_payment(transaction_id, amount, method, payment_date):
-    conn = create_connection()
-    c = conn.cursor()
-    c.execute("INSERT INTO payments (transaction_id, amount, method, date) VALUES (?, ?, ?, ?)",
-              (transaction_id, amount, method, payment_date))
-    pid = c.lastrowid
-    conn.commit()
-    conn.close()
-    recalc_balance(transaction_id)
-    return pid
-
-def delete_payment(payment_id):
-    conn = create_connection()
-    c = conn.cursor()
-    c.execute("SELECT transaction_id FROM payments WHERE id=?", (payment_id,))
-    row = c.fetchone()
-    tid = row[0] if row else None
-    c.execute("DELETE FROM payments WHERE id=?", (payment_id,))
-    conn.commit()
-    conn.close()
-    if tid:
-        recalc_balance(tid)
-    return tid
-
-def update_credit_item(item_id, qty, unit_price):
-    conn = create_connection()
-    c = conn.cursor()
-    total_price = round(qty * unit_price, 2)
-    c.execute("SELECT transaction_id FROM credit_items WHERE id=?", (item_id,))
-    row = c.fetchone()
-    tid = row[0] if row else None
-    c.execute("UPDATE credit_items SET quantity=?, unit_price=?, total_price=? WHERE id=?", (qty, unit_price, total_price, item_id))
-    conn.commit()
-    conn.close()
-    if tid:
-        recalc_balance(tid)
-    return tid
-
-def delete_transaction(transaction_id):
-    conn = create_connection()
-    c = conn.cursor()
-    c.execute("DELETE FROM credit_items WHERE transaction_id=?", (transaction_id,))
-    c.execute("DELETE FROM payments WHERE transaction_id=?", (transaction_id,))
-    c.execute("DELETE FROM credit_transactions WHERE id=?", (transaction_id,))
-    conn.commit()
-    conn.close()
-
-# Fetchers
-def fetch_customers():
-    conn = create_connection()
-    df = pd.read_sql("SELECT id, name FROM customers ORDER BY name", conn)
-    conn.close()
-    return df
-
-def fetch_products():
-    conn = create_connection()
-    df = pd.read_sql("SELECT id, name, price FROM products ORDER BY name", conn)
-    conn.close()
-    return df
-
-def fetch_grouped_accounts(customer_filter=None, status_filter=None, start_date=None, end_date=None):
-    conn = create_connection()
-    query = """
-    SELECT
-      ct.id AS transaction_id,
-      cu.id AS customer_id,
-      cu.name AS customer_name,
-      ct.date,
-      ct.status,
-      COALESCE((SELECT SUM(ci.total_price) FROM credit_items ci WHERE ci.transaction_id = ct.id),0) AS total_amount,
-      COALESCE((SELECT SUM(p.amount) FROM payments p WHERE p.transaction_id = ct.id),0) AS total_paid,
-      COALESCE((SELECT SUM(ci.total_price) FROM credit_items ci WHERE ci.transaction_id = ct.id),0) - COALESCE((SELECT SUM(p.amount) FROM payments p WHERE p.transaction_id = ct.id),0) AS balance
-    FROM credit_transactions ct
-    JOIN customers cu ON ct.customer_id = cu.id
-    WHERE 1=1
-    """
-    params = []
-    if customer_filter and customer_filter != "All":
-        query += " AND cu.name = ?"
-        params.append(customer_filter)
-    if status_filter and status_filter != "All":
-        query += " AND ct.status = ?"
-        params.append(status_filter)
-    if start_date:
-        query += " AND ct.date >= ?"
-        params.append(start_date.strftime("%Y-%m-%d"))
-    if end_date:
-        query += " AND ct.date <= ?"
-        params.append(end_date.strftime("%Y-%m-%d"))
-    query += " ORDER BY ct.date DESC"
-    df = pd.read_sql(query, create_connection(), params=params)
-    return df
-
-def fetch_items(transaction_id):
-    conn = create_connection()
-    df = pd.read_sql("SELECT id, product_id, quantity, unit_price, total_price FROM credit_items WHERE transaction_id = ?", conn, params=(transaction_id,))
-    conn.close()
-    return df
-
-def fetch_items_with_names(transaction_id):
-    conn = create_connection()
-    df = pd.read_sql("""
-        SELECT ci.id, ci.product_id, p.name AS product, ci.quantity, ci.unit_price, ci.total_price
-        FROM credit_items ci JOIN products p ON ci.product_id = p.id
-        WHERE ci.transaction_id = ?
-    """, conn, params=(transaction_id,))
-    conn.close()
-    return df
-
-def fetch_payments(transaction_id):
-    conn = create_connection()
-    df = pd.read_sql("SELECT id, amount, method, date FROM payments WHERE transaction_id = ? ORDER BY date DESC", conn, params=(transaction_id,))
-    conn.close()
-    return df
+# ---------- Data ----------
+# Columnar ledger snapshot shared by all sessions, topped up incrementally on each rerun.
+# It reads the reporting snapshot (see reporting.py), not the database cashiers write to.
+@st.cache_resource
+def ledger_snapshot():
+    return LedgerSnapshot(connect=connect_report)
+
+def fetch_top_owed(limit=10):
+    return snapshot.refresh().top_owed(limit)
+
+def accounts_workbook(customer_filter, status_filter, only_with_balance):
+    """Excel export of the grouped accounts, read from the reporting snapshot
+    when the button is clicked."""
+    conn = connect_report()
+    try:
+        grouped = fetch_grouped_accounts(customer_filter, status_filter, conn=conn)
+    finally:
+        conn.close()
+    if only_with_balance:
+        grouped = grouped[grouped['balance_cents'] > 0]
+    export_df = pd.DataFrame({
+        "Transaction ID": grouped['transaction_id'].astype(int),
+        "Customer": grouped['customer_name'],
+        "Date": grouped['date'],
+        "Status": grouped['status'],
+        "Total": grouped['total_cents'].map(to_amount),
+        "Paid": grouped['paid_cents'].map(to_amount),
+        "Balance": grouped['balance_cents'].map(to_amount),
+    })
+    excel_buf = BytesIO()
+    with pd.ExcelWriter(excel_buf, engine='openpyxl') as writer:
+        export_df.to_excel(writer, index=False, sheet_name="Accounts")
+    return excel_buf.getvalue()
+
 
 # ----------------- NEW / UPDATED RECEIPT FUNCTIONS -----------------
-def generate_payment_receipt_bytes(payment_id):
+def generate_payment_receipt_bytes(payment_id, fmt="pdf"):
     """
     Generate a styled PDF receipt for a payment, including the list of products in that transaction.
+    Other formats (see receipts.RECEIPT_FORMATS) give thermal-printer text or ESC/POS bytes.
     Returns bytes or None.
     """
-    conn = create_connection()
-    c = conn.cursor()
-    c.execute("""
-        SELECT p.id, p.amount, p.method, p.date, p.transaction_id, cu.name, ct.status
-        FROM payments p
-        JOIN credit_transactions ct ON p.transaction_id = ct.id
-        JOIN customers cu ON ct.customer_id = cu.id
-        WHERE p.id = ?
-    """, (payment_id,))
-    row = c.fetchone()
-    conn.close()
-    if not row:
+    data = payment_receipt_data(payment_id)
+    if not data:
         return None
-    pid, amount, method, pdate, txid, customer_name, tx_status = row
-
-    # fetch items for this transaction (include transaction date for purchase date)
-    conn2 = create_connection()
-    c2 = conn2.cursor()
-    c2.execute("""
-        SELECT p.name, ci.quantity, ci.unit_price, ci.total_price, ct.date
-        FROM credit_items ci
-        JOIN products p ON ci.product_id = p.id
-        JOIN credit_transactions ct ON ci.transaction_id = ct.id
-        WHERE ci.transaction_id = ?
-        ORDER BY ct.date ASC, p.name ASC
-    """, (txid,))
-    items = c2.fetchall()
-
-    # totals for the whole transaction
-    c2.execute("SELECT COALESCE(SUM(total_price),0) FROM credit_items WHERE transaction_id=?", (txid,))
-    total_tx = c2.fetchone()[0] or 0.0
-    c2.execute("SELECT COALESCE(SUM(amount),0) FROM payments WHERE transaction_id=?", (txid,))
-    total_paid = c2.fetchone()[0] or 0.0
-    conn2.close()
-
-    # Build PDF with ReportLab (preferred) or FPDF fallback
-    if _pdf_backend == "reportlab":
+    if fmt != "pdf":
+        return render_receipt(data, fmt, "payment")
+    # items include the transaction date as purchase date; totals cover the whole transaction
+    header, items, total_tx, total_paid = data
+    pid, amount, method, pdate, txid, customer_name, tx_status = header
+
+    # Build PDF with ReportLab (preferred) or FPDF fallback, imported on the first receipt
+    if pdf_backend() == "reportlab":
+        from reportlab.lib import colors
+        from reportlab.lib.pagesizes import A4
+        from reportlab.lib.styles import getSampleStyleSheet
+        from reportlab.lib.units import mm
+        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
         buffer = BytesIO()
         doc = SimpleDocTemplate(buffer, pagesize=A4,
                                 leftMargin=12*mm, rightMargin=12*mm,
@@ -326,18 +108,18 @@ def generate_payment_receipt_bytes(payment_id):
         elements.append(Paragraph(f"<b>Status:</b> {tx_status}", small))
         elements.append(Paragraph(f"<b>Payment Method:</b> {method}", small))
         elements.append(Paragraph(f"<b>Payment Date:</b> {pdate}", small))
-        elements.append(Paragraph(f"<b>Amount Paid:</b> Kshs {amount:,.2f}", small))
+        elements.append(Paragraph(f"<b>Amount Paid:</b> {format_kshs(amount)}", small))
         elements.append(Spacer(1, 8))
 
         # Products table header + rows
         data = [["Product", "Qty", "Unit Price", "Total", "Date Purchased"]]
         for it in items:
             pname, qty, up, totp, datep = it
-            data.append([pname, str(qty), f"Kshs {up:,.2f}", f"Kshs {totp:,.2f}", str(datep)])
+            data.append([pname, str(qty), f"{format_kshs(up)}", f"{format_kshs(totp)}", str(datep)])
 
         # Totals rows
-        data.append(["", "", "Total Transaction:", f"Kshs {total_tx:,.2f}", ""])
-        data.append(["", "", "Total Paid (incl this):", f"Kshs {total_paid:,.2f}", ""])
+        data.append(["", "", "Total Transaction:", f"{format_kshs(total_tx)}", ""])
+        data.append(["", "", "Total Paid (incl this):", f"{format_kshs(total_paid)}", ""])
 
         # wide column widths to create a modern wide invoice look
         col_widths = [80*mm, 20*mm, 30*mm, 30*mm, 30*mm]
@@ -365,7 +147,8 @@ def generate_payment_receipt_bytes(payment_id):
         buffer.seek(0)
         return buffer.getvalue()
 
-    elif _pdf_backend == "fpdf":
+    elif pdf_backend() == "fpdf":
+        from fpdf import FPDF
         pdf = FPDF()
         pdf.add_page()
         pdf.set_auto_page_break(auto=True, margin=15)
@@ -377,7 +160,7 @@ def generate_payment_receipt_bytes(payment_id):
         pdf.set_font("Arial", size=10)
         pdf.cell(0, 6, f"Receipt ID: {pid}    Transaction ID: {txid}", ln=True)
         pdf.cell(0, 6, f"Status: {tx_status}    Method: {method}    Payment Date: {pdate}", ln=True)
-        pdf.cell(0, 6, f"Amount Paid: Kshs {amount:,.2f}", ln=True)
+        pdf.cell(0, 6, f"Amount Paid: {format_kshs(amount)}", ln=True)
         pdf.ln(4)
 
         # Table header
@@ -399,8 +182,8 @@ def generate_payment_receipt_bytes(payment_id):
             pname, qty, up, totp, datep = it
             pdf.cell(w_prod, 7, str(pname)[:40], border=1)  # truncated to fit
             pdf.cell(w_qty, 7, str(qty), border=1, align="C")
-            pdf.cell(w_unit, 7, f"Kshs {up:,.2f}", border=1, align="R")
-            pdf.cell(w_total, 7, f"Kshs {totp:,.2f}", border=1, align="R")
+            pdf.cell(w_unit, 7, f"{format_kshs(up)}", border=1, align="R")
+            pdf.cell(w_total, 7, f"{format_kshs(totp)}", border=1, align="R")
             pdf.cell(w_date, 7, str(datep), border=1, align="C")
             pdf.ln()
 
@@ -410,11 +193,11 @@ def generate_payment_receipt_bytes(payment_id):
         # Position totals on the right
         pdf.set_x(w_prod + w_qty)
         pdf.cell(w_unit, 7, "Total Transaction:", border=0)
-        pdf.cell(w_total, 7, f"Kshs {total_tx:,.2f}", border=1, align="R")
+        pdf.cell(w_total, 7, f"{format_kshs(total_tx)}", border=1, align="R")
         pdf.ln()
         pdf.set_x(w_prod + w_qty)
         pdf.cell(w_unit, 7, "Total Paid (incl this):", border=0)
-        pdf.cell(w_total, 7, f"Kshs {total_paid:,.2f}", border=1, align="R")
+        pdf.cell(w_total, 7, f"{format_kshs(total_paid)}", border=1, align="R")
 
         pdf_bytes = pdf.output(dest='S').encode('latin1')
         return pdf_bytes
@@ -423,46 +206,28 @@ def generate_payment_receipt_bytes(payment_id):
         return None
 
 
-def generate_transaction_receipt_bytes(transaction_id):
+def generate_transaction_receipt_bytes(transaction_id, fmt="pdf"):
     """
     Generate a transaction-level invoice/receipt (transaction may be unpaid).
-    Includes product list and totals. Always returns raw PDF bytes.
+    Includes product list and totals. Always returns raw bytes: PDF, or text /
+    ESC/POS for the other formats in receipts.RECEIPT_FORMATS.
     """
-    conn = create_connection()
-    c = conn.cursor()
-    c.execute("""
-        SELECT ct.id, cu.name, ct.date, ct.status
-        FROM credit_transactions ct
-        JOIN customers cu ON ct.customer_id = cu.id
-        WHERE ct.id = ?
-    """, (transaction_id,))
-    row = c.fetchone()
-    conn.close()
-    if not row:
+    data = transaction_receipt_data(transaction_id)
+    if not data:
         return b""  # Always return bytes
+    if fmt != "pdf":
+        return render_receipt(data, fmt, "transaction")
 
-    txid, customer_name, tx_date, tx_status = row
-
-    # Fetch items
-    conn2 = create_connection()
-    c2 = conn2.cursor()
-    c2.execute("""
-        SELECT p.name, ci.quantity, ci.unit_price, ci.total_price, ct.date
-        FROM credit_items ci
-        JOIN products p ON ci.product_id = p.id
-        JOIN credit_transactions ct ON ci.transaction_id = ct.id
-        WHERE ci.transaction_id = ?
-        ORDER BY ct.date ASC, p.name ASC
-    """, (txid,))
-    items = c2.fetchall()
-    c2.execute("SELECT COALESCE(SUM(total_price),0) FROM credit_items WHERE transaction_id=?", (txid,))
-    total_tx = c2.fetchone()[0] or 0.0
-    c2.execute("SELECT COALESCE(SUM(amount),0) FROM payments WHERE transaction_id=?", (txid,))
-    total_paid = c2.fetchone()[0] or 0.0
-    conn2.close()
+    header, items, total_tx, total_paid = data
+    txid, customer_name, tx_date, tx_status = header
 
     # PDF generation
-    if _pdf_backend == "reportlab":
+    if pdf_backend() == "reportlab":
+        from reportlab.lib import colors
+        from reportlab.lib.pagesizes import A4
+        from reportlab.lib.styles import getSampleStyleSheet
+        from reportlab.lib.units import mm
+        from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
         buffer = BytesIO()
         doc = SimpleDocTemplate(buffer, pagesize=A4,
                                 leftMargin=12*mm, rightMargin=12*mm,
@@ -480,9 +245,9 @@ def generate_transaction_receipt_bytes(transaction_id):
 
         data = [["Product", "Qty", "Unit Price", "Total", "Date Purchased"]]
         for pname, qty, up, totp, datep in items:
-            data.append([pname, str(qty), f"Kshs {up:,.2f}", f"Kshs {totp:,.2f}", str(datep)])
-        data.append(["", "", "Total Transaction:", f"Kshs {total_tx:,.2f}", ""])
-        data.append(["", "", "Total Paid:", f"Kshs {total_paid:,.2f}", ""])
+            data.append([pname, str(qty), f"{format_kshs(up)}", f"{format_kshs(totp)}", str(datep)])
+        data.append(["", "", "Total Transaction:", f"{format_kshs(total_tx)}", ""])
+        data.append(["", "", "Total Paid:", f"{format_kshs(total_paid)}", ""])
 
         col_widths = [80*mm, 20*mm, 30*mm, 30*mm, 30*mm]
         table = Table(data, colWidths=col_widths, repeatRows=1)
@@ -508,7 +273,8 @@ def generate_transaction_receipt_bytes(transaction_id):
         buffer.seek(0)
         return buffer.getvalue()  # Always bytes
 
-    elif _pdf_backend == "fpdf":
+    elif pdf_backend() == "fpdf":
+        from fpdf import FPDF
         pdf = FPDF()
         pdf.add_page()
         pdf.set_auto_page_break(auto=True, margin=15)
@@ -532,8 +298,8 @@ def generate_transaction_receipt_bytes(transaction_id):
         for pname, qty, up, totp, datep in items:
             pdf.cell(w_prod, 7, str(pname)[:40], border=1)
             pdf.cell(w_qty, 7, str(qty), border=1, align="C")
-            pdf.cell(w_unit, 7, f"Kshs {up:,.2f}", border=1, align="R")
-            pdf.cell(w_total, 7, f"Kshs {totp:,.2f}", border=1, align="R")
+            pdf.cell(w_unit, 7, f"{format_kshs(up)}", border=1, align="R")
+            pdf.cell(w_total, 7, f"{format_kshs(totp)}", border=1, align="R")
             pdf.cell(w_date, 7, str(datep), border=1, align="C")
             pdf.ln()
 
@@ -541,32 +307,249 @@ def generate_transaction_receipt_bytes(transaction_id):
         pdf.set_font("Arial", "B", 10)
         pdf.set_x(w_prod + w_qty)
         pdf.cell(w_unit, 7, "Total:", border=0)
-        pdf.cell(w_total, 7, f"Kshs {total_tx:,.2f}", border=1, align="R")
+        pdf.cell(w_total, 7, f"{format_kshs(total_tx)}", border=1, align="R")
         pdf.ln()
         pdf.set_x(w_prod + w_qty)
         pdf.cell(w_unit, 7, "Total Paid:", border=0)
-        pdf.cell(w_total, 7, f"Kshs {total_paid:,.2f}", border=1, align="R")
+        pdf.cell(w_total, 7, f"{format_kshs(total_paid)}", border=1, align="R")
 
         return pdf.output(dest='S').encode('latin1')  # Always bytes
 
     return b""  # Fallback to bytes
 
-# ---------- UI Implementation ----------
-migrate_schema()
+def receipt_format():
+    """Receipt format picked on the Manage view; PDF unless a thermal printer is chosen."""
+    return st.session_state.get("receipt_format", "pdf")
+
+def receipt_download_button(label, make, stem, key):
+    """
+    Download button for make(fmt) in the selected format. The receipt is built
+    when clicked, not on every rerun, so the PDF libraries load on the first
+    download. Returns False (no button) if PDF is selected but not installed.
+    """
+    fmt = receipt_format()
+    if fmt == "pdf" and pdf_backend() is None:
+        return False
+    _, mime, ext = RECEIPT_FORMATS[fmt]
+    st.download_button(label=label, data=lambda: make(fmt) or b"", file_name=f"{stem}.{ext}", mime=mime, key=key)
+    return True
 
-# load datasets
-customers_df = fetch_customers()
-products_df = fetch_products()
+
+# ---------- Fragments ----------
+# Each fragment re-executes on its own when one of its widgets is used, loading only
+# the data it shows, so editing the cart or one transaction leaves the rest of the page alone.
+
+def _rerun_fragment():
+    try:
+        st.rerun(scope="fragment")
+    except StreamlitAPIException:
+        st.rerun()  # we got here in a full run (e.g. scripted clicks): rerun everything
+
+
+def _refresh_row(tid):
+    """Rerun just this transaction's row with its totals reloaded. The reloaded
+    row is kept until the next full run: later fragment reruns (a receipt
+    download, the expander) are still passed the account of the last full run."""
+    st.session_state[f"tx_account_{tid}"] = fetch_account(tid)
+    _rerun_fragment()
+
+
+@st.fragment
+def cart_panel(cust_id, lending_date, products):
+    cart_col, pick_col = st.columns([2, 1])
+    with pick_col:
+        st.markdown("**Add product to cart**")
+        prod_choice = st.selectbox("Product", options=products, format_func=lambda x: f"{x['name']} - {format_kshs(x['price_cents'])}")
+        qty = st.number_input("Quantity", min_value=1, value=1)
+        unit_price = st.number_input("Unit Price", min_value=0.00, value=to_amount(prod_choice['price_cents']), format="%.2f")
+        if st.button("➕ Add Product"):
+            # appended before the cart below is drawn, so no rerun needed
+            st.session_state.cart.append({
+                "product_id": prod_choice['id'],
+                "product_name": prod_choice['name'],
+                "qty": int(qty),
+                "unit_price_cents": to_cents(unit_price),
+                "total_price_cents": line_total(qty, to_cents(unit_price))
+            })
+
+    with cart_col:
+        st.markdown("### Cart")
+        if not st.session_state.cart:
+            st.info("Cart is empty.")
+            return
+        st.table([
+            {"product_name": x['product_name'], "qty": x['qty'],
+             "unit_price": format_kshs(x['unit_price_cents']), "total_price": format_kshs(x['total_price_cents'])}
+            for x in st.session_state.cart
+        ])
+        grand_total = sum(x['total_price_cents'] for x in st.session_state.cart)
+        st.markdown(f"**Grand Total:** {format_kshs(grand_total)}")
+
+        col_save, col_clear = st.columns([1,1])
+        with col_save:
+            if st.button("💾 Save Transaction"):
+                # build items
+                items = [{"product_id": x['product_id'], "qty": x['qty'], "unit_price_cents": x['unit_price_cents']} for x in st.session_state.cart]
+                try:
+                    tx_id = save_credit_items_for_customer(cust_id, lending_date.strftime("%Y-%m-%d"), items)
+                except CreditRefused as e:
+                    st.error(f"⛔ Not saved. {e}")
+                else:
+                    st.success(f"Saved to transaction ID {tx_id}.")
+                    st.session_state.cart = []
+                    st.rerun()  # balance and dashboard change: full rerun
+        with col_clear:
+            if st.button("🗑️ Clear Cart"):
+                st.session_state.cart = []
+                _rerun_fragment()
+
+
+@st.fragment
+def transaction_row(account):
+    tid = int(account.transaction_id)
+    account = st.session_state.get(f"tx_account_{tid}", account)
+    if account is None:     # deleted since the last full run
+        return
+
+    cols = st.columns([3,1,1,1,1,2])
+    with cols[0]:
+        st.markdown(f"**{account.customer_name}**")
+        st.write(f"Transaction: {tid} — Date: {account.date}")
+    with cols[1]:
+        st.write(f"**Total:** {format_kshs(int(account.total_cents))}")
+    with cols[2]:
+        st.write(f"**Paid:** {format_kshs(int(account.paid_cents))}")
+    with cols[3]:
+        st.write(f"**Balance:** {format_kshs(int(account.balance_cents))}")
+    with cols[4]:
+        st.write(f"**Status:** {account.status}")
+    with cols[5]:
+        # Transaction-level Download button (visible in table row)
+        receipt_download_button("📥 Download Receipt", partial(generate_transaction_receipt_bytes, tid),
+                                f"receipt_tx{tid}", f"dl_tx_{tid}")
+
+        if st.button("✅ Mark as Paid", key=f"markpaid_{tid}"):
+            # balancing payment if needed, then status
+            settle_transactions([tid], date.today().strftime("%Y-%m-%d"))
+            _refresh_row(tid)
+
+        if st.button("🗑️ Delete", key=f"del_{tid}"):
+            delete_transaction(tid)
+            st.warning("Transaction deleted.")
+            st.rerun()  # the row disappears from the list
+
+    # details are built only while the expander is open: every number input / select
+    # box copies the session state, so building all rows' editors grows with rows²
+    details = st.expander("View items & payments", key=f"tx_open_{tid}", on_change="rerun")
+    if details.open:
+        with details:
+            transaction_details(tid)
+
+
+def transaction_details(tid):
+    items = fetch_items_with_names(tid)
+    if items:
+        st.write("**Items**")
+        st.dataframe([
+            {"item_id": it.id, "product_id": it.product_id, "product": it.product, "quantity": it.quantity,
+             "unit_price": format_kshs(it.unit_price_cents), "total_price": format_kshs(it.total_price_cents)}
+            for it in items
+        ], use_container_width=True)
+
+        # Edit inline
+        st.markdown("**Edit Items**")
+        for it in items:
+            item_id = it.id
+            col_a, col_b, col_c, col_d = st.columns([3,1,1,1])
+            with col_a:
+                st.write(it.product)
+            with col_b:
+                new_qty = st.number_input(f"Qty item {item_id}", min_value=1, value=int(it.quantity), key=f"iq_{item_id}")
+            with col_c:
+                new_up = st.number_input(f"Unit item {item_id}", min_value=0.00, value=to_amount(it.unit_price_cents), format="%.2f", key=f"ip_{item_id}")
+            with col_d:
+                if st.button("Save", key=f"save_item_{item_id}"):
+                    try:
+                        update_credit_item(item_id, int(new_qty), to_cents(new_up))
+                    except CreditRefused as e:
+                        st.error(f"⛔ Not saved. {e}")
+                    else:
+                        _refresh_row(tid)
+    payments = fetch_payments(tid)
+    if payments:
+        st.write("**Payments**")
+        st.dataframe([
+            {"id": p.id, "amount": format_kshs(p.amount_cents), "method": p.method, "date": p.date}
+            for p in payments
+        ], use_container_width=True)
+        st.markdown("**Undo Payments**")
+        for idx, p in enumerate(payments):
+            pay_id = p.id
+            colx, coly = st.columns([3,1])
+            with coly:
+                if st.button("Undo", key=f"undo_{pay_id}"):
+                    delete_payment(pay_id)
+                    _refresh_row(tid)
+            receipt_download_button("📥 Download Receipt", partial(generate_payment_receipt_bytes, pay_id),
+                                    f"receipt_{pay_id}", f"dl_receipt_{tid}_{idx}")
+
+    with st.form(f"payment_form_{tid}", clear_on_submit=True):
+        st.markdown("**Record Payment**")
+        pcol1, pcol2, pcol3 = st.columns([2,1,1])
+        with pcol1:
+            pay_amount = st.number_input("Amount (Kshs)", min_value=0.00, value=0.0, format="%.2f", key=f"payamt_{tid}")
+        with pcol2:
+            pay_method = st.selectbox("Method", ["Cash","Mpesa","Card","Bank"], key=f"paymeth_{tid}")
+        with pcol3:
+            pay_date = st.date_input("Payment Date", value=date.today(), key=f"paydate_{tid}")
+        if st.form_submit_button("Save Payment"):
+            if pay_amount > 0:
+                pid = record_payment(tid, to_cents(pay_amount), pay_method, pay_date.strftime("%Y-%m-%d"))
+                st.session_state[f"tx_paid_{tid}"] = pid
+                _refresh_row(tid)
+            else:
+                st.warning("Enter amount > 0")
+
+    # receipt for a payment just recorded (the row reran to pick up the new totals)
+    pid = st.session_state.pop(f"tx_paid_{tid}", None)
+    if pid is not None:
+        st.success("Payment recorded.")
+        if not receipt_download_button("📥 Download Receipt", partial(generate_payment_receipt_bytes, pid),
+                                       f"receipt_{pid}", f"dl_receipt_{pid}"):
+            st.info("PDF receipt not available — install reportlab or fpdf, or pick a text receipt format.")
+
+
+# ---------- UI Implementation ----------
+init_db()
+snapshot = ledger_snapshot()
+
+# only the selected view is built (st.tabs would run both bodies on every rerun)
+VIEW_ADD, VIEW_MANAGE = "➕ Add Credit", "📊 Dashboard & Manage"
+view = st.session_state.get("credit_view", VIEW_ADD)
+
+# load datasets — independent reads start together, each section waits only for its own
+# (filters are keyed widgets, so their current values are known before they render)
+customers_future = submit_read(fetch_customer_picker)
+if view == VIEW_ADD:
+    products_future = submit_read(fetch_products)
+else:
+    owed_future = submit_read(fetch_top_owed)
+    grouped_future = submit_read(
+        fetch_grouped_accounts,
+        customer_filter=st.session_state.get("filter_customer", "All"),
+        status_filter=st.session_state.get("filter_status", "All"),
+    )
+customers_df = customers_future.result()
 
 # session state for cart
 if "cart" not in st.session_state:
     st.session_state.cart = []
 
-# Tabs
-tab_new, tab_manage = st.tabs(["➕ Add Credit", "📊 Dashboard & Manage"])
+st.radio("View", [VIEW_ADD, VIEW_MANAGE], horizontal=True, key="credit_view", label_visibility="collapsed")
 
-# ---------------- Tab: Add Credit ----------------
-with tab_new:
+# ---------------- View: Add Credit ----------------
+if view == VIEW_ADD:
+    products_df = products_future.result()
     st.header("Record New Credit Transaction")
     if customers_df.empty:
         st.warning("No customers found. Add customers first.")
@@ -575,288 +558,115 @@ with tab_new:
     else:
         col1, col2 = st.columns([2, 1])
         with col1:
-            selected_customer = st.selectbox("Select Customer", options=customers_df.to_dict("records"), format_func=lambda x: x['name'])
+            selected_customer = st.selectbox("Select Customer", options=customers_df.to_dict("records"),
+                                             format_func=lambda x: f"{x['name']}  {risk_label(x['risk'], x['score'])}".rstrip())
             cust_id = selected_customer['id']
             # live balance for customer
-            cust_balance_df = pd.read_sql("""
-                SELECT COALESCE(SUM(ci.total_price),0) - COALESCE((SELECT SUM(amount) FROM payments p WHERE p.transaction_id = ct.id),0) AS balance
-                FROM credit_transactions ct
-                LEFT JOIN credit_items ci ON ci.transaction_id = ct.id
-                WHERE ct.customer_id = ?
-            """, create_connection(), params=(cust_id,))
-            bal_val = cust_balance_df.iloc[0,0] or 0.0
+            bal_val = fetch_customer_balance(cust_id)
             if bal_val > 0:
-                st.info(f"💰 Current Outstanding Balance: Kshs {bal_val:,.2f}")
+                st.info(f"💰 Current Outstanding Balance: {format_kshs(bal_val)}")
             else:
                 st.success("✅ No outstanding balance")
-
-            lending_date = st.date_input("Date of Lending", value=date.today())
+            credit_limit = fetch_credit_limit(cust_id)
+            if credit_limit is not None:
+                st.caption(f"Credit limit {format_kshs(credit_limit)} — available {format_kshs(max(credit_limit - bal_val, 0))}")
+            if isinstance(selected_customer['risk'], str):
+                settle = selected_customer['avg_days_to_settle']
+                st.caption(f"Risk {risk_label(selected_customer['risk'], selected_customer['score'])}: "
+                           f"{selected_customer['repayment_ratio']:.0%} of credit repaid, "
+                           + (f"settles in {settle:.0f} days on average, " if settle == settle else "nothing settled yet, ")
+                           + f"{int(selected_customer['overdue_days'])} days overdue")
 
         with col2:
-            st.markdown("**Add product to cart**")
-            prod_choice = st.selectbox("Product", options=products_df.to_dict("records"), format_func=lambda x: f"{x['name']} - Kshs {x['price']:.2f}")
-            qty = st.number_input("Quantity", min_value=1, value=1)
-            unit_price = st.number_input("Unit Price", min_value=0.00, value=float(prod_choice['price']), format="%.2f")
-            if st.button("➕ Add Product"):
-                # append to cart
-                st.session_state.cart.append({
-                    "product_id": prod_choice['id'],
-                    "product_name": prod_choice['name'],
-                    "qty": int(qty),
-                    "unit_price": float(unit_price),
-                    "total_price": round(int(qty) * float(unit_price), 2)
-                })
-                st.rerun()
+            lending_date = st.date_input("Date of Lending", value=date.today())
 
-        # show cart
-        st.markdown("### Cart")
-        if st.session_state.cart:
-            cart_df = pd.DataFrame(st.session_state.cart)
-            cart_df_display = cart_df.copy()
-            cart_df_display['unit_price'] = cart_df_display['unit_price'].map(lambda x: f"Kshs {x:,.2f}")
-            cart_df_display['total_price'] = cart_df_display['total_price'].map(lambda x: f"Kshs {x:,.2f}")
-            st.table(cart_df_display[['product_name','qty','unit_price','total_price']])
-            grand_total = sum([x['total_price'] for x in st.session_state.cart])
-            st.markdown(f"**Grand Total:** Kshs {grand_total:,.2f}")
-
-            col_save, col_clear = st.columns([1,1])
-            with col_save:
-                if st.button("💾 Save Transaction"):
-                    # build items
-                    items = [{"product_id": x['product_id'], "qty": x['qty'], "unit_price": x['unit_price']} for x in st.session_state.cart]
-                    tx_id = save_credit_items_for_customer(cust_id, lending_date.strftime("%Y-%m-%d"), items)
-                    st.success(f"Saved to transaction ID {tx_id}.")
-                    st.session_state.cart = []
-                    st.rerun()
-            with col_clear:
-                if st.button("🗑️ Clear Cart"):
-                    st.session_state.cart = []
-                    st.rerun()
+        cart_panel(cust_id, lending_date, products_df.to_dict("records"))
 
-        else:
-            st.info("Cart is empty.")
 
-# ---------------- Tab: Dashboard & Manage ----------------
-with tab_manage:
+# ---------------- View: Dashboard & Manage ----------------
+else:
     st.header("Dashboard — Top Owed Customers")
+    age = snapshot_age()
+    fcol1, fcol2 = st.columns([4, 1])
+    with fcol1:
+        st.caption(f"📸 Dashboard and export figures are from a reporting snapshot taken {describe_age(age or 0)}, "
+                   f"refreshed every {REPORT_MAX_AGE_SECONDS // 60} min. The account list below is live.")
+    with fcol2:
+        st.button("🔄 Refresh report data", on_click=refresh_snapshot)
     # top owed customers
-    conn = create_connection()
-    owed_df = pd.read_sql("""
-        SELECT cu.id, cu.name, COALESCE(SUM(ci.total_price),0) - COALESCE(SUM(p.amount),0) AS balance
-        FROM customers cu
-        LEFT JOIN credit_transactions ct ON ct.customer_id = cu.id
-        LEFT JOIN credit_items ci ON ci.transaction_id = ct.id
-        LEFT JOIN payments p ON p.transaction_id = ct.id
-        GROUP BY cu.id
-        HAVING balance > 0
-        ORDER BY balance DESC
-        LIMIT 10
-    """, conn)
-    conn.close()
+    owed_df = owed_future.result()
 
     if not owed_df.empty:
         owed_df_display = owed_df.copy()
-        owed_df_display['balance'] = owed_df_display['balance'].map(lambda x: f"Kshs {x:,.2f}")
+        owed_df_display['balance'] = format_kshs_many(owed_df_display.pop('balance_cents'))
         st.table(owed_df_display.rename(columns={'name':'Customer'}))
     else:
         st.info("No outstanding balances to show.")
 
+    # aging of outstanding balances (snapshot was refreshed by fetch_top_owed)
+    aging_df = snapshot.aging()
+    if aging_df['transactions'].sum() > 0:
+        aging_display = aging_df.copy()
+        aging_display['balance'] = format_kshs_many(aging_display.pop('balance_cents'))
+        st.markdown("**Outstanding by Age**")
+        st.table(aging_display.rename(columns={'age':'Age','transactions':'Transactions','balance':'Balance'}))
+
     st.markdown("---")
     st.subheader("Manage Customer Accounts (expand one to view details)")
 
     # filters
     cust_list = ["All"] + customers_df['name'].tolist() if not customers_df.empty else ["All"]
-    colf1, colf2, colf3 = st.columns([2,1,1])
+    colf1, colf2, colf3, colf4 = st.columns([2,1,1,1])
     with colf1:
-        filter_customer = st.selectbox("Filter by Customer", cust_list, index=0)
+        filter_customer = st.selectbox("Filter by Customer", cust_list, index=0, key="filter_customer")
     with colf2:
-        filter_status = st.selectbox("Filter by Status", ["All","Unpaid","Partially Paid","Paid"], index=0)
+        filter_status = st.selectbox("Filter by Status", ["All","Unpaid","Partially Paid","Paid"], index=0, key="filter_status")
     with colf3:
+        st.selectbox("Receipt format", list(RECEIPT_FORMATS), format_func=lambda k: RECEIPT_FORMATS[k][0],
+                     key="receipt_format", help="PDF for emailed receipts; text or ESC/POS for a thermal printer")
+    with colf4:
         show_only_with_balance = st.checkbox("Only show accounts with balance", value=False)
 
-    # fetch grouped accounts (transactions)
-    grouped = fetch_grouped_accounts(customer_filter=filter_customer, status_filter=filter_status)
+    # fetch grouped accounts (transactions) — already started above with these filters
+    grouped = grouped_future.result()
 
     # optionally filter out zero balances
     if show_only_with_balance:
-        grouped = grouped[grouped['balance'] > 0]
+        grouped = grouped[grouped['balance_cents'] > 0]
+
+    # bulk actions
+    with st.expander("Bulk actions"):
+        owing = grouped[grouped['balance_cents'] > 0]
+        settle_all = st.checkbox(f"All {len(owing)} filtered accounts with a balance", value=False, key="settle_all")
+        settle_labels = {row.transaction_id: f"{row.customer_name} — #{row.transaction_id} ({format_kshs(row.balance_cents)})"
+                         for row in owing.itertuples()}
+        to_settle = st.multiselect("Settle selected", list(settle_labels), format_func=settle_labels.get,
+                                   disabled=settle_all, key="settle_selected")
+        bcol1, bcol2 = st.columns([1, 1])
+        with bcol1:
+            if st.button("✅ Settle selected", disabled=not (settle_all or to_settle)):
+                ids = owing['transaction_id'].tolist() if settle_all else to_settle
+                count = settle_transactions(ids, date.today().strftime("%Y-%m-%d"))
+                st.success(f"Recorded {count} balancing payment(s).")
+                st.rerun()
+        with bcol2:
+            if st.button("🔄 Recompute all statuses", help="Fix statuses that no longer match item and payment totals"):
+                st.success(f"{recompute_all_statuses()} status(es) corrected.")
 
     if grouped.empty:
         st.info("No accounts match the selected filters.")
     else:
-        # Display grouped rows (one row per transaction)
-        for _, row in grouped.iterrows():
-            tid = int(row['transaction_id'])
-            cust_name = row['customer_name']
-            tdate = row['date']
-            status = row['status']
-            total_amt = float(row['total_amount'])
-            total_paid = float(row['total_paid'])
-            balance = float(row['balance'])
-
-            cols = st.columns([3,1,1,1,1,2])
-            with cols[0]:
-                st.markdown(f"**{cust_name}**")
-                st.write(f"Transaction: {tid} — Date: {tdate}")
-            with cols[1]:
-                st.write(f"**Total:** Kshs {total_amt:,.2f}")
-            with cols[2]:
-                st.write(f"**Paid:** Kshs {total_paid:,.2f}")
-            with cols[3]:
-                st.write(f"**Balance:** Kshs {balance:,.2f}")
-            with cols[4]:
-                st.write(f"**Status:** {status}")
-            with cols[5]:
-                # Transaction-level Download button (visible in table row)
-                tx_pdf = generate_transaction_receipt_bytes(tid)
-
-                if tx_pdf:
-                    # Store raw bytes in session state to avoid .bin reference issues
-                    st.session_state[f"tx_receipt_{tid}"] = tx_pdf
-
-                # Always read from session_state to keep consistent behavior
-                if st.session_state.get(f"tx_receipt_{tid}"):
-                    st.download_button(
-                        label="📥 Download Receipt",
-                        data=st.session_state[f"tx_receipt_{tid}"],
-                        file_name=f"receipt_tx{tid}.pdf",
-                        mime="application/pdf",
-                        key=f"dl_tx_{tid}"
-                    )
-
-                if st.button("✅ Mark as Paid", key=f"markpaid_{tid}"):
-                    # create balancing payment if needed
-                    if balance > 0:
-                        pid = record_payment(tid, balance, "Manual", date.today().strftime("%Y-%m-%d"))
-                    else:
-                        pid = None
-                    recalc_balance(tid)
-                    st.success("Marked as Paid.")
-                    st.rerun()
-
-                if st.button("🗑️ Delete", key=f"del_{tid}"):
-                    delete_transaction(tid)
-                    st.warning("Transaction deleted.")
-                    st.rerun()
-
-
-            # details expander
-            with st.expander("View items & payments", expanded=False):
-                items_df = fetch_items_with_names(tid)
-                if not items_df.empty:
-                    display_items = items_df.copy()
-                    display_items['unit_price'] = display_items['unit_price'].map(lambda x: f"Kshs {x:,.2f}")
-                    display_items['total_price'] = display_items['total_price'].map(lambda x: f"Kshs {x:,.2f}")
-                    st.write("**Items**")
-                    st.dataframe(display_items.rename(columns={'id':'item_id'}), use_container_width=True)
-
-                    # Edit inline
-                    st.markdown("**Edit Items**")
-                    for idx, it in items_df.iterrows():
-                        item_id = int(it['id'])
-                        prod_id = int(it['product_id'])
-                        prod_name = it['product']
-                        col_a, col_b, col_c, col_d = st.columns([3,1,1,1])
-                        with col_a:
-                            st.write(prod_name)
-                        with col_b:
-                            new_qty = st.number_input(f"Qty item {item_id}", min_value=1, value=int(it['quantity']), key=f"iq_{item_id}")
-                        with col_c:
-                            new_up = st.number_input(f"Unit item {item_id}", min_value=0.00, value=float(it['unit_price']), format="%.2f", key=f"ip_{item_id}")
-                        with col_d:
-                            if st.button("Save", key=f"save_item_{item_id}"):
-                                         update_credit_item(item_id, int(new_qty), float(new_up))
-                                         st.success("Item updated.")
-                                         st.rerun()
-                payments_df = fetch_payments(tid)
-                if not payments_df.empty:
-                    display_payments = payments_df.copy()
-                    display_payments['amount'] = display_payments['amount'].map(lambda x: f"Kshs {x:,.2f}")
-                    st.write("**Payments**")
-                    st.dataframe(display_payments, use_container_width=True)
-                    st.markdown("**Undo Payments**")
-                    for idx, p in payments_df.iterrows():
-                        pay_id = int(p['id'])
-                        colx, coly = st.columns([3,1])
-                        with coly:
-                            if st.button("Undo", key=f"undo_{pay_id}"):
-                                delete_payment(pay_id)
-                                st.warning(f"Payment {pay_id} deleted.")
-                                st.rerun()
-                        pdf_bytes = generate_payment_receipt_bytes(pay_id)
-                        if pdf_bytes:
-                            st.download_button(
-                                label="📥 Download Receipt (PDF)",
-                                data=pdf_bytes,
-                                file_name=f"receipt_{pay_id}.pdf",
-                                mime="application/pdf",
-                                key=f"dl_receipt_{tid}_{idx}"    
-                            )
-                # ----------------- HERE IS THE UPDATED PAYMENT FORM AND DOWNLOAD BUTTON -----------------
-                with st.form(f"payment_form_{tid}", clear_on_submit=True):
-                    st.markdown("**Record Payment**")
-                    pcol1, pcol2, pcol3 = st.columns([2,1,1])
-                    with pcol1:
-                        pay_amount = st.number_input("Amount (Kshs)", min_value=0.00, value=0.0, format="%.2f", key=f"payamt_{tid}")
-                    with pcol2:
-                        pay_method = st.selectbox("Method", ["Cash","Mpesa","Card","Bank"], key=f"paymeth_{tid}")
-                    with pcol3:
-                        pay_date = st.date_input("Payment Date", value=date.today(), key=f"paydate_{tid}")
-                    pay_submit = st.form_submit_button("Save Payment")
-                    if pay_submit:
-                        if pay_amount > 0:
-                            pid = record_payment(tid, float(pay_amount), pay_method, pay_date.strftime("%Y-%m-%d"))
-                            st.success("Payment recorded.")
-                            pdf_bytes = generate_payment_receipt_bytes(pid)
-                            if pdf_bytes:
-                                st.download_button(
-                                    label="📥 Download Receipt (PDF)",
-                                    data=pdf_bytes,
-                                    file_name=f"receipt_{pid}.pdf",
-                                    mime="application/pdf",
-                                    key=f"dl_receipt_{pid}"
-                                )
-                                
-                            else:
-                                st.info("PDF receipt not available — install reportlab or fpdf.")
-                          
-
-                        else:
-                            st.warning("Enter amount > 0")
-
-                # Outside the form: show download button if receipt available in session state
-                # for key in list(st.session_state.keys()):
-                #     if key.startswith("receipt_") and st.session_state[key] is not None:
-                #         st.download_button(
-                #             label="📥 Download Receipt (PDF)",
-                #             data=st.session_state[key],
-                #             file_name=f"{key}.pdf",
-                #             mime="application/pdf",
-                #             key=f"dl_{key}"
-                #         )
-                #         # Uncomment below if you want to clear the receipt after download to clean up UI
-                #         # del st.session_state[key]
-            
-    # Export grouped view to excel
+        # Display grouped rows (one fragment per transaction); rows reloaded by
+        # fragment reruns are superseded by this full run's data
+        for key in [k for k in st.session_state if k.startswith("tx_account_")]:
+            del st.session_state[key]
+        for account in grouped.itertuples(index=False):
+            transaction_row(account)
+
+    # Export grouped view to excel (built from the reporting snapshot on click)
     st.markdown("---")
-    export_df = []
-    for _, r in grouped.iterrows():
-        export_df.append({
-            "Transaction ID": int(r['transaction_id']),
-            "Customer": r['customer_name'],
-            "Date": r['date'],
-            "Status": r['status'],
-            "Total": float(r['total_amount']),
-            "Paid": float(r['total_paid']),
-            "Balance": float(r['balance'])
-        })
-    if export_df:
-        export_df = pd.DataFrame(export_df)
-        excel_buf = BytesIO()
-        with pd.ExcelWriter(excel_buf, engine='openpyxl') as writer:
-            export_df.to_excel(writer, index=False, sheet_name="Accounts")
-        excel_bytes = excel_buf.getvalue()
-        st.download_button("📥 Export Accounts (Excel)", data=excel_bytes, file_name="credit_accounts.xlsx")
+    if not grouped.empty:
+        st.download_button("📥 Export Accounts (Excel)", file_name="credit_accounts.xlsx",
+                           data=partial(accounts_workbook, filter_customer, filter_status, show_only_with_balance))
 
 # End of script
-          
\ No newline at end of file
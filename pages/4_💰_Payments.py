@@ -1,75 +1,15 @@
 import streamlit as st
-import sqlite3
-import pandas as pd
 from datetime import datetime
+from database import init_db
+from money import format_kshs, format_kshs_many, to_cents
+from reconcile import DEFAULT_WINDOW_DAYS, StatementError, reconcile
+from repository import (
+    ALLOCATION_METHODS, allocate_amount, count_review_queue, delete_payment, fetch_customers,
+    fetch_open_transactions, fetch_payment_history, fetch_review_queue, ignore_statement_line, pay_customer,
+    record_payment, resolve_statement_line,
+)
 
 
-# ====================
-# DB CONNECTION
-# ====================
-def create_connection():
-    return sqlite3.connect("data/shop.db", check_same_thread=False)
-
-# ====================
-# HELPER FUNCTIONS
-# ====================
-def get_customers():
-    conn = create_connection()
-    df = pd.read_sql("SELECT id, name FROM customers ORDER BY name", conn)
-    conn.close()
-    return df
-
-def get_customer_balance(customer_id):
-    conn = create_connection()
-    query = """
-        SELECT 
-            ct.id AS transaction_id,
-            ct.date,
-            SUM(ci.total_price) AS total_credit,
-            IFNULL(SUM(p.amount), 0) AS total_paid,
-            (SUM(ci.total_price) - IFNULL(SUM(p.amount), 0)) AS balance
-        FROM credit_transactions ct
-        JOIN credit_items ci ON ci.transaction_id = ct.id
-        LEFT JOIN payments p ON p.transaction_id = ct.id
-        WHERE ct.customer_id = ?
-        GROUP BY ct.id
-        HAVING balance > 0
-        ORDER BY ct.date
-    """
-    df = pd.read_sql(query, conn, params=(customer_id,))
-    conn.close()
-    return df
-
-def insert_payment(transaction_id, amount, method, date):
-    conn = create_connection()
-    c = conn.cursor()
-    c.execute("""
-        INSERT INTO payments (transaction_id, amount, method, date)
-        VALUES (?, ?, ?, ?)
-    """, (transaction_id, amount, method, date))
-    conn.commit()
-    conn.close()
-
-def get_payment_history(customer_id):
-    conn = create_connection()
-    query = """
-        SELECT p.id, p.transaction_id, p.amount, p.method, p.date
-        FROM payments p
-        JOIN credit_transactions ct ON p.transaction_id = ct.id
-        WHERE ct.customer_id = ?
-        ORDER BY p.date DESC
-    """
-    df = pd.read_sql(query, conn, params=(customer_id,))
-    conn.close()
-    return df
-
-def delete_payment(payment_id):
-    conn = create_connection()
-    c = conn.cursor()
-    c.execute("DELETE FROM payments WHERE id = ?", (payment_id,))
-    conn.commit()
-    conn.close()
-
 # ====================
 # PAGE UI
 # ====================
@@ -85,8 +25,10 @@ if st.button("🚪 Logout"):
     st.session_state.logged_in = False
     st.switch_page("pages/0_🔑_Login.py")
 
+init_db()
+
 # 1. Select Customer
-customers_df = get_customers()
+customers_df = fetch_customers()
 if customers_df.empty:
     st.warning("No customers found in the system.")
     st.stop()
@@ -99,47 +41,72 @@ if selected_customer:
 
     # 2. Show Outstanding Credits
     st.subheader(f"Outstanding Credits for {selected_customer}")
-    credits_df = get_customer_balance(customer_id)
+    credits_df = fetch_open_transactions(customer_id)
 
     if credits_df.empty:
         st.info("No outstanding credits for this customer.")
     else:
-        st.dataframe(credits_df[["transaction_id", "date", "total_credit", "total_paid", "balance"]])
+        credits_display = credits_df[["transaction_id", "date"]].copy()
+        credits_display["total_credit"] = format_kshs_many(credits_df["total_credit_cents"])
+        credits_display["total_paid"] = format_kshs_many(credits_df["total_paid_cents"])
+        credits_display["balance"] = format_kshs_many(credits_df["balance_cents"])
+        st.dataframe(credits_display)
 
         # Total Balance
-        total_balance = credits_df["balance"].sum()
-        st.metric("Total Outstanding Balance", f"Kshs {total_balance:,.2f}")
+        total_balance = credits_df["balance_cents"].sum()
+        st.metric("Total Outstanding Balance", format_kshs(total_balance))
 
         # 3. Record Payment
         st.subheader("Record Payment")
-        transaction_options = {f"Transaction {row.transaction_id} (Bal: {row.balance:,.2f})": row.transaction_id
-                               for row in credits_df.itertuples()}
-        selected_transaction_label = st.selectbox("Select Credit Transaction", list(transaction_options.keys()))
-        selected_transaction_id = transaction_options[selected_transaction_label]
+        pay_to = st.radio("Apply payment to", ["All open transactions", "One transaction"], horizontal=True)
+        if pay_to == "All open transactions":
+            allocation = st.selectbox("Allocation", list(ALLOCATION_METHODS), format_func=ALLOCATION_METHODS.get)
+        else:
+            transaction_options = {f"Transaction {row.transaction_id} (Bal: {format_kshs(row.balance_cents)})": row.transaction_id
+                                   for row in credits_df.itertuples()}
+            selected_transaction_label = st.selectbox("Select Credit Transaction", list(transaction_options.keys()))
+            selected_transaction_id = transaction_options[selected_transaction_label]
 
         pay_amount = st.number_input("Amount (Kshs)", min_value=0.01, value=0.01, step=0.01, format="%.2f")
         pay_method = st.selectbox("Payment Method", ["Cash", "Mpesa", "Bank", "Other"])
         pay_date = st.date_input("Payment Date", value=datetime.today())
 
+        if pay_to == "All open transactions":
+            if to_cents(pay_amount) > total_balance:
+                st.error(f"Amount is more than the {format_kshs(total_balance)} outstanding.")
+            else:
+                split = allocate_amount(to_cents(pay_amount), zip(credits_df["transaction_id"].tolist(),
+                                                                  credits_df["balance_cents"].tolist()), allocation)
+                st.caption("Split: " + ", ".join(f"#{tx} {format_kshs(cents)}" for tx, cents in split[:10])
+                           + (f" … and {len(split) - 10} more" if len(split) > 10 else ""))
+
         if st.button("💾 Save Payment"):
-            if pay_amount > 0:
-                insert_payment(selected_transaction_id, pay_amount, pay_method, pay_date.strftime("%Y-%m-%d"))
+            if pay_amount <= 0:
+                st.error("Amount must be greater than 0.")
+            elif pay_to == "All open transactions":
+                try:
+                    parts = pay_customer(customer_id, to_cents(pay_amount), pay_method, pay_date.strftime("%Y-%m-%d"), allocation)
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    st.success(f"Payment recorded across {len(parts)} transaction(s)!")
+                    st.rerun()
+            else:
+                record_payment(selected_transaction_id, to_cents(pay_amount), pay_method, pay_date.strftime("%Y-%m-%d"))
                 st.success("Payment recorded successfully!")
                 st.rerun()
 
-            else:
-                st.error("Amount must be greater than 0.")
-
     # 4. Payment History
     st.subheader("Payment History")
-    history_df = get_payment_history(customer_id)
+    history_df = fetch_payment_history(customer_id)
     if history_df.empty:
         st.info("No payments found for this customer.")
     else:
+        st.caption("Latest 20 payments — open the Statements page for the full history.")
         for row in history_df.itertuples():
             col1, col2, col3, col4, col5 = st.columns([2, 2, 2, 2, 1])
             col1.write(f"Txn ID: {row.transaction_id}")
-            col2.write(f"Kshs {row.amount:,.2f}")
+            col2.write(format_kshs(row.amount_cents))
             col3.write(row.method)
             col4.write(row.date)
             if col5.button("❌", key=f"del_{row.id}"):
@@ -147,3 +114,56 @@ if selected_customer:
                 st.warning("Payment deleted!")
                 st.rerun()
 
+# 5. Statement import
+st.markdown("---")
+st.subheader("📥 Mobile-Money / Bank Statement Import")
+with st.expander("Import a statement CSV"):
+    st.caption("Lines are matched to customers by phone number and paid to their open credit; "
+               "anything uncertain goes to the review queue below. Re-importing a file is safe.")
+    statement_file = st.file_uploader("Statement export (CSV)", type=["csv"])
+    icol1, icol2 = st.columns([1, 1])
+    with icol1:
+        window_days = st.number_input("Matching window (days after lending)", min_value=0, value=DEFAULT_WINDOW_DAYS)
+    with icol2:
+        import_method = st.selectbox("Record as method", ["Mpesa", "Bank", "Other"])
+    if st.button("📥 Import statement", disabled=statement_file is None):
+        try:
+            summary = reconcile(statement_file.getvalue(), int(window_days), import_method)
+        except StatementError as e:
+            st.error(str(e))
+        else:
+            st.success(f"{summary['matched']:,} line(s) matched → {summary['payments']:,} payment(s), "
+                       f"{format_kshs(summary['matched_cents'])}. {summary['review']:,} queued for review, "
+                       f"{summary['duplicates']:,} already imported, {summary['skipped']:,} other row(s) skipped "
+                       f"({summary['seconds']:.2f} s).")
+
+queued = count_review_queue()
+st.markdown(f"**Review queue** ({queued:,} line(s))")
+if queued:
+    customer_ids = customers_df["id"].tolist()
+    customer_names = dict(zip(customers_df["id"], customers_df["name"]))
+    review_lines = fetch_review_queue()
+    if queued > len(review_lines):
+        st.caption(f"Showing the oldest {len(review_lines)}.")
+    for line in review_lines:
+        rcol1, rcol2, rcol3, rcol4 = st.columns([4, 3, 1, 1])
+        with rcol1:
+            st.write(f"**{line.reference}** — {line.date} — {format_kshs(line.amount_cents)}")
+            st.caption(f"{line.phone or line.details} · {line.note}")
+        with rcol2:
+            suggested = customer_ids.index(line.customer_id) if line.customer_id in customer_ids else None
+            pay_to_customer = st.selectbox("Customer", customer_ids, index=suggested, format_func=customer_names.get,
+                                           key=f"review_cust_{line.reference}", label_visibility="collapsed",
+                                           placeholder="Choose customer")
+        with rcol3:
+            if st.button("✅ Apply", key=f"review_apply_{line.reference}", disabled=pay_to_customer is None):
+                try:
+                    resolve_statement_line(line.reference, pay_to_customer, import_method)
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    st.rerun()
+        with rcol4:
+            if st.button("🚫 Ignore", key=f"review_ignore_{line.reference}"):
+                ignore_statement_line(line.reference)
+                st.rerun()
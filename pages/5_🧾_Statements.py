@@ -0,0 +1,82 @@
+import streamlit as st
+from datetime import date, timedelta
+from database import init_db
+from money import format_kshs, format_kshs_many
+from repository import fetch_customers, fetch_statement_page, fetch_statement_summary
+
+PAGE_SIZE = 50
+
+st.set_page_config(page_title="Statements", page_icon="🧾", layout="wide")
+
+if "logged_in" not in st.session_state or not st.session_state.logged_in:
+    st.warning("🔒 Please log in to access this page.")
+    st.switch_page("pages/0_🔑_Login.py")
+
+# Show logout button on all protected pages
+if st.button("🚪 Logout"):
+    st.session_state.logged_in = False
+    st.switch_page("pages/0_🔑_Login.py")
+
+init_db()
+
+# --- Streamlit UI ---
+st.title("🧾 Customer Statement")
+
+customers = fetch_customers()
+if customers.empty:
+    st.info("No customers found.")
+    st.stop()
+
+col1, col2, col3 = st.columns([2, 2, 1])
+with col1:
+    customer = st.selectbox("Customer", customers.to_dict("records"), format_func=lambda x: x["name"])
+with col2:
+    date_range = st.date_input("Statement period", value=(date.today() - timedelta(days=90), date.today()))
+with col3:
+    include_archived = st.checkbox("Include archived", value=False, help="Also read settled transactions moved to the archive")
+
+if not isinstance(date_range, tuple) or len(date_range) != 2:
+    st.info("Pick a start and end date.")
+    st.stop()
+
+start = date_range[0].strftime("%Y-%m-%d")
+end = (date_range[1] + timedelta(days=1)).strftime("%Y-%m-%d")  # exclusive; payment dates may carry a time
+
+summary = fetch_statement_summary(customer["id"], start, end, include_archived)
+
+# cursor stack for paging; reset whenever the customer or period changes
+statement_key = (customer["id"], start, end, include_archived)
+if st.session_state.get("statement_key") != statement_key:
+    st.session_state.statement_key = statement_key
+    st.session_state.statement_cursors = [("", "", 0, summary["opening"])]
+
+cursors = st.session_state.statement_cursors
+page = fetch_statement_page(customer["id"], start, end, cursors[-1], limit=PAGE_SIZE, include_archived=include_archived)
+
+m1, m2, m3, m4 = st.columns(4)
+m1.metric("Opening Balance", format_kshs(summary["opening"]))
+m2.metric("Credit Given", format_kshs(summary["debits"]))
+m3.metric("Payments", format_kshs(summary["credits"]))
+m4.metric("Closing Balance", format_kshs(summary["closing"]))
+
+if page.empty:
+    st.info("No activity in this period.")
+else:
+    display = page[["date", "transaction_id", "description"]].copy()
+    display["debit"] = format_kshs_many(page["debit_cents"], blank_zero=True)
+    display["credit"] = format_kshs_many(page["credit_cents"], blank_zero=True)
+    display["balance"] = format_kshs_many(page["balance_cents"])
+    st.dataframe(display, use_container_width=True, hide_index=True)
+
+    nav1, nav2, nav3 = st.columns([1, 2, 1])
+    with nav1:
+        if len(cursors) > 1 and st.button("⬅️ Previous"):
+            cursors.pop()
+            st.rerun()
+    with nav2:
+        st.caption(f"Page {len(cursors)}")
+    with nav3:
+        if len(page) == PAGE_SIZE and st.button("Next ➡️"):
+            last = page.iloc[-1]
+            cursors.append((last["date"], last["kind"], int(last["id"]), int(last["balance_cents"])))
+            st.rerun()
@@ -0,0 +1,79 @@
+import streamlit as st
+import pandas as pd
+import plotly.express as px
+from datetime import date, timedelta
+from database import init_db
+from money import format_kshs
+from repository import fetch_daily_rollups
+
+GRANULARITY = {"Daily": "D", "Weekly": "W-MON", "Monthly": "MS"}
+
+st.set_page_config(page_title="Trends", page_icon="📈", layout="wide")
+
+if "logged_in" not in st.session_state or not st.session_state.logged_in:
+    st.warning("🔒 Please log in to access this page.")
+    st.switch_page("pages/0_🔑_Login.py")
+
+# Show logout button on all protected pages
+if st.button("🚪 Logout"):
+    st.session_state.logged_in = False
+    st.switch_page("pages/0_🔑_Login.py")
+
+init_db()
+
+# --- Streamlit UI ---
+st.title("📈 Collections Trends")
+
+rollups = fetch_daily_rollups()
+if rollups.empty:
+    st.info("No credit or payments recorded yet.")
+    st.stop()
+
+rollups["day"] = pd.to_datetime(rollups["day"], errors="coerce")
+rollups = rollups.dropna(subset=["day"])
+
+col1, col2 = st.columns([1, 2])
+with col1:
+    granularity = st.radio("Group by", list(GRANULARITY), index=1, horizontal=True)
+with col2:
+    period = st.date_input("Period", value=(date.today() - timedelta(days=180), date.today()))
+if not isinstance(period, tuple) or len(period) != 2:
+    st.info("Pick a start and end date.")
+    st.stop()
+start, end = pd.Timestamp(period[0]), pd.Timestamp(period[1])
+freq = GRANULARITY[granularity]
+
+# sums stay in integer cents; only the plotted values are converted to Kshs
+daily = rollups.pivot_table(index="day", columns="kind", values="amount_cents", aggfunc="sum", fill_value=0)
+daily = daily.reindex(columns=["issued", "collected"], fill_value=0).astype("int64")
+# outstanding needs the whole history, so accumulate before cutting to the period
+outstanding = (daily["issued"] - daily["collected"]).cumsum()
+
+in_period = daily[(daily.index >= start) & (daily.index <= end)]
+flows = (in_period.resample(freq).sum() / 100).rename(columns={"issued": "Credit issued", "collected": "Collected"})
+
+to_end = outstanding[outstanding.index <= end]
+
+m1, m2, m3 = st.columns(3)
+m1.metric("Credit Issued", format_kshs(in_period["issued"].sum()))
+m2.metric("Collected", format_kshs(in_period["collected"].sum()))
+m3.metric("Outstanding at End", format_kshs(to_end.iloc[-1] if not to_end.empty else 0))
+
+st.subheader("Credit issued vs collected")
+fig = px.bar(flows.reset_index().melt(id_vars="day", var_name="", value_name="Kshs"), x="day", y="Kshs", color="",
+             barmode="group")
+st.plotly_chart(fig, use_container_width=True)
+
+st.subheader("Collections by method")
+collected = rollups[(rollups["kind"] == "collected") & rollups["day"].between(start, end)]
+if collected.empty:
+    st.info("No payments in this period.")
+else:
+    by_method = collected.groupby([pd.Grouper(key="day", freq=freq), "method"])["amount_cents"].sum().reset_index()
+    by_method["Kshs"] = by_method.pop("amount_cents") / 100
+    st.plotly_chart(px.bar(by_method, x="day", y="Kshs", color="method"), use_container_width=True)
+
+st.subheader("Outstanding balance over time")
+balance = to_end.resample(freq).last().ffill()
+balance = balance[balance.index >= start - pd.tseries.frequencies.to_offset(freq)]
+st.plotly_chart(px.line((balance / 100).rename("Kshs").reset_index(), x="day", y="Kshs"), use_container_width=True)
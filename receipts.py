@@ -0,0 +1,135 @@
+"""
+Fixed-width receipts for 58/80 mm thermal printers.
+
+Built from the same data as the PDF receipts (repository.payment_receipt_data /
+transaction_receipt_data) with string formatting only, so a receipt takes
+microseconds and needs no PDF library. Output is plain text, or an ESC/POS
+byte stream for printers attached to the counter. PDF stays available for
+receipts that are emailed or filed.
+"""
+import importlib.util
+from functools import lru_cache
+
+from money import format_kshs
+
+PAPER_WIDTHS = {"58": 32, "80": 48}     # characters per line in the printer's standard font
+
+# format key -> (label, mime type, file extension)
+RECEIPT_FORMATS = {
+    "pdf": ("PDF (A4)", "application/pdf", "pdf"),
+    "text58": ("Text, 58 mm", "text/plain; charset=utf-8", "txt"),
+    "text80": ("Text, 80 mm", "text/plain; charset=utf-8", "txt"),
+    "escpos58": ("ESC/POS, 58 mm", "application/octet-stream", "bin"),
+    "escpos80": ("ESC/POS, 80 mm", "application/octet-stream", "bin"),
+}
+
+# ESC/POS commands
+ESC_INIT = b"\x1b@"
+ESC_ALIGN = {"left": b"\x1ba\x00", "center": b"\x1ba\x01"}
+ESC_BOLD_ON, ESC_BOLD_OFF = b"\x1bE\x01", b"\x1bE\x00"
+GS_SIZE_DOUBLE, GS_SIZE_NORMAL = b"\x1d!\x11", b"\x1d!\x00"
+GS_FEED_CUT = b"\x1dVB\x03"             # feed 3 lines, partial cut
+
+
+@lru_cache(maxsize=None)
+def pdf_backend():
+    """'reportlab' or 'fpdf', whichever is installed first, else None. Found
+    without importing either; the PDF generators import them on first use."""
+    for name in ("reportlab", "fpdf"):
+        if importlib.util.find_spec(name) is not None:
+            return name
+    return None
+
+
+# ---------- Layout ----------
+# A receipt is a list of (style, text) lines; style is one of
+# "title" (centred, double size), "center", "bold" or "normal".
+
+def _pair(left, right, width):
+    """Left text and right-aligned text on one line, truncating the left."""
+    room = width - len(right) - 1
+    return f"{left[:room]:<{room}} {right}"
+
+def _rule(width, char="-"):
+    return ("normal", char * width)
+
+def _item_lines(items, width):
+    lines = []
+    for name, qty, unit_cents, total_cents, _ in items:
+        lines.append(("normal", _pair(f"{qty} x {name}", format_kshs(total_cents, currency="").strip(), width)))
+        lines.append(("normal", f"    @ {format_kshs(unit_cents)}"))
+    return lines
+
+def _totals(total_tx, total_paid, width):
+    return [
+        ("normal", _pair("Transaction total", format_kshs(total_tx), width)),
+        ("normal", _pair("Paid to date", format_kshs(total_paid), width)),
+        ("bold", _pair("Balance", format_kshs(total_tx - total_paid), width)),
+    ]
+
+def payment_receipt_lines(data, width):
+    header, items, total_tx, total_paid = data
+    pid, amount, method, pdate, txid, customer_name, tx_status = header
+    return [
+        ("title", customer_name),
+        ("center", "PAYMENT RECEIPT"),
+        _rule(width),
+        ("normal", _pair(f"Receipt #{pid}", str(pdate), width)),
+        ("normal", _pair(f"Transaction #{txid}", tx_status, width)),
+        _rule(width),
+        *_item_lines(items, width),
+        _rule(width),
+        *_totals(total_tx, total_paid, width),
+        _rule(width, "="),
+        ("bold", _pair("AMOUNT PAID", format_kshs(amount), width)),
+        ("normal", _pair("Method", method, width)),
+    ]
+
+def transaction_receipt_lines(data, width):
+    header, items, total_tx, total_paid = data
+    txid, customer_name, tx_date, tx_status = header
+    return [
+        ("title", customer_name),
+        ("center", "CREDIT INVOICE"),
+        _rule(width),
+        ("normal", _pair(f"Transaction #{txid}", str(tx_date), width)),
+        ("normal", _pair("Status", tx_status, width)),
+        _rule(width),
+        *_item_lines(items, width),
+        _rule(width),
+        *_totals(total_tx, total_paid, width),
+    ]
+
+
+# ---------- Output ----------
+def render_text(lines, width):
+    out = []
+    for style, text in lines:
+        if style in ("title", "center"):
+            out.append(text[:width].center(width).rstrip())
+        else:
+            out.append(text)
+    return ("\n".join(out) + "\n").encode("utf-8")
+
+def render_escpos(lines, width):
+    out = [ESC_INIT]
+    for style, text in lines:
+        if style == "title":
+            # double width: half as many characters fit
+            out += [ESC_ALIGN["center"], GS_SIZE_DOUBLE, ESC_BOLD_ON,
+                    text[:width // 2].encode("cp437", "replace"), ESC_BOLD_OFF, GS_SIZE_NORMAL, b"\n",
+                    ESC_ALIGN["left"]]
+        elif style == "center":
+            out += [ESC_ALIGN["center"], text[:width].encode("cp437", "replace"), b"\n", ESC_ALIGN["left"]]
+        elif style == "bold":
+            out += [ESC_BOLD_ON, text.encode("cp437", "replace"), ESC_BOLD_OFF, b"\n"]
+        else:
+            out += [text.encode("cp437", "replace"), b"\n"]
+    out.append(GS_FEED_CUT)
+    return b"".join(out)
+
+def render_receipt(data, fmt, kind="payment"):
+    """Bytes for receipt data in a text/ESC-POS format ('text58', 'escpos80', ...)."""
+    width = PAPER_WIDTHS[fmt[-2:]]
+    lines = (payment_receipt_lines if kind == "payment" else transaction_receipt_lines)(data, width)
+    return render_escpos(lines, width) if fmt.startswith("escpos") else render_text(lines, width)
@@ -0,0 +1,254 @@
+"""
+Mobile-money / bank statement reconciliation.
+
+A statement CSV export (M-Pesa "Paid In" lines, bank credits) is parsed into
+StatementLine records. Each line is matched to a customer by normalised phone
+number and to their open transactions by amount and date. Both lookups are
+dict indexes built once per import. Matched lines become payments in one bulk
+write; lines that cannot be placed safely are queued for review
+(statement_lines, status 'review'), and re-imported references are skipped.
+
+    python reconcile.py statement.csv [--window-days 30] [--method Mpesa]
+"""
+import argparse
+import csv
+import io
+import re
+import time
+from collections import namedtuple
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+
+from database import init_db
+from money import format_kshs, to_cents
+from repository import allocate_amount, import_statement_lines
+
+StatementLine = namedtuple("StatementLine", "reference date amount_cents phone details")
+
+# header names seen in exports, lower-cased; the first one present wins
+COLUMN_ALIASES = {
+    "reference": ("receipt no.", "receipt no", "receipt", "transaction id", "transaction code", "reference", "ref no", "ref"),
+    "date": ("completion time", "transaction date", "value date", "date", "initiation time", "time"),
+    "amount": ("paid in", "money in", "credit", "credit amount", "amount"),
+    "phone": ("phone", "phone number", "msisdn", "sender phone", "mobile"),
+    "details": ("details", "description", "narrative", "particulars", "other party info"),
+    "status": ("transaction status", "status"),
+}
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%m/%d/%Y", "%d %b %Y")
+PHONE_IN_TEXT = re.compile(r"(?<!\d)(?:\+?254|0)?([17]\d{8})(?!\d)")
+NON_DIGITS = re.compile(r"\D")
+DEFAULT_WINDOW_DAYS = 30
+
+
+class StatementError(Exception):
+    pass
+
+
+# ---------- Parsing ----------
+def normalize_phone(raw):
+    """Last nine digits of a Kenyan number, so 0712 345678, +254712345678
+    and 254712345678 all give '712345678'. None if there are too few digits."""
+    digits = NON_DIGITS.sub("", raw or "")
+    return digits[-9:] if len(digits) >= 9 else None
+
+def phone_in_text(text):
+    """First phone number written in free text (e.g. M-Pesa 'Details'), normalised."""
+    match = PHONE_IN_TEXT.search(text or "")
+    return match.group(1) if match else None
+
+@lru_cache(maxsize=4096)
+def _parse_day(value):
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    raise StatementError(f"unrecognised date {value!r}")
+
+def parse_date(value):
+    """Statement timestamp -> 'YYYY-MM-DD' (payments keep the day only)."""
+    value = value.strip()
+    if len(value) >= 10 and value[4] == "-" and value[7] == "-":
+        try:
+            return date.fromisoformat(value[:10]).isoformat()
+        except ValueError:
+            raise StatementError(f"unrecognised date {value!r}")
+    day, _, clock = value.rpartition(" ")
+    return _parse_day(day if ":" in clock else value)  # drop a trailing time of day
+
+def parse_amount(value):
+    """'1,500.00' -> 150000 cents; blank or non-positive -> 0."""
+    value = (value or "").replace(",", "").strip()
+    if not value:
+        return 0
+    try:
+        cents = to_cents(Decimal(value))
+    except InvalidOperation:
+        raise StatementError(f"unrecognised amount {value!r}")
+    return max(cents, 0)
+
+def _columns(header):
+    names = [h.strip().lower() for h in header]
+    found = {}
+    for field, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in names:
+                found[field] = names.index(alias)
+                break
+    missing = {"reference", "date", "amount"} - found.keys()
+    if missing:
+        raise StatementError(f"statement has no {', '.join(sorted(missing))} column (headers: {', '.join(header)})")
+    return found
+
+def _statement_text(source):
+    """The statement as a text stream. Input that is not UTF-8 is a StatementError."""
+    try:
+        if isinstance(source, bytes):
+            return io.StringIO(source.decode("utf-8-sig"))
+        if isinstance(source, str):
+            if "\n" in source:
+                return io.StringIO(source)
+            with open(source, newline="", encoding="utf-8-sig") as f:
+                return io.StringIO(f.read())
+        with source:
+            return io.StringIO(source.read())
+    except UnicodeDecodeError as e:
+        raise StatementError(f"statement is not UTF-8 text (undecodable byte at position {e.start}); "
+                             "save it as CSV UTF-8 and import it again") from None
+
+
+def parse_statement(source):
+    """
+    Read a statement CSV (path, text, bytes or a text stream). Returns
+    (lines, skipped): money-in lines as StatementLine, and how many rows were
+    skipped (withdrawals, failed transactions, blank amounts).
+    """
+    with _statement_text(source) as source:
+        reader = csv.reader(source)
+        header = next(reader, None)
+        if header is None:
+            raise StatementError("statement is empty")
+        col = _columns(header)
+        ref_i, date_i, amount_i = col["reference"], col["date"], col["amount"]
+        phone_i, details_i, status_i = col.get("phone"), col.get("details"), col.get("status")
+        width = max(col.values()) + 1
+
+        lines, skipped = [], 0
+        for row in reader:
+            if len(row) < width or not row[ref_i].strip():
+                skipped += 1
+                continue
+            if status_i is not None and row[status_i].strip().lower() not in ("", "completed", "success", "successful"):
+                skipped += 1
+                continue
+            cents = parse_amount(row[amount_i])
+            if cents <= 0:
+                skipped += 1
+                continue
+            details = row[details_i].strip() if details_i is not None else ""
+            phone = row[phone_i].strip() if phone_i is not None else ""
+            lines.append(StatementLine(row[ref_i].strip(), parse_date(row[date_i]), cents, phone, details))
+    return lines, skipped
+
+
+# ---------- Matching ----------
+def build_phone_index(phone_rows):
+    """{normalised phone: [customer_id, ...]} from (id, phone) rows."""
+    index = {}
+    for customer_id, phone in phone_rows:
+        key = normalize_phone(phone)
+        if key:
+            index.setdefault(key, []).append(customer_id)
+    return index
+
+def build_open_index(open_rows):
+    """{customer_id: [[transaction_id, date, balance_cents], ...]} oldest first,
+    from (transaction_id, customer_id, date, balance_cents) rows."""
+    index = {}
+    for tx, customer_id, tx_date, balance in open_rows:
+        if balance > 0:
+            index.setdefault(customer_id, []).append([tx, tx_date, balance])
+    return index
+
+def match_line(line, phones, open_txs, window_days=DEFAULT_WINDOW_DAYS):
+    """
+    Decide one line: (status, customer_id, parts, note). Only credit lent
+    within `window_days` before the payment is considered. A transaction whose
+    balance equals the amount takes it whole (oldest first); otherwise the
+    amount is spread oldest first, or the line goes to review if that credit
+    cannot take all of it. Balances in `open_txs` are reduced as lines are matched.
+    """
+    key = normalize_phone(line.phone) or phone_in_text(line.details)
+    if key is None:
+        return "review", None, [], "no phone number on the line"
+    customers = phones.get(key)
+    if not customers:
+        return "review", None, [], f"no customer with phone ending {key[-4:]}"
+    if len(customers) > 1:
+        return "review", None, [], "phone shared by customers " + ", ".join(f"#{c}" for c in customers)
+    customer_id = customers[0]
+    txs = [t for t in open_txs.get(customer_id, ()) if t[2] > 0]
+    owed = sum(t[2] for t in txs)
+    if not owed:
+        return "review", customer_id, [], "customer owes nothing"
+    if line.amount_cents > owed:
+        return "review", customer_id, [], f"{format_kshs(line.amount_cents)} is more than the {format_kshs(owed)} owed"
+
+    # only credit lent on or before the payment, within the window, can take it
+    paid_on = date.fromisoformat(line.date)
+    eligible = [t for t in txs if 0 <= (paid_on - date.fromisoformat(t[1][:10])).days <= window_days]
+    exact = next((t for t in eligible if t[2] == line.amount_cents), None)
+    if exact is not None:
+        parts = [(exact[0], line.amount_cents)]
+        note = "exact amount"
+    elif line.amount_cents <= sum(t[2] for t in eligible):
+        parts = allocate_amount(line.amount_cents, [(t[0], t[2]) for t in eligible], "fifo")
+        note = "oldest first"
+    else:
+        return "review", customer_id, [], (f"{format_kshs(line.amount_cents)} is more than the credit lent "
+                                           f"in the {window_days} days before {line.date}")
+    paid = dict(parts)
+    for t in txs:
+        t[2] -= paid.get(t[0], 0)
+    return "matched", customer_id, parts, note
+
+def plan_lines(lines, phone_rows, open_rows, window_days=DEFAULT_WINDOW_DAYS):
+    phones = build_phone_index(phone_rows)
+    open_txs = build_open_index(open_rows)
+    return [match_line(line, phones, open_txs, window_days) for line in lines]
+
+
+def reconcile(source, window_days=DEFAULT_WINDOW_DAYS, method="Mpesa"):
+    """Parse, match and record a statement. Returns a summary dict."""
+    t0 = time.perf_counter()
+    lines, skipped = parse_statement(source)
+    decided, duplicates = import_statement_lines(
+        lines, lambda fresh, phones, open_rows: plan_lines(fresh, phones, open_rows, window_days), method)
+    matched = [(line, d) for line, d in decided if d[0] == "matched"]
+    return {
+        "lines": len(lines),
+        "matched": len(matched),
+        "review": len(decided) - len(matched),
+        "duplicates": duplicates,
+        "skipped": skipped,
+        "payments": sum(len(d[2]) for _, d in matched),
+        "matched_cents": sum(line.amount_cents for line, _ in matched),
+        "seconds": time.perf_counter() - t0,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconcile a mobile-money or bank statement CSV.")
+    parser.add_argument("path")
+    parser.add_argument("--window-days", type=int, default=DEFAULT_WINDOW_DAYS,
+                        help="how long after lending a payment is matched to that credit")
+    parser.add_argument("--method", default="Mpesa", help="payment method recorded for matched lines")
+    args = parser.parse_args()
+
+    init_db()
+    r = reconcile(args.path, args.window_days, args.method)
+    print(f"{r['lines']:,} money-in lines ({r['skipped']:,} other rows skipped) in {r['seconds']:.2f} s")
+    print(f"matched:    {r['matched']:,} lines -> {r['payments']:,} payments, {format_kshs(r['matched_cents'])}")
+    print(f"review:     {r['review']:,} lines queued")
+    print(f"duplicates: {r['duplicates']:,} lines already imported")
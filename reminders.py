@@ -0,0 +1,238 @@
+"""
+Payment reminders for overdue credit.
+
+One query picks customers whose credit has been open longer than N days and
+renders a message for each. The messages go through an asyncio queue: a few
+workers share a rate limiter, and transient gateway errors are retried with
+backoff. Each customer gets at most one reminder a day: a reminder is claimed
+in reminders_sent before it is sent, so overlapping runs (cron and the UI
+button) never message the same customer twice, and its outcome is recorded
+as soon as it is known. Run it outside the UI, e.g. daily from cron:
+
+    python reminders.py --days 30 --rate 5 --gateway file:data/outbox/reminders.jsonl
+    python reminders.py --dry-run                       # list who would be reminded
+
+Gateways are pluggable: "file:<path>" writes JSON lines (for testing or a
+local SMS bridge), "module:Class" loads any class implementing Gateway.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import time
+from collections import namedtuple
+from datetime import date
+from decimal import Decimal
+
+from database import init_db
+from money import format_kshs, to_cents
+from repository import claim_reminder, fetch_overdue_customers, record_reminder
+from stats import percentile
+
+DEFAULT_TEMPLATE = ("Hello {name}, you have {overdue} of credit outstanding since {oldest_date} "
+                    "(total balance {balance}). Kindly clear it at your earliest convenience. Thank you.")
+DEFAULT_GATEWAY = "file:data/outbox/reminders.jsonl"
+
+Reminder = namedtuple("Reminder", "customer_id phone balance_cents text")
+
+
+# ---------- Gateways ----------
+class TransientGatewayError(Exception):
+    """Raised by a gateway for failures worth retrying (timeouts, throttling)."""
+
+
+class Gateway:
+    """Sends one message. Raise TransientGatewayError to have it retried;
+    any other exception fails that reminder."""
+
+    async def send(self, phone, text):
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class FileGateway(Gateway):
+    """Appends each message as a JSON line. latency and fail_rate simulate a
+    real gateway when exercising the dispatcher."""
+
+    def __init__(self, path, latency=0.0, fail_rate=0.0):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+        self.latency = latency
+        self.fail_rate = fail_rate
+
+    async def send(self, phone, text):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.fail_rate and random.random() < self.fail_rate:
+            raise TransientGatewayError("simulated gateway failure")
+        self.file.write(json.dumps({"to": phone, "text": text, "at": time.strftime("%Y-%m-%d %H:%M:%S")}) + "\n")
+
+    async def close(self):
+        self.file.close()
+
+
+def load_gateway(spec, **options):
+    """'file:<path>' or 'package.module:ClassName' (constructed with **options)."""
+    kind, _, target = spec.partition(":")
+    if kind == "file":
+        return FileGateway(target or DEFAULT_GATEWAY.partition(":")[2], **options)
+    if not target:
+        raise ValueError(f"gateway {spec!r} should look like 'file:<path>' or 'module:Class'")
+    return getattr(importlib.import_module(kind), target)(**options)
+
+
+# ---------- Selection ----------
+def build_reminders(rows, template=DEFAULT_TEMPLATE):
+    """Reminder per customer row, with counts of rows left out."""
+    reminders, skipped = [], {"reminded_today": 0, "no_phone": 0}
+    for row in rows:
+        if row.reminded_today:
+            skipped["reminded_today"] += 1
+        elif not (row.phone or "").strip():
+            skipped["no_phone"] += 1
+        else:
+            text = template.format(name=row.name, balance=format_kshs(row.balance_cents),
+                                   overdue=format_kshs(row.overdue_cents), oldest_date=row.oldest_date)
+            reminders.append(Reminder(row.customer_id, row.phone.strip(), row.balance_cents, text))
+    return reminders, skipped
+
+
+# ---------- Dispatch ----------
+class RateLimiter:
+    """At most `rate` acquisitions per second, spaced evenly."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_at = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            now = time.monotonic()
+            wait = self.next_at - now
+            self.next_at = max(now, self.next_at) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+async def dispatch(reminders, gateway, rate=5.0, concurrency=4, max_attempts=3, backoff=1.0, on_result=None,
+                   claim=None):
+    """
+    Send reminders through `gateway` with `concurrency` workers sharing one
+    rate limit. claim(reminder) is called before a reminder is sent; if it
+    returns False the reminder is skipped. on_result(reminder, status,
+    attempts, error) is called as each one finishes. Returns metrics.
+    """
+    queue = asyncio.Queue()
+    for reminder in reminders:
+        queue.put_nowait(reminder)
+    limiter = RateLimiter(rate)
+    metrics = {"sent": 0, "failed": 0, "retries": 0, "claimed_elsewhere": 0}
+    latencies = []
+
+    async def worker():
+        while True:
+            try:
+                reminder = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            if claim and not claim(reminder):
+                metrics["claimed_elsewhere"] += 1
+                continue
+            status, attempt = "failed", 0
+            while attempt < max_attempts:
+                attempt += 1
+                await limiter.acquire()
+                t0 = time.perf_counter()
+                try:
+                    await gateway.send(reminder.phone, reminder.text)
+                    error, retry = None, False
+                except TransientGatewayError as e:
+                    error, retry = str(e), True
+                except Exception as e:
+                    error, retry = f"{type(e).__name__}: {e}", False
+                latencies.append(time.perf_counter() - t0)
+                if error is None:
+                    status = "sent"
+                    break
+                if not retry or attempt == max_attempts:
+                    break
+                metrics["retries"] += 1
+                await asyncio.sleep(backoff * 2 ** (attempt - 1))
+            metrics[status] += 1
+            if on_result:
+                on_result(reminder, status, attempt, error)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    elapsed = time.perf_counter() - t0
+    metrics.update({
+        "seconds": elapsed,
+        "per_second": metrics["sent"] / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    })
+    return metrics
+
+
+def run_reminders(gateway, overdue_days=30, min_cents=1, template=DEFAULT_TEMPLATE, rate=5.0, concurrency=4,
+                  max_attempts=3, backoff=1.0):
+    """Select, render and send today's reminders, claiming each one in
+    reminders_sent before it is sent and recording its outcome. Returns metrics.
+    A run that dies mid-send leaves its claims 'pending', so those customers
+    are not messaged again that day."""
+    day = date.today()
+    day_key = day.strftime("%Y-%m-%d")
+    reminders, skipped = build_reminders(fetch_overdue_customers(overdue_days, min_cents, day), template)
+
+    def claim(reminder):
+        return claim_reminder(reminder.customer_id, day_key, reminder.balance_cents)
+
+    def on_result(reminder, status, attempts, error):
+        record_reminder(reminder.customer_id, day_key, status, attempts, error)
+
+    async def main():
+        try:
+            return await dispatch(reminders, gateway, rate, concurrency, max_attempts, backoff, on_result, claim)
+        finally:
+            await gateway.close()
+
+    metrics = asyncio.run(main())
+    metrics.update(candidates=len(reminders), **{f"skipped_{k}": v for k, v in skipped.items()})
+    return metrics
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send payment reminders for overdue credit.")
+    parser.add_argument("--days", type=int, default=30, help="remind about credit older than this")
+    parser.add_argument("--min-balance", type=Decimal, default=Decimal("1"), help="minimum overdue amount in Kshs")
+    parser.add_argument("--gateway", default=DEFAULT_GATEWAY, help="'file:<path>' or 'module:Class'")
+    parser.add_argument("--rate", type=float, default=5.0, help="messages per second")
+    parser.add_argument("--concurrency", type=int, default=4, help="messages in flight")
+    parser.add_argument("--attempts", type=int, default=3, help="tries per message for transient errors")
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE,
+                        help="message with {name}, {overdue}, {balance}, {oldest_date}")
+    parser.add_argument("--dry-run", action="store_true", help="list who would be reminded; send nothing")
+    args = parser.parse_args()
+
+    init_db()
+    min_cents = to_cents(args.min_balance)
+    if args.dry_run:
+        reminders, skipped = build_reminders(fetch_overdue_customers(args.days, min_cents), args.template)
+        for r in reminders:
+            print(f"{r.phone:<15} {r.text}")
+        print(f"{len(reminders)} reminder(s); skipped {skipped['reminded_today']} already reminded today, "
+              f"{skipped['no_phone']} without a phone number")
+    else:
+        m = run_reminders(load_gateway(args.gateway), args.days, min_cents, args.template, args.rate,
+                          args.concurrency, args.attempts)
+        print(f"candidates: {m['candidates']}  (skipped {m['skipped_reminded_today']} already reminded today, "
+              f"{m['skipped_no_phone']} without a phone)")
+        print(f"sent:       {m['sent']}  failed: {m['failed']}  retries: {m['retries']}  "
+              f"claimed by another run: {m['claimed_elsewhere']}")
+        print(f"throughput: {m['per_second']:.1f} messages/s over {m['seconds']:.1f} s  "
+              f"gateway p50={m['p50_ms']:.1f} ms  p99={m['p99_ms']:.1f} ms")
@@ -0,0 +1,155 @@
+"""
+Read-only reporting snapshots of the ledger.
+
+Heavy reads (the accounts export, the owed-customers ranking and aging, month-end
+reports) run against a copy of data/shop.db instead of the live file, so long
+scans neither compete with cashiers' writes for I/O nor hold back WAL
+checkpoints. A copy is made with VACUUM INTO (one consistent read of the live
+database, compacted as it is written) into data/reports/ledger-<stamp>.db and
+published under a new name, so readers of the previous copy are never
+disturbed. Report connections open the newest copy read-only, with mmap.
+
+Copies older than REPORT_MAX_AGE_SECONDS are refreshed in the background on
+the next report read; the UI shows how old the data is. Refresh from cron too
+if reports should be fresh at opening time:
+
+    python reporting.py refresh
+    python reporting.py status
+"""
+import argparse
+import glob
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from backup import STAMP_FORMAT
+from database import CACHED_STATEMENTS, create_connection, init_db
+
+REPORT_DIR = 'data/reports'
+REPORT_PREFIX = 'ledger-'
+REPORT_MAX_AGE_SECONDS = 10 * 60
+REPORT_KEEP = 2                     # the newest copy and the one before it (possibly still being read)
+MMAP_SIZE = 256 * 1024 * 1024       # bytes of the copy read through the OS page cache, not read() calls
+
+_refresh_lock = threading.Lock()
+
+
+def list_snapshots(report_dir=REPORT_DIR):
+    """Snapshots as (taken_at, path), oldest first."""
+    found = []
+    for path in glob.glob(os.path.join(report_dir, f"{REPORT_PREFIX}*.db")):
+        stamp = os.path.basename(path)[len(REPORT_PREFIX):-len(".db")]
+        try:
+            found.append((datetime.strptime(stamp, STAMP_FORMAT), path))
+        except ValueError:
+            continue
+    return sorted(found)
+
+
+def latest_snapshot(report_dir=REPORT_DIR):
+    """(taken_at, path) of the newest snapshot, or None."""
+    snapshots = list_snapshots(report_dir)
+    return snapshots[-1] if snapshots else None
+
+
+def snapshot_age(report_dir=REPORT_DIR):
+    """Seconds since the newest snapshot was taken, or None if there is none."""
+    latest = latest_snapshot(report_dir)
+    return (datetime.now() - latest[0]).total_seconds() if latest else None
+
+
+def _prune(keep, report_dir):
+    for _, path in list_snapshots(report_dir)[:-keep]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass    # still open somewhere (Windows); removed on a later refresh
+
+
+def refresh_snapshot(report_dir=REPORT_DIR, keep=REPORT_KEEP):
+    """Copy the live ledger into a new snapshot and prune old ones. Returns its
+    path (the existing one if a snapshot was already taken this second)."""
+    with _refresh_lock:
+        os.makedirs(report_dir, exist_ok=True)
+        path = os.path.join(report_dir, f"{REPORT_PREFIX}{datetime.now().strftime(STAMP_FORMAT)}.db")
+        if os.path.exists(path):
+            return path
+        part = path + ".part"
+        if os.path.exists(part):
+            os.remove(part)
+        src = create_connection()
+        try:
+            src.execute("VACUUM INTO ?", (part,))
+        finally:
+            src.close()
+        # readers open the copy with mode=ro, which cannot create the -wal/-shm files WAL needs
+        dest = sqlite3.connect(part)
+        try:
+            dest.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            dest.close()
+        os.replace(part, path)
+        _prune(keep, report_dir)
+        return path
+
+
+def refresh_in_background(report_dir=REPORT_DIR):
+    """Start a refresh unless one is already running in this process."""
+    if _refresh_lock.locked():
+        return
+    threading.Thread(target=refresh_snapshot, args=(report_dir,), daemon=True,
+                     name="report-refresh").start()
+
+
+def connect_report(max_age=REPORT_MAX_AGE_SECONDS, report_dir=REPORT_DIR):
+    """
+    New read-only connection to the newest snapshot (close it when done).
+    The first call takes a snapshot if there is none; afterwards a snapshot
+    older than max_age is served as is while a fresh one is made.
+    """
+    latest = latest_snapshot(report_dir)
+    if latest is None:
+        path = refresh_snapshot(report_dir)
+    else:
+        taken_at, path = latest
+        if (datetime.now() - taken_at).total_seconds() > max_age:
+            refresh_in_background(report_dir)
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False,
+                           cached_statements=CACHED_STATEMENTS)
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    return conn
+
+
+def describe_age(seconds):
+    """'just now', '4 min ago', '2 h 5 min ago'."""
+    minutes = int(seconds // 60)
+    if minutes < 1:
+        return "just now"
+    if minutes < 60:
+        return f"{minutes} min ago"
+    return f"{minutes // 60} h {minutes % 60} min ago"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the read-only reporting snapshot.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("refresh", help="take a fresh snapshot now")
+    sub.add_parser("status", help="list snapshots and their age")
+    args = parser.parse_args()
+
+    if args.command == "refresh":
+        init_db()
+        t0 = time.perf_counter()
+        path = refresh_snapshot()
+        print(f"{path}: {os.path.getsize(path) / 1e6:.1f} MB in {time.perf_counter() - t0:.2f} s")
+    else:
+        snapshots = list_snapshots()
+        for taken_at, path in snapshots:
+            print(f"{path}  {os.path.getsize(path) / 1e6:.1f} MB  taken {taken_at:%Y-%m-%d %H:%M:%S}")
+        if snapshots:
+            print(f"newest is {describe_age(snapshot_age())}; refreshed when older than "
+                  f"{REPORT_MAX_AGE_SECONDS // 60} min")
+        else:
+            print("no snapshot yet; the first report read takes one")
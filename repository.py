@@ -0,0 +1,1110 @@
+"""
+All ledger SQL in one place.
+
+Statements are module constants and run on the connection leased to the
+current thread by database.get_connection(). Connections outlive their thread
+(and so the Streamlit rerun), so sqlite3 re-uses their prepared form. Small
+lookups come back as namedtuple rows (tuples with empty __slots__); listings
+meant for tables come back as DataFrames.
+"""
+import json
+import sqlite3
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import pandas as pd
+
+from archive import attach_archive, table_source
+from database import get_connection
+from money import format_kshs, line_total
+
+# ---------- Customers ----------
+SQL_INSERT_CUSTOMER = "INSERT INTO customers (name, phone) VALUES (?, ?)"
+SQL_ALL_CUSTOMERS = """
+    SELECT c.id, c.name, c.phone, c.created_at, c.credit_limit_cents,
+           s.band AS risk, s.score, s.overdue_days, s.repayment_ratio, s.avg_days_to_settle, s.velocity_cents
+    FROM customers c
+    LEFT JOIN customer_scores s ON s.customer_id = c.id
+    WHERE c.deleted_at IS NULL ORDER BY c.created_at DESC
+"""
+SQL_CUSTOMER_NAMES = "SELECT id, name FROM customers WHERE deleted_at IS NULL ORDER BY name"
+SQL_CUSTOMER_PICKER = """
+    SELECT c.id, c.name, s.band AS risk, s.score, s.overdue_days, s.repayment_ratio, s.avg_days_to_settle
+    FROM customers c
+    LEFT JOIN customer_scores s ON s.customer_id = c.id
+    WHERE c.deleted_at IS NULL ORDER BY c.name
+"""
+# soft delete: their transactions keep pointing at them (ON DELETE RESTRICT)
+SQL_DELETE_CUSTOMER = "UPDATE customers SET deleted_at = CURRENT_TIMESTAMP WHERE id = ?"
+
+# ---------- Credit limits ----------
+SQL_CREDIT_LIMIT = "SELECT credit_limit_cents FROM customers WHERE id = ?"
+SQL_CUSTOMER_DELETED = "SELECT deleted_at IS NOT NULL FROM customers WHERE id = ?"
+SQL_PRODUCT_DELETED = "SELECT deleted_at IS NOT NULL FROM products WHERE id = ?"
+SQL_SET_CREDIT_LIMIT = "UPDATE customers SET credit_limit_cents = ? WHERE id = ?"
+SQL_GET_SETTING = "SELECT value FROM settings WHERE key = ?"
+SQL_SET_SETTING = "INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value"
+SQL_LEDGER_VERSION = "SELECT version FROM ledger_version WHERE id = 1"
+SQL_PRODUCTS_VERSION = "SELECT version FROM products_version WHERE id = 1"
+# customer_balances is kept up to date by triggers (database.create_customer_balances)
+SQL_BALANCES_BY_CUSTOMER = "SELECT customer_id, balance_cents FROM customer_balances WHERE balance_cents != 0"
+SQL_TX_CUSTOMER = "SELECT customer_id FROM credit_transactions WHERE id = ?"
+SQL_IDEMPOTENT_RESPONSE = "SELECT response FROM idempotency_keys WHERE scope = ? AND key = ?"
+SQL_SAVE_IDEMPOTENT_RESPONSE = "INSERT INTO idempotency_keys (scope, key, response) VALUES (?, ?, ?)"
+SQL_INSERT_CREDIT_BLOCK = """
+    INSERT INTO credit_blocks (customer_id, attempted_cents, balance_cents, limit_cents, reason)
+    VALUES (?, ?, ?, ?, ?)
+"""
+SQL_CREDIT_BLOCKS = """
+    SELECT b.created_at, cu.name AS customer, b.reason, b.attempted_cents, b.balance_cents, b.limit_cents
+    FROM credit_blocks b LEFT JOIN customers cu ON cu.id = b.customer_id
+    ORDER BY b.id DESC
+    LIMIT ?
+"""
+EXPOSURE_CAP_KEY = "exposure_cap_cents"
+
+# ---------- Products ----------
+SQL_INSERT_PRODUCT = "INSERT INTO products (name, price_cents) VALUES (?, ?)"
+SQL_ALL_PRODUCTS = "SELECT id, name, price_cents, created_at FROM products WHERE deleted_at IS NULL ORDER BY created_at DESC"
+SQL_PRODUCT_PRICES = "SELECT id, name, price_cents FROM products WHERE deleted_at IS NULL ORDER BY name"
+SQL_DELETE_PRODUCT = "UPDATE products SET deleted_at = CURRENT_TIMESTAMP WHERE id = ?"
+
+# ---------- Transactions, items, payments ----------
+SQL_TX_CREDIT_TOTAL = "SELECT COALESCE(SUM(total_price_cents),0) FROM credit_items WHERE transaction_id=?"
+SQL_TX_PAID_TOTAL = "SELECT COALESCE(SUM(amount_cents),0) FROM payments WHERE transaction_id=?"
+SQL_SET_TX_STATUS = "UPDATE credit_transactions SET status=? WHERE id=?"
+# Which transaction new credit goes into:
+#   "until_paid" - the customer's latest open transaction, until it is paid off
+#   "per_day"    - an open transaction with the same lending date, else a new one
+#   "new"        - always a new transaction
+# The shop's choice is kept in settings under OPEN_TX_POLICY_KEY; API requests may override it.
+OPEN_TX_POLICIES = ("until_paid", "per_day", "new")
+OPEN_TX_POLICY = "until_paid"          # when nothing is stored
+OPEN_TX_POLICY_KEY = "open_tx_policy"
+
+# both lookups are served by the partial index idx_ct_open (status != 'Paid')
+SQL_OPEN_TX_FOR_CUSTOMER = """
+    SELECT id FROM credit_transactions
+    WHERE customer_id=? AND status!='Paid'
+    ORDER BY date DESC, id DESC LIMIT 1
+"""
+SQL_OPEN_TX_FOR_CUSTOMER_ON = """
+    SELECT id FROM credit_transactions
+    WHERE customer_id=? AND status!='Paid' AND date=?
+    ORDER BY id DESC LIMIT 1
+"""
+SQL_INSERT_TX = "INSERT INTO credit_transactions (customer_id, date, status) VALUES (?, ?, 'Unpaid')"
+SQL_INSERT_ITEM = """
+    INSERT INTO credit_items (transaction_id, product_id, quantity, unit_price_cents, total_price_cents)
+    VALUES (?, ?, ?, ?, ?)
+"""
+SQL_ITEM_TX = """
+    SELECT ci.transaction_id, ci.total_price_cents, ct.customer_id
+    FROM credit_items ci JOIN credit_transactions ct ON ct.id = ci.transaction_id WHERE ci.id=?
+"""
+SQL_UPDATE_ITEM = "UPDATE credit_items SET quantity=?, unit_price_cents=?, total_price_cents=? WHERE id=?"
+SQL_INSERT_PAYMENT = """
+    INSERT INTO payments (transaction_id, amount_cents, method, date, customer_id)
+    VALUES (?1, ?2, ?3, ?4, (SELECT customer_id FROM credit_transactions WHERE id = ?1))
+"""
+SQL_RECALC_BATCH = """
+    UPDATE credit_transactions
+    SET status = CASE WHEN t.credit - t.paid <= 0 THEN 'Paid'
+                      WHEN t.paid > 0 THEN 'Partially Paid'
+                      ELSE 'Unpaid' END
+    FROM (SELECT b.id,
+                 COALESCE((SELECT SUM(total_price_cents) FROM credit_items WHERE transaction_id = b.id), 0) AS credit,
+                 COALESCE((SELECT SUM(amount_cents) FROM payments WHERE transaction_id = b.id), 0) AS paid
+          FROM recalc_batch b) t
+    WHERE credit_transactions.id = t.id
+"""
+# every transaction at once; only rows whose status actually changes are written
+SQL_RECALC_ALL = """
+    UPDATE credit_transactions
+    SET status = t.status
+    FROM (SELECT ct.id,
+                 CASE WHEN COALESCE(i.credit, 0) - COALESCE(p.paid, 0) <= 0 THEN 'Paid'
+                      WHEN COALESCE(p.paid, 0) > 0 THEN 'Partially Paid'
+                      ELSE 'Unpaid' END AS status
+          FROM credit_transactions ct
+          LEFT JOIN (SELECT transaction_id, SUM(total_price_cents) AS credit
+                     FROM credit_items GROUP BY transaction_id) i ON i.transaction_id = ct.id
+          LEFT JOIN (SELECT transaction_id, SUM(amount_cents) AS paid
+                     FROM payments GROUP BY transaction_id) p ON p.transaction_id = ct.id) t
+    WHERE credit_transactions.id = t.id AND credit_transactions.status IS NOT t.status
+"""
+SQL_BATCH_BALANCES = """
+    SELECT ct.id, ct.customer_id,
+           COALESCE((SELECT SUM(total_price_cents) FROM credit_items WHERE transaction_id = ct.id), 0)
+         - COALESCE((SELECT SUM(amount_cents) FROM payments WHERE transaction_id = ct.id), 0)
+    FROM recalc_batch b JOIN credit_transactions ct ON ct.id = b.id
+"""
+SQL_PAYMENT_TX = """
+    SELECT p.transaction_id, p.amount_cents, ct.customer_id
+    FROM payments p JOIN credit_transactions ct ON ct.id = p.transaction_id WHERE p.id=?
+"""
+SQL_DELETE_PAYMENT = "DELETE FROM payments WHERE id=?"
+SQL_TX_BALANCE = """
+    SELECT customer_id,
+           COALESCE((SELECT SUM(total_price_cents) FROM credit_items WHERE transaction_id = ct.id), 0)
+         - COALESCE((SELECT SUM(amount_cents) FROM payments WHERE transaction_id = ct.id), 0)
+    FROM credit_transactions ct WHERE id=?
+"""
+SQL_DELETE_TX = "DELETE FROM credit_transactions WHERE id=?"  # items and payments cascade
+
+SQL_GROUPED_ACCOUNTS = """
+    SELECT
+      ct.id AS transaction_id,
+      cu.id AS customer_id,
+      cu.name AS customer_name,
+      ct.date,
+      ct.status,
+      COALESCE((SELECT SUM(ci.total_price_cents) FROM credit_items ci WHERE ci.transaction_id = ct.id),0) AS total_cents,
+      COALESCE((SELECT SUM(p.amount_cents) FROM payments p WHERE p.transaction_id = ct.id),0) AS paid_cents,
+      COALESCE((SELECT SUM(ci.total_price_cents) FROM credit_items ci WHERE ci.transaction_id = ct.id),0) - COALESCE((SELECT SUM(p.amount_cents) FROM payments p WHERE p.transaction_id = ct.id),0) AS balance_cents
+    FROM credit_transactions ct
+    JOIN customers cu ON ct.customer_id = cu.id
+    WHERE 1=1
+"""
+SQL_OPEN_TRANSACTIONS = """
+    SELECT * FROM (
+        SELECT ct.id AS transaction_id, ct.date,
+               COALESCE((SELECT SUM(ci.total_price_cents) FROM credit_items ci WHERE ci.transaction_id = ct.id),0) AS total_credit_cents,
+               COALESCE((SELECT SUM(p.amount_cents) FROM payments p WHERE p.transaction_id = ct.id),0) AS total_paid_cents
+        FROM credit_transactions ct
+        WHERE ct.customer_id = ?
+    )
+    WHERE total_credit_cents - total_paid_cents > 0
+    ORDER BY date, transaction_id
+"""
+SQL_ITEMS_WITH_NAMES = """
+    SELECT ci.id, ci.product_id, p.name AS product, ci.quantity, ci.unit_price_cents, ci.total_price_cents
+    FROM credit_items ci JOIN products p ON ci.product_id = p.id
+    WHERE ci.transaction_id = ?
+"""
+SQL_TX_PAYMENTS = "SELECT id, amount_cents, method, date FROM payments WHERE transaction_id = ? ORDER BY date DESC"
+SQL_PAYMENT_HISTORY = """
+    SELECT p.id, p.transaction_id, p.amount_cents, p.method, p.date
+    FROM payments p
+    JOIN credit_transactions ct ON p.transaction_id = ct.id
+    WHERE ct.customer_id = ?
+    ORDER BY p.date DESC, p.id DESC
+    LIMIT ?
+"""
+
+# ---------- Receipts ----------
+SQL_PAYMENT_RECEIPT = """
+    SELECT p.id, p.amount_cents, p.method, p.date, p.transaction_id, cu.name, ct.status
+    FROM payments p
+    JOIN credit_transactions ct ON p.transaction_id = ct.id
+    JOIN customers cu ON ct.customer_id = cu.id
+    WHERE p.id = ?
+"""
+SQL_TX_RECEIPT = """
+    SELECT ct.id, cu.name, ct.date, ct.status
+    FROM credit_transactions ct
+    JOIN customers cu ON ct.customer_id = cu.id
+    WHERE ct.id = ?
+"""
+SQL_RECEIPT_ITEMS = """
+    SELECT p.name, ci.quantity, ci.unit_price_cents, ci.total_price_cents, ct.date
+    FROM credit_items ci
+    JOIN products p ON ci.product_id = p.id
+    JOIN credit_transactions ct ON ci.transaction_id = ct.id
+    WHERE ci.transaction_id = ?
+    ORDER BY ct.date ASC, p.name ASC
+"""
+
+# ---------- Product analytics ----------
+# drives from the period's transactions (idx_ct_date) and reads their items
+# from the covering idx_ci_transaction_product, so cost follows the period
+SQL_PRODUCT_STATS = """
+    SELECT p.id, p.name, p.price_cents,
+           SUM(ci.quantity) AS units,
+           SUM(ci.total_price_cents) AS value_cents,
+           COUNT(DISTINCT ci.transaction_id) AS transactions,
+           COUNT(*) AS lines,
+           SUM(ci.unit_price_cents != p.price_cents) AS overrides
+    FROM credit_transactions ct
+    JOIN credit_items ci ON ci.transaction_id = ct.id
+    JOIN products p ON p.id = ci.product_id
+    WHERE ct.date >= :start AND ct.date < :end
+    GROUP BY ci.product_id
+"""
+
+# ---------- Trends ----------
+SQL_DAILY_ROLLUPS = "SELECT day, kind, method, amount_cents FROM daily_rollups WHERE amount_cents != 0 ORDER BY day"
+
+# ---------- Statements ----------
+# One customer's credit lines and payments from one schema ('main' or
+# 'archive'), each walking a (customer_id, date) index; {bounds} is a condition
+# on {date}. kind keeps (date, kind, id) unique across the two tables ('credit'
+# sorts before 'payment' on the same date).
+SQL_STATEMENT_CREDITS = """
+    SELECT ct.date AS date, 'credit' AS kind, ci.id AS id, ct.id AS transaction_id,
+           p.name || ' x' || ci.quantity AS description,
+           ci.total_price_cents AS debit_cents, 0 AS credit_cents
+    FROM {schema}.credit_transactions ct
+    JOIN {schema}.credit_items ci ON ci.transaction_id = ct.id
+    JOIN main.products p ON p.id = ci.product_id
+    WHERE ct.customer_id = :customer_id AND {bounds}
+"""
+SQL_STATEMENT_PAYMENTS = """
+    SELECT pay.date AS date, 'payment' AS kind, pay.id AS id, pay.transaction_id AS transaction_id,
+           'Payment (' || pay.method || ')' AS description,
+           0 AS debit_cents, pay.amount_cents AS credit_cents
+    FROM {schema}.payments pay
+    WHERE pay.customer_id = :customer_id AND {bounds}
+"""
+# net of everything from :start on, then debits/credits within [:start, :end)
+SQL_STATEMENT_SUMMARY = """
+    SELECT
+        COALESCE(SUM(debit_cents - credit_cents), 0),
+        COALESCE(SUM(CASE WHEN date < :end THEN debit_cents END), 0),
+        COALESCE(SUM(CASE WHEN date < :end THEN credit_cents END), 0)
+    FROM ({entries})
+"""
+# each source gives at most one page after the cursor, in key order, so a page
+# merges a few pages' worth of rows however long the history is
+SQL_STATEMENT_PAGE_PART = """
+    SELECT * FROM ({entries})
+    WHERE (date, kind, id) > (:after_date, :after_kind, :after_id)
+    ORDER BY date, id
+    LIMIT :limit
+"""
+SQL_STATEMENT_PAGE = """
+    SELECT date, kind, id, transaction_id, description, debit_cents, credit_cents,
+           :balance + SUM(debit_cents - credit_cents)
+               OVER (ORDER BY date, kind, id ROWS UNBOUNDED PRECEDING) AS balance_cents
+    FROM ({parts})
+    ORDER BY date, kind, id
+    LIMIT :limit
+"""
+
+# ---------- Statement reconciliation ----------
+SQL_CUSTOMER_PHONES = "SELECT id, phone FROM customers WHERE deleted_at IS NULL AND COALESCE(phone, '') != ''"
+# every open transaction with its balance (idx_ct_open), oldest first per customer
+SQL_ALL_OPEN_BALANCES = """
+    SELECT ct.id, ct.customer_id, ct.date,
+           COALESCE((SELECT SUM(total_price_cents) FROM credit_items WHERE transaction_id = ct.id), 0)
+         - COALESCE((SELECT SUM(amount_cents) FROM payments WHERE transaction_id = ct.id), 0) AS balance_cents
+    FROM credit_transactions ct
+    WHERE ct.status != 'Paid'
+    ORDER BY ct.customer_id, ct.date, ct.id
+"""
+SQL_KNOWN_STATEMENT_REFS = "SELECT reference FROM statement_lines WHERE reference IN (SELECT reference FROM statement_batch)"
+SQL_INSERT_STATEMENT_LINE = """
+    INSERT INTO statement_lines (reference, date, amount_cents, phone, details, status, note, customer_id, allocation)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_REVIEW_QUEUE = """
+    SELECT reference, date, amount_cents, phone, details, note, customer_id FROM statement_lines
+    WHERE status = 'review' ORDER BY date, reference
+    LIMIT ?
+"""
+SQL_REVIEW_COUNT = "SELECT COUNT(*) FROM statement_lines WHERE status = 'review'"
+SQL_STATEMENT_LINE = "SELECT reference, date, amount_cents, status FROM statement_lines WHERE reference = ?"
+SQL_SET_STATEMENT_LINE = "UPDATE statement_lines SET status = ?, customer_id = ?, allocation = ?, note = ? WHERE reference = ?"
+SQL_IGNORE_STATEMENT_LINE = "UPDATE statement_lines SET status = 'ignored', note = ? WHERE reference = ? AND status = 'review'"
+
+# ---------- Reminders ----------
+# one pass over open transactions (idx_ct_open); customers already reminded
+# (or being reminded by another run) on :day are flagged rather than dropped
+# so the dispatcher can count them
+# MATERIALIZED: computed once; flattened into the outer query, the correlated
+# balance subqueries would run again for every reference to balance_cents
+SQL_OVERDUE_CUSTOMERS = """
+    WITH t AS MATERIALIZED (
+        SELECT ct.customer_id, ct.date,
+               COALESCE((SELECT SUM(total_price_cents) FROM credit_items WHERE transaction_id = ct.id), 0)
+             - COALESCE((SELECT SUM(amount_cents) FROM payments WHERE transaction_id = ct.id), 0) AS balance_cents
+        FROM credit_transactions ct
+        WHERE ct.status != 'Paid'
+    )
+    SELECT cu.id AS customer_id, cu.name, cu.phone,
+           SUM(t.balance_cents) AS balance_cents,
+           SUM(CASE WHEN t.date <= :cutoff THEN t.balance_cents ELSE 0 END) AS overdue_cents,
+           MIN(t.date) AS oldest_date,
+           EXISTS (SELECT 1 FROM reminders_sent r
+                   WHERE r.customer_id = cu.id AND r.day = :day AND r.status IN ('sent', 'pending')) AS reminded_today
+    FROM t
+    JOIN customers cu ON cu.id = t.customer_id AND cu.deleted_at IS NULL
+    WHERE t.balance_cents > 0
+    GROUP BY cu.id
+    HAVING overdue_cents >= :min_cents
+    ORDER BY overdue_cents DESC
+"""
+# a reminder is claimed before it is sent: a second run the same day gets no
+# row back and skips it; a failed one may be claimed again
+SQL_CLAIM_REMINDER = """
+    INSERT INTO reminders_sent (customer_id, day, status, attempts, balance_cents)
+    VALUES (?, ?, 'pending', 0, ?)
+    ON CONFLICT (customer_id, day) DO UPDATE SET
+        status = 'pending', balance_cents = excluded.balance_cents, error = NULL, sent_at = CURRENT_TIMESTAMP
+    WHERE reminders_sent.status = 'failed'
+"""
+SQL_RECORD_REMINDER = """
+    UPDATE reminders_sent SET status = ?, attempts = attempts + ?, error = ?, sent_at = CURRENT_TIMESTAMP
+    WHERE customer_id = ? AND day = ?
+"""
+SQL_REMINDER_SUMMARY = "SELECT status, COUNT(*) AS customers FROM reminders_sent WHERE day = ? GROUP BY status"
+
+# ---------- Risk scores ----------
+# dates come back as days since 1970-01-01 (-1 if unparseable) so they load straight into int arrays
+SQL_DAY_NUMBER = "COALESCE(CAST(julianday(substr({col}, 1, 10)) - 2440587.5 AS INTEGER), -1)"
+SQL_SCORING_TRANSACTIONS = """
+    SELECT ct.id, ct.customer_id, {day}, COALESCE(t.total_cents, 0)
+    FROM {ct} ct
+    LEFT JOIN (SELECT transaction_id, SUM(total_price_cents) AS total_cents FROM {ci} GROUP BY transaction_id) t
+           ON t.transaction_id = ct.id
+    ORDER BY ct.id
+"""
+SQL_SCORING_PAYMENTS = "SELECT transaction_id, {day}, amount_cents FROM {pay} ORDER BY transaction_id, date, id"
+SQL_CLEAR_SCORES = "DELETE FROM customer_scores"
+SQL_INSERT_SCORE = """
+    INSERT INTO customer_scores (customer_id, avg_days_to_settle, repayment_ratio, overdue_days, velocity_cents,
+                                 score, band, scored_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+SQL_SCORED_AT = "SELECT MAX(scored_at) FROM customer_scores"
+
+
+# ---------- Row helpers ----------
+_record_types = {}
+
+def _record_factory(cursor, row):
+    fields = tuple(col[0] for col in cursor.description)
+    record = _record_types.get(fields)
+    if record is None:
+        record = _record_types[fields] = namedtuple("Record", fields, rename=True)
+    return record._make(row)
+
+def query(sql, params=()):
+    """All rows as namedtuples."""
+    cur = get_connection().cursor()
+    cur.row_factory = _record_factory
+    return cur.execute(sql, params).fetchall()
+
+def query_one(sql, params=()):
+    """First row as a namedtuple, or None."""
+    cur = get_connection().cursor()
+    cur.row_factory = _record_factory
+    return cur.execute(sql, params).fetchone()
+
+def scalar(sql, params=()):
+    row = get_connection().execute(sql, params).fetchone()
+    return row[0] if row else None
+
+def query_df(sql, params=(), conn=None):
+    return pd.read_sql(sql, conn or get_connection(), params=params)
+
+def execute(sql, params=()):
+    """Run one write statement and commit (rolled back on error)."""
+    conn = get_connection()
+    with conn:
+        return conn.execute(sql, params)
+
+
+# ---------- Customers ----------
+def add_customer(name, phone):
+    execute(SQL_INSERT_CUSTOMER, (name, phone))
+
+def fetch_all_customers():
+    return query_df(SQL_ALL_CUSTOMERS)
+
+def fetch_customers():
+    return query_df(SQL_CUSTOMER_NAMES)
+
+def fetch_customer_picker():
+    """Customer names with their latest risk score (NULL until scoring.py has run)."""
+    return query_df(SQL_CUSTOMER_PICKER)
+
+def delete_customer(customer_id):
+    execute(SQL_DELETE_CUSTOMER, (customer_id,))
+
+
+# ---------- Products ----------
+def add_product(name, price_cents):
+    execute(SQL_INSERT_PRODUCT, (name, price_cents))
+
+def fetch_all_products():
+    return query_df(SQL_ALL_PRODUCTS)
+
+def fetch_products():
+    return query_df(SQL_PRODUCT_PRICES)
+
+def delete_product(product_id):
+    execute(SQL_DELETE_PRODUCT, (product_id,))
+
+
+# ---------- Credit limits ----------
+class CreditRefused(Exception):
+    """Credit that must not be written; `reason` is a short code for API clients."""
+    reason = "refused"
+
+
+class CustomerDeleted(CreditRefused):
+    reason = "customer_deleted"
+
+    def __init__(self, customer_id):
+        super().__init__(f"customer #{customer_id} has been deleted")
+
+
+class ProductDeleted(CreditRefused):
+    reason = "product_deleted"
+
+    def __init__(self, product_id):
+        super().__init__(f"product #{product_id} has been deleted")
+
+
+class CreditLimitExceeded(CreditRefused):
+    def __init__(self, reason, attempted_cents, balance_cents, limit_cents):
+        self.reason = reason
+        self.attempted_cents = attempted_cents
+        self.balance_cents = balance_cents
+        self.limit_cents = limit_cents
+        super().__init__(f"{reason}: {format_kshs(attempted_cents)} would take {format_kshs(balance_cents)} "
+                         f"to {format_kshs(balance_cents + attempted_cents)}, over the limit of {format_kshs(limit_cents)}")
+
+
+class BalanceIndex:
+    """
+    Outstanding balance per customer, plus total shop exposure, kept in memory.
+
+    Writes through _ledger_write apply their own deltas; any other write (e.g.
+    from another process) bumps ledger_version and the next sync() reloads
+    customer_balances, which triggers keep current, so the ledger itself is
+    never re-aggregated. Callers hold `lock`.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.version = None
+        self.balances = {}
+        self.exposure = 0
+
+    def sync(self, c):
+        version = c.execute(SQL_LEDGER_VERSION).fetchone()[0]
+        if version != self.version:
+            self.balances = dict(c.execute(SQL_BALANCES_BY_CUSTOMER).fetchall())
+            self.exposure = sum(b for b in self.balances.values() if b > 0)
+            self.version = version
+
+    def apply(self, c, customer_id, delta):
+        old = self.balances.get(customer_id, 0)
+        self.balances[customer_id] = old + delta
+        self.exposure += max(old + delta, 0) - max(old, 0)
+        self.version = c.execute(SQL_LEDGER_VERSION).fetchone()[0]
+
+    def invalidate(self):
+        self.version = None
+
+
+_balances = BalanceIndex()
+
+@contextmanager
+def _ledger_write():
+    """Write transaction for balance-changing writes: holds the index lock and
+    SQLite's write lock (BEGIN IMMEDIATE), so checks and writes see the same
+    balances across sessions and processes."""
+    conn = get_connection()
+    with _balances.lock:
+        try:
+            with conn:
+                c = conn.cursor()
+                c.execute("BEGIN IMMEDIATE")
+                _balances.sync(c)
+                yield c
+        except BaseException:
+            _balances.invalidate()
+            raise
+
+def _refuse_credit(c, customer_id, amount_cents):
+    """A CreditLimitExceeded (logged to credit_blocks) if the credit does not fit, else None."""
+    blocked = _credit_check(c, customer_id, amount_cents)
+    if blocked is None:
+        return None
+    reason, balance, limit = blocked
+    c.execute(SQL_INSERT_CREDIT_BLOCK, (customer_id, amount_cents, balance, limit, reason))
+    return CreditLimitExceeded(reason, amount_cents, balance, limit)
+
+def _credit_check(c, customer_id, amount_cents):
+    """None if the credit fits, else (reason, balance_cents, limit_cents)."""
+    balance = _balances.balances.get(customer_id, 0)
+    limit = c.execute(SQL_CREDIT_LIMIT, (customer_id,)).fetchone()
+    if limit and limit[0] is not None and balance + amount_cents > limit[0]:
+        return "Customer credit limit", balance, limit[0]
+    cap = c.execute(SQL_GET_SETTING, (EXPOSURE_CAP_KEY,)).fetchone()
+    if cap and cap[0] not in (None, ""):
+        exposure = _balances.exposure - max(balance, 0) + max(balance + amount_cents, 0)
+        if exposure > int(cap[0]):
+            return "Shop exposure cap", _balances.exposure, int(cap[0])
+    return None
+
+def fetch_credit_limit(customer_id):
+    return scalar(SQL_CREDIT_LIMIT, (customer_id,))
+
+def set_credit_limit(customer_id, limit_cents):
+    """limit_cents=None removes the limit."""
+    execute(SQL_SET_CREDIT_LIMIT, (limit_cents, customer_id))
+
+def fetch_exposure_cap():
+    value = scalar(SQL_GET_SETTING, (EXPOSURE_CAP_KEY,))
+    return int(value) if value not in (None, "") else None
+
+def set_exposure_cap(cap_cents):
+    """cap_cents=None removes the cap."""
+    execute(SQL_SET_SETTING, (EXPOSURE_CAP_KEY, None if cap_cents is None else str(cap_cents)))
+
+def _stored_policy(c):
+    row = c.execute(SQL_GET_SETTING, (OPEN_TX_POLICY_KEY,)).fetchone()
+    return row[0] if row and row[0] in OPEN_TX_POLICIES else OPEN_TX_POLICY
+
+def fetch_open_tx_policy():
+    """The shop's open transaction policy (see OPEN_TX_POLICIES)."""
+    return _stored_policy(get_connection())
+
+def set_open_tx_policy(policy):
+    if policy not in OPEN_TX_POLICIES:
+        raise ValueError(f"unknown open transaction policy {policy!r}; expected one of {OPEN_TX_POLICIES}")
+    execute(SQL_SET_SETTING, (OPEN_TX_POLICY_KEY, policy))
+
+def fetch_exposure():
+    """Total outstanding across all customers, in cents."""
+    with _balances.lock:
+        _balances.sync(get_connection())
+        return _balances.exposure
+
+def fetch_credit_blocks(limit=50):
+    return query_df(SQL_CREDIT_BLOCKS, (limit,))
+
+
+# ---------- Credit & payments ----------
+def _recalc(c, transaction_id):
+    total_credit = c.execute(SQL_TX_CREDIT_TOTAL, (transaction_id,)).fetchone()[0]
+    total_paid = c.execute(SQL_TX_PAID_TOTAL, (transaction_id,)).fetchone()[0]
+    balance = total_credit - total_paid
+    if balance <= 0:
+        status = 'Paid'
+    elif 0 < total_paid < total_credit:
+        status = 'Partially Paid'
+    else:
+        status = 'Unpaid'
+    c.execute(SQL_SET_TX_STATUS, (status, transaction_id))
+    return balance
+
+# Insert a transaction and items (reuses open transaction)
+def _open_transaction(c, customer_id, lending_date, policy):
+    if policy == "until_paid":
+        row = c.execute(SQL_OPEN_TX_FOR_CUSTOMER, (customer_id,)).fetchone()
+    elif policy == "per_day":
+        row = c.execute(SQL_OPEN_TX_FOR_CUSTOMER_ON, (customer_id, lending_date)).fetchone()
+    elif policy == "new":
+        row = None
+    else:
+        raise ValueError(f"unknown open transaction policy {policy!r}; expected one of {OPEN_TX_POLICIES}")
+    return row
+
+def save_credit_items_for_customer(customer_id, lending_date, items, policy=None):
+    """items: list of dicts with keys product_id, qty, unit_price_cents.
+    policy: see OPEN_TX_POLICIES (default: the stored setting, see set_open_tx_policy).
+
+    Raises CreditLimitExceeded (after logging to credit_blocks) if the cart
+    would take the customer over their limit or the shop over its cap,
+    CustomerDeleted if the customer has been soft-deleted and ProductDeleted
+    if any item's product has been."""
+    with _ledger_write() as c:
+        result = _save_credit(c, customer_id, lending_date, items, policy)
+    if isinstance(result, CreditRefused):
+        raise result
+    return result
+
+def _save_credit(c, customer_id, lending_date, items, policy):
+    """Inside a _ledger_write: the transaction id, or a CreditRefused if the
+    credit was refused (a CreditLimitExceeded is already logged to credit_blocks)."""
+    deleted = c.execute(SQL_CUSTOMER_DELETED, (customer_id,)).fetchone()
+    if deleted and deleted[0]:
+        return CustomerDeleted(customer_id)
+    for product_id in dict.fromkeys(it['product_id'] for it in items):
+        deleted = c.execute(SQL_PRODUCT_DELETED, (product_id,)).fetchone()
+        if deleted and deleted[0]:
+            return ProductDeleted(product_id)
+    policy = policy or _stored_policy(c)
+    rows = [(it['product_id'], it['qty'], it['unit_price_cents'], line_total(it['qty'], it['unit_price_cents']))
+            for it in items]
+    amount = sum(r[3] for r in rows)
+    refused = _refuse_credit(c, customer_id, amount)
+    if refused:
+        return refused
+    row = _open_transaction(c, customer_id, lending_date, policy)
+    if row:
+        tx_id = row[0]
+    else:
+        tx_id = c.execute(SQL_INSERT_TX, (customer_id, lending_date)).lastrowid
+    c.executemany(SQL_INSERT_ITEM, [(tx_id, *r) for r in rows])
+    _recalc(c, tx_id)
+    _balances.apply(c, customer_id, amount)
+    return tx_id
+
+def _load_batch(c, transaction_ids):
+    c.execute("CREATE TEMP TABLE IF NOT EXISTS recalc_batch (id INTEGER PRIMARY KEY)")
+    c.execute("DELETE FROM recalc_batch")
+    c.executemany("INSERT OR IGNORE INTO recalc_batch (id) VALUES (?)", [(t,) for t in transaction_ids])
+
+def _recalc_many(c, transaction_ids):
+    """Set-based _recalc: one UPDATE ... FROM for any number of transactions."""
+    _load_batch(c, transaction_ids)
+    c.execute(SQL_RECALC_BATCH)
+
+def recompute_all_statuses():
+    """Bring every transaction's status in line with its sums. Returns the
+    number of transactions whose status changed."""
+    conn = get_connection()
+    with conn:
+        return conn.execute(SQL_RECALC_ALL).rowcount
+
+def settle_transactions(transaction_ids, payment_date, method="Manual"):
+    """Record a balancing payment for each transaction with a balance and mark
+    them all Paid, in one database transaction. Returns the number of
+    payments written."""
+    with _ledger_write() as c:
+        _load_batch(c, transaction_ids)
+        owing = [(tx, cust, bal) for tx, cust, bal in c.execute(SQL_BATCH_BALANCES).fetchall() if bal > 0]
+        c.executemany(SQL_INSERT_PAYMENT, [(tx, bal, method, payment_date) for tx, _, bal in owing])
+        c.execute(SQL_RECALC_BATCH)
+        by_customer = {}
+        for _, cust, bal in owing:
+            by_customer[cust] = by_customer.get(cust, 0) + bal
+        for cust, paid in by_customer.items():
+            _balances.apply(c, cust, -paid)
+    return len(owing)
+
+# Insert payment and auto-recalc
+def record_payment(transaction_id, amount_cents, method, payment_date):
+    with _ledger_write() as c:
+        return _record_payment(c, transaction_id, amount_cents, method, payment_date)
+
+def _record_payment(c, transaction_id, amount_cents, method, payment_date):
+    pid = c.execute(SQL_INSERT_PAYMENT, (transaction_id, amount_cents, method, payment_date)).lastrowid
+    _recalc(c, transaction_id)
+    row = c.execute(SQL_TX_CUSTOMER, (transaction_id,)).fetchone()
+    if row:
+        _balances.apply(c, row[0], -amount_cents)
+    return pid
+
+def delete_payment(payment_id):
+    """Returns the payment's transaction id, or None if it is gone."""
+    with _ledger_write() as c:
+        row = c.execute(SQL_PAYMENT_TX, (payment_id,)).fetchone()
+        if row is None:
+            return None
+        tid, amount, customer_id = row
+        c.execute(SQL_DELETE_PAYMENT, (payment_id,))
+        _recalc(c, tid)
+        _balances.apply(c, customer_id, amount)
+    return tid
+
+def update_credit_item(item_id, qty, unit_price_cents):
+    """Returns the item's transaction id, or None if it is gone. Raises
+    CreditLimitExceeded (after logging to credit_blocks) if a larger total
+    would take the customer over their limit or the shop over its cap."""
+    with _ledger_write() as c:
+        row = c.execute(SQL_ITEM_TX, (item_id,)).fetchone()
+        if row is None:
+            return None
+        tid, old_total, customer_id = row
+        delta = line_total(qty, unit_price_cents) - old_total
+        refused = _refuse_credit(c, customer_id, delta) if delta > 0 else None
+        if refused is None:
+            c.execute(SQL_UPDATE_ITEM, (qty, unit_price_cents, old_total + delta, item_id))
+            _recalc(c, tid)
+            _balances.apply(c, customer_id, delta)
+    if refused:
+        raise refused
+    return tid
+
+def delete_transaction(transaction_id):
+    """One statement: items and payments go with it through ON DELETE CASCADE."""
+    with _ledger_write() as c:
+        row = c.execute(SQL_TX_BALANCE, (transaction_id,)).fetchone()
+        c.execute(SQL_DELETE_TX, (transaction_id,))
+        if row:
+            _balances.apply(c, row[0], -row[1])
+
+
+# ---------- Payment allocation ----------
+ALLOCATION_METHODS = {
+    "fifo": "Oldest first (FIFO)",
+    "newest_first": "Newest first",
+    "pro_rata": "Pro-rata by balance",
+}
+
+def allocate_amount(amount_cents, open_balances, method="fifo"):
+    """
+    Split a payment across open transactions.
+    open_balances: [(transaction_id, balance_cents), ...] oldest first.
+    Returns [(transaction_id, cents), ...] for the parts that are > 0; the
+    parts always add up to amount_cents exactly.
+    """
+    open_balances = [(tx, bal) for tx, bal in open_balances if bal > 0]
+    total = sum(bal for _, bal in open_balances)
+    if amount_cents <= 0:
+        raise ValueError("payment amount must be positive")
+    if amount_cents > total:
+        raise ValueError(f"payment of {format_kshs(amount_cents)} is more than the {format_kshs(total)} outstanding")
+    if method == "pro_rata":
+        # floor each share, then hand the leftover cents to the largest remainders (oldest wins ties)
+        shares = [divmod(amount_cents * bal, total) for _, bal in open_balances]
+        leftover = amount_cents - sum(q for q, _ in shares)
+        bump = set(sorted(range(len(shares)), key=lambda i: -shares[i][1])[:leftover])
+        parts = [(tx, q + (i in bump)) for i, ((tx, _), (q, _)) in enumerate(zip(open_balances, shares))]
+        return [(tx, cents) for tx, cents in parts if cents > 0]
+    if method == "newest_first":
+        open_balances = open_balances[::-1]
+    elif method != "fifo":
+        raise ValueError(f"unknown allocation method {method!r}; expected one of {tuple(ALLOCATION_METHODS)}")
+    parts, remaining = [], amount_cents
+    for tx, bal in open_balances:
+        if remaining <= 0:
+            break
+        cents = min(bal, remaining)
+        parts.append((tx, cents))
+        remaining -= cents
+    return parts
+
+def pay_customer(customer_id, amount_cents, method, payment_date, allocation="fifo"):
+    """Record one lump-sum payment against a customer's open transactions:
+    all payment rows and status updates commit together. Returns the split."""
+    with _ledger_write() as c:
+        return _pay_customer(c, customer_id, amount_cents, method, payment_date, allocation)
+
+def _pay_customer(c, customer_id, amount_cents, method, payment_date, allocation):
+    open_txs = c.execute(SQL_OPEN_TRANSACTIONS, (customer_id,)).fetchall()
+    parts = allocate_amount(amount_cents, [(r[0], r[2] - r[3]) for r in open_txs], allocation)
+    c.executemany(SQL_INSERT_PAYMENT, [(tx, cents, method, payment_date) for tx, cents in parts])
+    _recalc_many(c, [tx for tx, _ in parts])
+    _balances.apply(c, customer_id, -amount_cents)
+    return parts
+
+
+# ---------- Statement reconciliation ----------
+def _allocation_text(parts):
+    return ",".join(f"{tx}:{cents}" for tx, cents in parts)
+
+def import_statement_lines(lines, plan, method="Mpesa"):
+    """
+    Record statement lines and the payments they match, in one ledger write.
+
+    lines: records with reference, date, amount_cents, phone, details.
+    plan(lines, phone_rows, open_rows) decides each line against the
+    customers' phones and every open transaction's balance, read under the
+    write lock; it returns one (status, customer_id, parts, note) per line,
+    where parts [(transaction_id, cents), ...] are paid for status 'matched'.
+
+    References imported before (or repeated in the file) are skipped.
+    Returns ([(line, decision), ...] for the new lines, duplicates skipped).
+    """
+    with _ledger_write() as c:
+        c.execute("CREATE TEMP TABLE IF NOT EXISTS statement_batch (reference TEXT PRIMARY KEY)")
+        c.execute("DELETE FROM statement_batch")
+        c.executemany("INSERT OR IGNORE INTO statement_batch (reference) VALUES (?)", [(l.reference,) for l in lines])
+        seen = {r for (r,) in c.execute(SQL_KNOWN_STATEMENT_REFS)}
+        fresh = []
+        for line in lines:
+            if line.reference not in seen:
+                seen.add(line.reference)
+                fresh.append(line)
+
+        decisions = plan(fresh, c.execute(SQL_CUSTOMER_PHONES).fetchall(), c.execute(SQL_ALL_OPEN_BALANCES).fetchall())
+        payments, rows, paid = [], [], {}
+        for line, (status, customer_id, parts, note) in zip(fresh, decisions):
+            if status == "matched":
+                payments.extend((tx, cents, method, line.date) for tx, cents in parts)
+                paid[customer_id] = paid.get(customer_id, 0) + line.amount_cents
+            rows.append((line.reference, line.date, line.amount_cents, line.phone, line.details,
+                         status, note, customer_id, _allocation_text(parts) or None))
+        c.executemany(SQL_INSERT_PAYMENT, payments)
+        c.executemany(SQL_INSERT_STATEMENT_LINE, rows)
+        _recalc_many(c, {tx for tx, *_ in payments})
+        for customer_id, cents in paid.items():
+            _balances.apply(c, customer_id, -cents)
+    return list(zip(fresh, decisions)), len(lines) - len(fresh)
+
+def fetch_review_queue(limit=50):
+    return query(SQL_REVIEW_QUEUE, (limit,))
+
+def count_review_queue():
+    return scalar(SQL_REVIEW_COUNT)
+
+def resolve_statement_line(reference, customer_id, method="Mpesa", allocation="fifo"):
+    """Pay a queued line to the chosen customer's open transactions. Raises
+    ValueError if the line is not awaiting review or is more than they owe."""
+    with _ledger_write() as c:
+        line = c.execute(SQL_STATEMENT_LINE, (reference,)).fetchone()
+        if line is None or line[3] != "review":
+            raise ValueError(f"statement line {reference} is not awaiting review")
+        parts = _pay_customer(c, customer_id, line[2], method, line[1], allocation)
+        c.execute(SQL_SET_STATEMENT_LINE, ("resolved", customer_id, _allocation_text(parts), "matched by hand", reference))
+    return parts
+
+def ignore_statement_line(reference, note="ignored by hand"):
+    execute(SQL_IGNORE_STATEMENT_LINE, (note, reference))
+
+
+# ---------- Batched writes ----------
+def _write_batch(scope, records, write_one):
+    """
+    Apply records in a single ledger write, each under its own savepoint so a
+    record that breaks a constraint only undoes itself. A record whose
+    idempotency_key was seen before (within `scope`) gets the stored result
+    back instead of being written twice. Returns one result dict per record.
+    """
+    results = []
+    with _ledger_write() as c:
+        for rec in records:
+            key = rec.get("idempotency_key")
+            if key is not None:
+                seen = c.execute(SQL_IDEMPOTENT_RESPONSE, (scope, key)).fetchone()
+                if seen:
+                    results.append(dict(json.loads(seen[0]), replayed=True))
+                    continue
+            c.execute("SAVEPOINT batch_record")
+            try:
+                result = write_one(c, rec)
+            except sqlite3.IntegrityError as e:
+                c.execute("ROLLBACK TO batch_record")
+                c.execute("RELEASE batch_record")
+                results.append({"ok": False, "error": str(e)})
+                continue
+            if key is not None:
+                c.execute(SQL_SAVE_IDEMPOTENT_RESPONSE, (scope, key, json.dumps(result)))
+            c.execute("RELEASE batch_record")
+            results.append(result)
+    return results
+
+def save_credit_batch(records, policy=None):
+    """records: dicts with customer_id, date, items (as for
+    save_credit_items_for_customer) and an optional idempotency_key.
+    Refused credit is logged and reported per record, not raised."""
+    def write_one(c, rec):
+        result = _save_credit(c, rec["customer_id"], rec["date"], rec["items"], policy)
+        if isinstance(result, CreditRefused):
+            return {"ok": False, "error": str(result), "reason": result.reason}
+        return {"ok": True, "transaction_id": result}
+    return _write_batch("credit", records, write_one)
+
+def record_payment_batch(records):
+    """records: dicts with transaction_id, amount_cents, method, date and an
+    optional idempotency_key."""
+    def write_one(c, rec):
+        pid = _record_payment(c, rec["transaction_id"], rec["amount_cents"], rec["method"], rec["date"])
+        return {"ok": True, "payment_id": pid}
+    return _write_batch("payment", records, write_one)
+
+
+# ---------- Reminders ----------
+def fetch_overdue_customers(overdue_days=30, min_cents=1, day=None):
+    """Customers owing at least min_cents on credit older than overdue_days,
+    most overdue first, flagged if already reminded on `day` (default today)."""
+    day = day or date.today()
+    params = {"cutoff": (day - timedelta(days=overdue_days)).strftime("%Y-%m-%d"),
+              "day": day.strftime("%Y-%m-%d"), "min_cents": min_cents}
+    return query(SQL_OVERDUE_CUSTOMERS, params)
+
+def claim_reminder(customer_id, day, balance_cents):
+    """Mark a reminder as being sent. False if it was already sent, or is being
+    sent by another run, on `day`."""
+    return execute(SQL_CLAIM_REMINDER, (customer_id, day, balance_cents)).rowcount == 1
+
+def record_reminder(customer_id, day, status, attempts, error=None):
+    """Outcome of a claimed reminder ('sent' or 'failed')."""
+    execute(SQL_RECORD_REMINDER, (status, attempts, error, customer_id, day))
+
+def fetch_reminder_summary(day=None):
+    """{status: customers} for reminders on `day` (default today)."""
+    return dict(query(SQL_REMINDER_SUMMARY, ((day or date.today()).strftime("%Y-%m-%d"),)))
+
+
+# ---------- Risk scores ----------
+def fetch_scoring_inputs(include_archived=True):
+    """
+    Two set-based reads for scoring.py: transactions as (id, customer_id, day,
+    total_cents) in id order, and payments as (transaction_id, day, amount_cents)
+    ordered by transaction then date. Days are counted from 1970-01-01.
+    """
+    conn = attach_archive(get_connection()) if include_archived else get_connection()
+    day = SQL_DAY_NUMBER.format(col="ct.date")
+    transactions = conn.execute(SQL_SCORING_TRANSACTIONS.format(
+        day=day, ct=table_source("credit_transactions", include_archived),
+        ci=table_source("credit_items", include_archived))).fetchall()
+    payments = conn.execute(SQL_SCORING_PAYMENTS.format(
+        day=SQL_DAY_NUMBER.format(col="date"), pay=table_source("payments", include_archived))).fetchall()
+    return transactions, payments
+
+def save_customer_scores(rows):
+    """Replace all scores in one transaction. rows: (customer_id, avg_days_to_settle,
+    repayment_ratio, overdue_days, velocity_cents, score, band, scored_at)."""
+    conn = get_connection()
+    with conn:
+        conn.execute(SQL_CLEAR_SCORES)
+        conn.executemany(SQL_INSERT_SCORE, rows)
+
+def fetch_scored_at():
+    """When the scores were last computed ('YYYY-MM-DD HH:MM:SS'), or None."""
+    return scalar(SQL_SCORED_AT)
+
+
+# ---------- Fetchers ----------
+def fetch_grouped_accounts(customer_filter=None, status_filter=None, start_date=None, end_date=None, conn=None):
+    query_sql = SQL_GROUPED_ACCOUNTS
+    params = []
+    if customer_filter and customer_filter != "All":
+        query_sql += " AND cu.name = ?"
+        params.append(customer_filter)
+    if status_filter and status_filter != "All":
+        query_sql += " AND ct.status = ?"
+        params.append(status_filter)
+    if start_date:
+        query_sql += " AND ct.date >= ?"
+        params.append(start_date.strftime("%Y-%m-%d"))
+    if end_date:
+        query_sql += " AND ct.date <= ?"
+        params.append(end_date.strftime("%Y-%m-%d"))
+    query_sql += " ORDER BY ct.date DESC"
+    return query_df(query_sql, params, conn)
+
+def fetch_account(transaction_id):
+    """One row of the grouped view, or None if the transaction is gone."""
+    return query_one(SQL_GROUPED_ACCOUNTS + " AND ct.id = ?", (transaction_id,))
+
+def fetch_customer_balance(customer_id):
+    """Outstanding balance across all of a customer's transactions, in cents
+    (from the in-memory index; a version check, not an aggregate, per call)."""
+    with _balances.lock:
+        _balances.sync(get_connection())
+        return _balances.balances.get(customer_id, 0)
+
+def fetch_balances(customer_ids=None):
+    """{customer_id: balance_cents} for the given customers (default: all with activity)."""
+    with _balances.lock:
+        _balances.sync(get_connection())
+        if customer_ids is None:
+            return dict(_balances.balances)
+        return {cid: _balances.balances.get(cid, 0) for cid in customer_ids}
+
+def fetch_open_transactions(customer_id):
+    df = query_df(SQL_OPEN_TRANSACTIONS, (customer_id,))
+    df["balance_cents"] = df["total_credit_cents"] - df["total_paid_cents"]
+    return df
+
+def fetch_items_with_names(transaction_id):
+    """Items of one transaction as records (a handful of rows; no DataFrame)."""
+    return query(SQL_ITEMS_WITH_NAMES, (transaction_id,))
+
+def fetch_payments(transaction_id):
+    return query(SQL_TX_PAYMENTS, (transaction_id,))
+
+def fetch_payment_history(customer_id, limit=20):
+    return query_df(SQL_PAYMENT_HISTORY, (customer_id, limit))
+
+
+# ---------- Receipt data ----------
+def _receipt_lines(transaction_id):
+    c = get_connection().cursor()
+    items = c.execute(SQL_RECEIPT_ITEMS, (transaction_id,)).fetchall()
+    total_tx = c.execute(SQL_TX_CREDIT_TOTAL, (transaction_id,)).fetchone()[0]
+    total_paid = c.execute(SQL_TX_PAID_TOTAL, (transaction_id,)).fetchone()[0]
+    return items, total_tx, total_paid
+
+def payment_receipt_data(payment_id):
+    """(header, items, total_tx, total_paid) for a payment receipt, or None."""
+    header = query_one(SQL_PAYMENT_RECEIPT, (payment_id,))
+    if not header:
+        return None
+    return (header,) + _receipt_lines(header.transaction_id)
+
+def transaction_receipt_data(transaction_id):
+    """(header, items, total_tx, total_paid) for a transaction invoice, or None."""
+    header = query_one(SQL_TX_RECEIPT, (transaction_id,))
+    if not header:
+        return None
+    return (header,) + _receipt_lines(header.id)
+
+
+# ---------- Product analytics ----------
+def fetch_ledger_version():
+    """Changes whenever items or payments change; a cheap cache key."""
+    return scalar(SQL_LEDGER_VERSION)
+
+def fetch_products_version():
+    """Changes whenever a product is added, edited or deleted."""
+    return scalar(SQL_PRODUCTS_VERSION)
+
+def fetch_product_stats(start, end):
+    """Per-product units, value, average quantity per transaction and how often
+    the lent price differed from the list price, for transactions dated in
+    [start, end). Sorted by value lent."""
+    df = query_df(SQL_PRODUCT_STATS, {"start": start, "end": end})
+    df["avg_qty"] = (df["units"] / df["transactions"]).round(2)
+    df["override_rate"] = (df["overrides"] / df["lines"]).round(3)
+    return df.sort_values("value_cents", ascending=False, ignore_index=True)
+
+
+# ---------- Trends ----------
+def fetch_daily_rollups():
+    """Pre-aggregated credit issued / collected per day (see database.create_rollups)."""
+    return query_df(SQL_DAILY_ROLLUPS)
+
+
+# ---------- Statements ----------
+def statement_entries(bounds, include_archived=False):
+    """SELECTs of one customer's statement lines matching `bounds` (a condition
+    on {date}), one per table and schema."""
+    schemas = ("main", "archive") if include_archived else ("main",)
+    return [sql.format(schema=schema, bounds=bounds.format(date=date))
+            for schema in schemas
+            for sql, date in ((SQL_STATEMENT_CREDITS, "ct.date"), (SQL_STATEMENT_PAYMENTS, "pay.date"))]
+
+def _statement_connection(include_archived):
+    conn = get_connection()
+    return attach_archive(conn) if include_archived else conn
+
+def fetch_statement_summary(customer_id, start, end, include_archived=False):
+    """
+    Opening balance before `start` plus debits/credits within [start, end) (all in cents).
+    The opening balance is the customer's current balance (BalanceIndex) less
+    everything dated from `start` on, so only rows since `start` are read, not
+    the history before it. Archived transactions are settled and add nothing
+    to the current balance, with or without include_archived.
+    """
+    conn = _statement_connection(include_archived)
+    with _balances.lock, conn:
+        conn.execute("BEGIN")       # the balance and the rows since `start` come from one read snapshot
+        _balances.sync(conn)
+        balance = _balances.balances.get(customer_id, 0)
+        entries = " UNION ALL ".join(statement_entries("{date} >= :start", include_archived))
+        since, debits, credits = conn.execute(
+            SQL_STATEMENT_SUMMARY.format(entries=entries),
+            {"customer_id": customer_id, "start": start, "end": end}).fetchone()
+    opening = balance - since
+    return {"opening": opening, "debits": debits, "credits": credits, "closing": opening + debits - credits}
+
+def fetch_statement_page(customer_id, start, end, cursor, limit=50, include_archived=False):
+    """
+    One page of statement lines after `cursor` = (date, kind, id, balance_cents).
+    Each source is read from its (customer_id, date) index starting at the
+    cursor and stops after `limit` rows, and the running balance is a window
+    SUM seeded with the cursor's balance, so a page costs the same however
+    old the account is.
+    """
+    after_date, after_kind, after_id, balance = cursor
+    conn = _statement_connection(include_archived)
+    parts = " UNION ALL ".join(
+        f"SELECT * FROM ({SQL_STATEMENT_PAGE_PART.format(entries=entries)})"
+        for entries in statement_entries("{date} >= :start AND {date} >= :after_date AND {date} < :end", include_archived))
+    return query_df(SQL_STATEMENT_PAGE.format(parts=parts), {
+        "customer_id": customer_id, "start": start, "end": end, "balance": balance,
+        "after_date": after_date, "after_kind": after_kind, "after_id": after_id, "limit": limit,
+    }, conn=conn)
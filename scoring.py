@@ -0,0 +1,208 @@
+"""
+Repayment-behaviour risk scores.
+
+Each customer with credit is profiled from their whole history (archive included):
+
+    avg_days_to_settle  days from lending to the payment that cleared it (settled credit only)
+    repayment_ratio     share of everything lent that has been paid back
+    overdue_days        days the oldest unpaid credit is past TERMS_DAYS
+    velocity_cents      credit taken in the last VELOCITY_DAYS
+
+and given a 0-100 score and a band. Transactions and payments are read with two
+queries and every customer is scored at once with array operations (sorts,
+bincounts, reduceats), so 100k customers take seconds. Results replace the
+customer_scores table. Run it nightly, e.g. from cron:
+
+    python scoring.py
+    python scoring.py --bench 100000      # time the scoring pass on synthetic data
+"""
+import argparse
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+from database import init_db
+from repository import fetch_scoring_inputs, save_customer_scores
+
+TERMS_DAYS = 30         # credit is due this long after it is given
+VELOCITY_DAYS = 30
+# points each part adds at its worst; they sum to 100
+WEIGHTS = {"overdue": 45, "shortfall": 20, "slow": 20, "surge": 15}
+HIGH_RISK_SCORE, MEDIUM_RISK_SCORE = 50, 25
+BAND_ICONS = {"Low": "🟢", "Medium": "🟡", "High": "🔴"}
+EPOCH = date(1970, 1, 1)
+
+
+def risk_label(band, score):
+    """'🔴 High (72)', or '' for a customer not scored yet."""
+    if not isinstance(band, str):
+        return ""
+    return f"{BAND_ICONS.get(band, '')} {band} ({int(score)})"
+
+
+# ---------- Array helpers ----------
+def _group_starts(sorted_groups):
+    """Index where each run of equal values begins."""
+    return np.flatnonzero(np.r_[True, sorted_groups[1:] != sorted_groups[:-1]])
+
+def _group_min(groups, values, n):
+    """Smallest value per group 0..n-1; groups without values get the dtype's max."""
+    out = np.full(n, np.iinfo(values.dtype).max, dtype=values.dtype)
+    if len(groups):
+        order = np.argsort(groups, kind="stable")
+        g = groups[order]
+        starts = _group_starts(g)
+        out[g[starts]] = np.minimum.reduceat(values[order], starts)
+    return out
+
+def settle_days(tx_total, pay_tx, pay_day, pay_amount):
+    """
+    Day each transaction was paid in full, or -1: the first payment at which
+    its running total reaches the transaction total. pay_tx holds transaction
+    positions, sorted, with each transaction's payments in date order.
+    """
+    settled = np.full(len(tx_total), -1, dtype=np.int64)
+    if len(pay_tx):
+        running = np.cumsum(pay_amount)
+        starts = _group_starts(pay_tx)
+        group = np.cumsum(np.r_[True, pay_tx[1:] != pay_tx[:-1]]) - 1
+        running -= (running[starts] - pay_amount[starts])[group]     # restart the sum per transaction
+        reached = running >= tx_total[pay_tx]
+        txs, first = np.unique(pay_tx[reached], return_index=True)
+        settled[txs] = pay_day[reached][first]
+    return settled
+
+
+# ---------- Scoring ----------
+def compute_scores(transactions, payments, today=None):
+    """
+    Score every customer in `transactions`. Inputs are as fetch_scoring_inputs
+    returns them. Returns a dict of equal-length arrays keyed by customer_scores
+    column (avg_days_to_settle is NaN where nothing has been settled yet).
+    """
+    today = ((today or date.today()) - EPOCH).days
+    tx = np.array(transactions, dtype=np.int64).reshape(-1, 4)
+    tx = tx[(tx[:, 3] > 0) & (tx[:, 2] >= 0)]      # empty or undated credit says nothing about repayment
+    tx_id, tx_customer, tx_day, tx_total = tx.T
+    n = len(tx_id)
+
+    pay = np.array(payments, dtype=np.int64).reshape(-1, 3)
+    pos = np.searchsorted(tx_id, pay[:, 0])
+    known = pos < n
+    known[known] = tx_id[pos[known]] == pay[known, 0]
+    pay_tx, pay_day, pay_amount = pos[known], pay[known, 1], pay[known, 2]
+
+    paid = np.bincount(pay_tx, weights=pay_amount, minlength=n).astype(np.int64)
+    settled_day = settle_days(tx_total, pay_tx, pay_day, pay_amount)
+
+    customer_id, cust = np.unique(tx_customer, return_inverse=True)
+    m = len(customer_id)
+    repaid_tx = np.minimum(paid, tx_total)
+    lent = np.bincount(cust, weights=tx_total, minlength=m)
+    ratio = np.bincount(cust, weights=repaid_tx, minlength=m) / np.maximum(lent, 1)
+    # the score only holds credit past its terms against the customer
+    due = tx_day <= today - TERMS_DAYS
+    due_lent = np.bincount(cust[due], weights=tx_total[due], minlength=m)
+    due_repaid = np.bincount(cust[due], weights=repaid_tx[due], minlength=m)
+    shortfall = np.where(due_lent > 0, 1 - due_repaid / np.maximum(due_lent, 1), 0)
+
+    done = settled_day >= 0
+    settle_total = np.bincount(cust[done], weights=np.maximum(settled_day - tx_day, 0)[done], minlength=m)
+    settle_count = np.bincount(cust[done], minlength=m)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_days = settle_total / settle_count
+
+    unpaid = paid < tx_total
+    oldest_unpaid = _group_min(cust[unpaid], tx_day[unpaid], m)
+    owing = np.bincount(cust[unpaid], minlength=m) > 0
+    overdue = np.where(owing, np.maximum(today - oldest_unpaid - TERMS_DAYS, 0), 0)
+
+    recent = tx_day > today - VELOCITY_DAYS
+    velocity = np.bincount(cust[recent], weights=tx_total[recent], minlength=m)
+    # credit usually taken per VELOCITY_DAYS since the customer's first credit
+    usual = lent * VELOCITY_DAYS / np.maximum(today - _group_min(cust, tx_day, m) + 1, VELOCITY_DAYS)
+    surge = velocity / np.maximum(usual, 1)
+
+    points = (WEIGHTS["overdue"] * np.clip(overdue / (2 * TERMS_DAYS), 0, 1)
+              + WEIGHTS["shortfall"] * np.clip(shortfall, 0, 1)
+              + WEIGHTS["slow"] * np.clip(np.nan_to_num(avg_days) / (2 * TERMS_DAYS), 0, 1)
+              + WEIGHTS["surge"] * np.clip((surge - 1) / 2, 0, 1))
+    score = np.rint(points).astype(np.int64)
+    band = np.select([score >= HIGH_RISK_SCORE, score >= MEDIUM_RISK_SCORE], ["High", "Medium"], "Low")
+    return {
+        "customer_id": customer_id,
+        "avg_days_to_settle": np.round(avg_days, 1),
+        "repayment_ratio": np.round(ratio, 4),
+        "overdue_days": overdue.astype(np.int64),
+        "velocity_cents": velocity.astype(np.int64),
+        "score": score,
+        "band": band,
+    }
+
+
+def score_rows(scores, scored_at):
+    """customer_scores rows from compute_scores output."""
+    avg = [None if d != d else d for d in scores["avg_days_to_settle"].tolist()]   # NaN -> NULL
+    return list(zip(scores["customer_id"].tolist(), avg, scores["repayment_ratio"].tolist(),
+                    scores["overdue_days"].tolist(), scores["velocity_cents"].tolist(),
+                    scores["score"].tolist(), scores["band"].tolist(), [scored_at] * len(avg)))
+
+
+def run_scoring(include_archived=True, today=None):
+    """Load, score and store every customer. Returns timings and band counts."""
+    t0 = time.perf_counter()
+    transactions, payments = fetch_scoring_inputs(include_archived)
+    t1 = time.perf_counter()
+    scores = compute_scores(transactions, payments, today)
+    t2 = time.perf_counter()
+    save_customer_scores(score_rows(scores, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    t3 = time.perf_counter()
+    bands, counts = np.unique(scores["band"], return_counts=True)
+    return {
+        "customers": len(scores["customer_id"]), "transactions": len(transactions), "payments": len(payments),
+        "load_s": t1 - t0, "score_s": t2 - t1, "save_s": t3 - t2,
+        "bands": dict(zip(bands.tolist(), counts.tolist())),
+    }
+
+
+def synthetic_inputs(customers, tx_per_customer=10, days=730, seed=1):
+    """Random transactions and payments shaped like fetch_scoring_inputs output, for --bench."""
+    rng = np.random.default_rng(seed)
+    today = (date.today() - EPOCH).days
+    n = customers * tx_per_customer
+    tx = np.column_stack([np.arange(1, n + 1), rng.integers(1, customers + 1, n),
+                          today - rng.integers(0, days, n), rng.integers(1, 500, n) * 100])
+    tx = tx[np.argsort(tx[:, 2], kind="stable")]
+    tx[:, 0] = np.arange(1, n + 1)      # ids follow dates, as when credit is recorded day by day
+    paying = rng.random(n) < 0.8
+    first = np.column_stack([tx[paying, 0], np.minimum(tx[paying, 2] + rng.integers(0, 60, paying.sum()), today),
+                             tx[paying, 3] // 2])
+    second = first.copy()
+    second[:, 1] = np.minimum(second[:, 1] + rng.integers(0, 30, len(second)), today)
+    second[:, 2] = np.where(rng.random(len(second)) < 0.7, tx[paying, 3] - first[:, 2], 0)
+    pay = np.concatenate([first, second[second[:, 2] > 0]])
+    pay = pay[np.lexsort((pay[:, 1], pay[:, 0]))]
+    return tx, pay
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score every customer's repayment behaviour.")
+    parser.add_argument("--hot-only", action="store_true", help="leave archived (settled) history out")
+    parser.add_argument("--bench", type=int, metavar="CUSTOMERS",
+                        help="time the scoring pass on synthetic data; the database is not touched")
+    args = parser.parse_args()
+
+    if args.bench:
+        transactions, payments = synthetic_inputs(args.bench)
+        t0 = time.perf_counter()
+        scores = compute_scores(transactions, payments)
+        rows = score_rows(scores, "bench")
+        print(f"{len(rows):,} customers, {len(transactions):,} transactions, {len(payments):,} payments "
+              f"scored in {time.perf_counter() - t0:.2f} s")
+    else:
+        init_db()
+        r = run_scoring(include_archived=not args.hot_only)
+        print(f"{r['customers']:,} customers from {r['transactions']:,} transactions and {r['payments']:,} payments")
+        print(f"load {r['load_s']:.2f} s, score {r['score_s']:.2f} s, save {r['save_s']:.2f} s")
+        print("bands: " + ", ".join(f"{band} {count:,}" for band, count in sorted(r["bands"].items())))
@@ -0,0 +1,107 @@
+"""
+Cold-start import benchmark for Home.py and the pages.
+
+Each script's top-level imports run in a fresh interpreter under
+`python -X importtime`. The figure reported is what the script adds on top of
+`import streamlit`, which every page pays and we cannot shrink. The best of
+--repeat runs is used, so the OS file cache is warm, as after an app restart.
+
+    python startup_bench.py               # table, heaviest imports per script
+    python startup_bench.py --check       # exit 1 if any script breaks the budget
+
+Budget: STARTUP_BUDGET_MS per script (DEFAULT_BUDGET_MS otherwise), with room
+for pandas (~400-550 ms here), which every page that reads the ledger needs.
+Timings are noisy, so --check also fails, deterministically, if a script
+loads any of LAZY_ONLY at startup: PDF and Excel libraries are imported where
+a receipt or export is made, not at module top.
+"""
+import argparse
+import ast
+import glob
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+BASELINE = "streamlit"
+DEFAULT_BUDGET_MS = 650
+STARTUP_BUDGET_MS = {
+    "Home.py": 150,
+    "pages/2_📦_Products.py": 800,     # plotly.express draws the product charts on load
+    "pages/6_📈_Trends.py": 800,       # plotly.express draws the trend charts on load
+}
+LAZY_ONLY = {"reportlab", "fpdf", "openpyxl"}
+
+
+def scripts():
+    return ["Home.py"] + sorted(os.path.relpath(p, ROOT) for p in glob.glob(os.path.join(ROOT, "pages", "*.py")))
+
+def import_source(path):
+    """The script's module-level import statements (including any inside a
+    top-level try/if), as source to run on their own."""
+    with open(os.path.join(ROOT, path), encoding="utf-8") as f:
+        source = f.read()
+    statements = []
+    for node in ast.parse(source).body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)) or (
+                isinstance(node, (ast.Try, ast.If))
+                and any(isinstance(n, (ast.Import, ast.ImportFrom)) for n in ast.walk(node))):
+            statements.append(ast.get_source_segment(source, node))
+    return "\n".join(statements)
+
+def parse_importtime(stderr):
+    """[(module, cumulative_us)] for top-level imports after the baseline."""
+    found, after_baseline = [], False
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if name.startswith("  "):   # nested import, already inside its parent's cumulative time
+            continue
+        name = name.strip()
+        if after_baseline:
+            found.append((name, int(cumulative)))
+        elif name == BASELINE:
+            after_baseline = True
+    return found
+
+def measure(path, repeat=3):
+    """(best total ms beyond streamlit, [(module, ms)] heaviest first for that
+    run, LAZY_ONLY packages that were loaded)."""
+    code = (f"import {BASELINE}\n" + import_source(path)
+            + "\nimport sys\nprint(' '.join({m.partition('.')[0] for m in sys.modules}))")
+    best = None
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT,
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"{path}: imports failed\n{proc.stderr.strip().splitlines()[-1]}")
+        modules = parse_importtime(proc.stderr)
+        total = sum(us for _, us in modules) / 1000
+        if best is None or total < best[0]:
+            best = (total, sorted(((m, us / 1000) for m, us in modules), key=lambda x: -x[1]),
+                    sorted(LAZY_ONLY & set(proc.stdout.split())))
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the import cost of each Streamlit script.")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per script; the best is kept")
+    parser.add_argument("--top", type=int, default=3, help="heaviest imports to list per script")
+    parser.add_argument("--check", action="store_true",
+                        help="exit 1 if any script is over its budget or loads a lazy-only package")
+    args = parser.parse_args()
+
+    over = []
+    print(f"{'script':<36} {'imports':>9} {'budget':>8}  heaviest (ms, beyond {BASELINE})")
+    for path in scripts():
+        total, modules, eager = measure(path, args.repeat)
+        budget = STARTUP_BUDGET_MS.get(path, DEFAULT_BUDGET_MS)
+        heaviest = ", ".join(f"{m} {ms:.0f}" for m, ms in modules[:args.top])
+        flags = ("  OVER" if total > budget else "") + (f"  loads {', '.join(eager)}" if eager else "")
+        print(f"{path:<36} {total:>7.0f}ms {budget:>6}ms  {heaviest}{flags}")
+        if flags:
+            over.append(path)
+    if args.check and over:
+        print(f"cold-start budget broken by: {', '.join(over)}")
+        sys.exit(1)
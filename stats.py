@@ -0,0 +1,9 @@
+"""Small statistics helpers shared by the benchmarks and load tests."""
+
+
+def percentile(values, pct):
+    """Nearest-rank `pct` percentile of `values` (0.0 when there are none)."""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]